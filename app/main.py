@@ -1,13 +1,17 @@
 from pathlib import Path
 
-from fastapi import FastAPI, File, Form, UploadFile, HTTPException
-from fastapi.responses import FileResponse
-from fastapi.staticfiles import StaticFiles
+from contextlib import asynccontextmanager
+from fastapi import FastAPI, File, Form, Header, UploadFile, HTTPException
+from fastapi.responses import FileResponse, JSONResponse, Response, StreamingResponse
+from starlette.concurrency import run_in_threadpool
+from app.services.storage import ShardedStaticFiles, StorageManager
+import asyncio
 import uuid
 import time
 import os
-from io import BytesIO
-from PIL import Image
+import shutil
+import zipfile
+from typing import List, Optional
 
 APP_TITLE = "Book Screenshot Extraction API"
 APP_VERSION = "0.1.0"
@@ -15,22 +19,194 @@ APP_VERSION = "0.1.0"
 # Resolve openapi.yaml from project root (mounted into container)
 SPEC_PATH = Path(__file__).resolve().parents[1] / "openapi.yaml"
 OUTPUT_DIR = Path(os.getenv("OUTPUT_DIR", "/shared_outputs")).resolve()
+# Inference runs on a dedicated pool: ENGINE_WORKERS calls at once, plus up to
+# ENGINE_QUEUE_SIZE waiting; beyond that /extract answers 503 with Retry-After.
+# ENGINE_MODE=process runs each worker in its own process; ENGINE_THREADS caps
+# the CPU threads (OMP/MKL) each worker uses. ENGINE_MODE=remote runs nothing
+# here and sends every page to worker nodes instead (see WORK_QUEUE_* below).
+ENGINE_MODE = os.getenv("ENGINE_MODE", "thread")
+ENGINE_WORKERS = int(os.getenv("ENGINE_WORKERS", "1"))
+ENGINE_QUEUE_SIZE = int(os.getenv("ENGINE_QUEUE_SIZE", "8"))
+ENGINE_THREADS = int(os.getenv("ENGINE_THREADS", "0")) or None
+# Models and CPU settings of the engines: accurate, balanced or fast (see
+# app.services.inference_profiles). Without ENGINE_THREADS, the oneDNN
+# profiles share the machine's cores between the workers.
+INFERENCE_PROFILE = os.getenv("INFERENCE_PROFILE", "accurate").lower()
+# Results are cached by image content + options: RESULT_CACHE_SIZE entries in
+# memory (0 disables), plus RESULT_CACHE_DISK_MB on disk under OUTPUT_DIR/_cache
+RESULT_CACHE_SIZE = int(os.getenv("RESULT_CACHE_SIZE", "256"))
+RESULT_CACHE_TTL = int(os.getenv("RESULT_CACHE_TTL", "86400"))
+RESULT_CACHE_DISK_MB = int(os.getenv("RESULT_CACHE_DISK_MB", "0"))
+# Text regions seen before (running headers, footers, boilerplate) reuse their
+# OCR results from a cache shared by all engine workers: up to REGION_CACHE_MB
+# (0 disables) and REGION_CACHE_ENTRIES regions in OUTPUT_DIR/_cache/regions.sqlite3
+REGION_CACHE_MB = int(os.getenv("REGION_CACHE_MB", "0"))
+REGION_CACHE_ENTRIES = int(os.getenv("REGION_CACHE_ENTRIES", "100000"))
+# Limits for /extract/batch (pages per request, uncompressed bytes per zip).
+# BATCH_MAX_MB also caps the whole request body of /extract/batch and /jobs.
+BATCH_MAX_PAGES = int(os.getenv("BATCH_MAX_PAGES", "500"))
+BATCH_MAX_BYTES = int(os.getenv("BATCH_MAX_MB", "512")) * 1024 * 1024
+# Image uploads over UPLOAD_MAX_MB are rejected (413); an /extract request
+# declaring a larger body is refused before any of it is read
+UPLOAD_MAX_BYTES = int(float(os.getenv("UPLOAD_MAX_MB", "64")) * 1024 * 1024)
+# Allowance for form fields and multipart framing on top of the file limits
+FORM_OVERHEAD_BYTES = 64 * 1024
+# Background jobs (POST /jobs): pages extracted concurrently across all jobs
+JOB_CONCURRENCY = int(os.getenv("JOB_CONCURRENCY", "2"))
+# Uploads with more pixels than this are rejected (413) from their header alone,
+# before anything is decompressed
+IMAGE_MAX_PIXELS = int(float(os.getenv("IMAGE_MAX_MEGAPIXELS", "100")) * 1_000_000)
+# Large pages are downscaled before inference: to at most IMAGE_MAX_SIDE pixels
+# on the long side, and further until the estimated text height is about
+# IMAGE_TARGET_TEXT_PX. Results are reported in original-image coordinates.
+IMAGE_MAX_SIDE = int(os.getenv("IMAGE_MAX_SIDE", "2560"))
+IMAGE_TARGET_TEXT_PX = int(os.getenv("IMAGE_TARGET_TEXT_PX", "32"))
+# Pages still larger than IMAGE_TILE_SIZE pixels after that text-driven
+# downscaling (600 dpi scans, two-page spreads) run as tiles overlapping by
+# IMAGE_TILE_OVERLAP pixels, in parallel on the engine pool, instead of being
+# shrunk to IMAGE_MAX_SIDE. 0 disables tiling.
+IMAGE_TILE_SIZE = int(os.getenv("IMAGE_TILE_SIZE", "0"))
+IMAGE_TILE_OVERLAP = int(os.getenv("IMAGE_TILE_OVERLAP", "256"))
+# Tiled pages are decoded in the API process and held there until their
+# tiles are merged; at most IMAGE_TILED_PAGES of them at a time (the others
+# wait, or are refused with 503 like a full queue)
+IMAGE_TILED_PAGES = int(os.getenv("IMAGE_TILED_PAGES", "2"))
+# Look at each page before inference and skip the engines on blank pages
+# (empty result) and figure-only pages (one figure). Requests can override it
+# with the `triage` form field.
+PAGE_TRIAGE = os.getenv("PAGE_TRIAGE", "false").lower() in ("1", "true", "yes")
+# /extract and /extract/batch bodies of at least this many bytes are sent
+# compressed (brotli or gzip) to clients that accept it. 0 disables.
+RESPONSE_COMPRESS_MIN_BYTES = int(os.getenv("RESPONSE_COMPRESS_MIN_BYTES", "8192"))
+# Split layout/detection from text recognition, which then runs in batches of up
+# to REC_BATCH_SIZE line crops, merging pages that arrive within REC_BATCH_WAIT_MS
+ENGINE_PIPELINE = os.getenv("ENGINE_PIPELINE", "false").lower() in ("1", "true", "yes")
+REC_BATCH_SIZE = int(os.getenv("REC_BATCH_SIZE", "32"))
+REC_BATCH_WAIT_MS = float(os.getenv("REC_BATCH_WAIT_MS", "5"))
+# Outputs (input copy, figure crops, annotated preview) are written in the
+# background by ARTIFACT_WORKERS threads per process. Images are stored as
+# ARTIFACT_FORMAT (png, jpeg or webp) at ARTIFACT_QUALITY (jpeg/webp, 1-100) or
+# ARTIFACT_PNG_COMPRESSION (0-9)
+ARTIFACT_FORMAT = os.getenv("ARTIFACT_FORMAT", "png").lower()
+ARTIFACT_QUALITY = int(os.getenv("ARTIFACT_QUALITY", "90"))
+ARTIFACT_PNG_COMPRESSION = int(os.getenv("ARTIFACT_PNG_COMPRESSION", "3"))
+ARTIFACT_WORKERS = int(os.getenv("ARTIFACT_WORKERS", "4"))
+# PDF exports wait up to PDF_FIGURE_WAIT_S for figure crops still being written
+PDF_FIGURE_WAIT_S = float(os.getenv("PDF_FIGURE_WAIT_S", "10"))
+# Searchable PDFs (pdf_mode=searchable) embed JPEG uploads as they are, unless
+# PDF_RECOMPRESS_IMAGES; other page images are encoded at PDF_IMAGE_QUALITY
+PDF_IMAGE_QUALITY = int(os.getenv("PDF_IMAGE_QUALITY", "85"))
+PDF_RECOMPRESS_IMAGES = os.getenv("PDF_RECOMPRESS_IMAGES", "false").lower() == "true"
+# Stored outputs are removed OUTPUT_TTL_HOURS after they were written (0 keeps
+# them) and, oldest first, while they take more than OUTPUT_MAX_GB (0 = no
+# quota). The sweeper runs every OUTPUT_SWEEP_INTERVAL_S seconds.
+OUTPUT_TTL_HOURS = float(os.getenv("OUTPUT_TTL_HOURS", "168"))
+OUTPUT_MAX_BYTES = int(float(os.getenv("OUTPUT_MAX_GB", "0")) * 1024 ** 3)
+OUTPUT_SWEEP_INTERVAL_S = float(os.getenv("OUTPUT_SWEEP_INTERVAL_S", "300"))
+# Identical uploads are stored once and hardlinked into each request directory
+OUTPUT_DEDUPE_INPUTS = os.getenv("OUTPUT_DEDUPE_INPUTS", "true").lower() in ("1", "true", "yes")
+# Let clients send `X-Profile: true` to get a cProfile dump of the inference of
+# their page under OUTPUT_DIR/<request_id>/profile.prof
+ALLOW_PROFILING = os.getenv("ALLOW_PROFILING", "false").lower() in ("1", "true", "yes")
+# Worker fleet: nodes with ENGINE_MODE=remote put their pages in a work queue,
+# a SQLite database on the shared volume (WORK_QUEUE_PATH); nodes with
+# WORK_QUEUE_WORKER take them out and run them on their own engine pool,
+# ENGINE_WORKERS at a time, writing outputs to the shared OUTPUT_DIR. A page
+# whose worker node misses heartbeats for WORK_QUEUE_LEASE_S goes to another
+# one, at most WORK_QUEUE_MAX_ATTEMPTS times.
+WORK_QUEUE_PATH = Path(os.getenv("WORK_QUEUE_PATH", str(OUTPUT_DIR / "_queue" / "tasks.sqlite3")))
+WORK_QUEUE_WORKER = os.getenv("WORK_QUEUE_WORKER", "false").lower() in ("1", "true", "yes")
+WORK_QUEUE_LEASE_S = float(os.getenv("WORK_QUEUE_LEASE_S", "30"))
+WORK_QUEUE_MAX_ATTEMPTS = int(os.getenv("WORK_QUEUE_MAX_ATTEMPTS", "3"))
+# Load and warm every engine worker at startup; /ready reports 503 until done
+ENGINE_WARMUP = os.getenv("ENGINE_WARMUP", "true").lower() in ("1", "true", "yes")
+
+# Warm-up state reported by /ready
+readiness = {"status": "warming", "load_ms": None, "workers": [], "error": None}
+
+async def warm_up_engines():
+    t_start = time.perf_counter()
+    try:
+        readiness["workers"] = await engine_pool.warmup()
+    except Exception as e:
+        print(f"Engine warm-up failed: {e}")
+        readiness.update(status="failed", error=str(e))
+        return
+    readiness.update(status="ready", load_ms=int((time.perf_counter() - t_start) * 1000))
+
+async def serve_work_queue(warmup_task):
+    # A worker node takes work once its engines are warm
+    if warmup_task is not None:
+        await warmup_task
+    if readiness["status"] == "ready":
+        queue_consumer.report = readiness["workers"]
+        await queue_consumer.start()
+
+async def sweep_outputs():
+    while True:
+        try:
+            await asyncio.to_thread(storage.sweep)
+        except Exception as e:
+            print(f"Output sweep failed: {e}")
+        await asyncio.sleep(OUTPUT_SWEEP_INTERVAL_S)
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # Warm up in the background so /health answers while models load
+    warmup_task = None
+    if ENGINE_WARMUP:
+        warmup_task = asyncio.create_task(warm_up_engines())
+    else:
+        readiness["status"] = "ready"
+    # Worker nodes get no requests, so they leave the API nodes' jobs to them
+    consumer_task = None
+    if queue_consumer is not None:
+        consumer_task = asyncio.create_task(serve_work_queue(warmup_task))
+    else:
+        await job_manager.start()
+    sweeper_task = None
+    if OUTPUT_TTL_HOURS or OUTPUT_MAX_BYTES:
+        sweeper_task = asyncio.create_task(sweep_outputs())
+    yield
+    if consumer_task is not None:
+        consumer_task.cancel()
+        await queue_consumer.stop()
+    await job_manager.stop()
+    if warmup_task is not None:
+        warmup_task.cancel()
+    if sweeper_task is not None:
+        sweeper_task.cancel()
+    engine_pool.shutdown(wait=False)
+    artifact_writer.shutdown(wait=True)
 
 app = FastAPI(
     title=APP_TITLE,
     version=APP_VERSION,
     description="Contract-first backend. Spec is served at /openapi.yaml",
+    lifespan=lifespan,
 )
 
 # Ensure the output directory exists
 OUTPUT_DIR.mkdir(parents=True, exist_ok=True)
 
-app.mount("/outputs", StaticFiles(directory=str(OUTPUT_DIR)), name="outputs")
+storage = StorageManager(
+    OUTPUT_DIR,
+    ttl_s=OUTPUT_TTL_HOURS * 3600,
+    max_bytes=OUTPUT_MAX_BYTES,
+    dedupe_inputs=OUTPUT_DEDUPE_INPUTS,
+    protect=lambda request_id: job_manager.is_active(request_id),
+)
+
+app.mount("/outputs", ShardedStaticFiles(storage), name="outputs")
 
 @app.get("/health", tags=["system"])
 def health():
     return {"status": "ok"}
 
+@app.get("/ready", tags=["system"])
+def ready():
+    return JSONResponse(readiness, status_code=200 if readiness["status"] == "ready" else 503)
+
 @app.get("/openapi.yaml", include_in_schema=False)
 def openapi_yaml():
     if not SPEC_PATH.exists():
@@ -42,67 +218,747 @@ def openapi_yaml():
         filename="openapi.yaml",
     )
 
-from app.services.pdf_service import get_pdf_service
-from app.services.extraction import get_extraction_service
+from app.services.pdf_service import PDF_MODES, get_pdf_service
+from app.services.engine_pool import create_engine_pool, QueueFullError
+from app.services.result_cache import ResultCache
+from app.services.batch import BatchTooLargeError, is_zip_upload, read_zip_pages
+from app.services.jobs import JobManager
+from app.services.artifacts import artifact_status, get_artifact_writer
+from app.services.image_ingest import ImageTooLargeError, InvalidImageError, decode_image, probe_image, resize_image
+from app.services.extraction import region_events, triaged_events
+from app.services.tiling import plan_inference, plan_tiles, run_tiles
+from app.services.triage import triage_page
+from app.services.uploads import BodySizeLimitMiddleware, UploadTooLargeError, read_upload
+from app.services.inference_profiles import profile_threads
+from app.services.work_queue import QueueConsumer, WorkQueue, options_key
+from app.services.engines import EngineUnavailableError, UnknownEngineError, check_available, resolve_engines
+from app.services import metrics
+from app.services.streaming import collect_page, encode_event, negotiate_stream_format, page_events
+from app.services.serialization import InvalidFieldsError, parse_fields, render, shape_events, shape_page
+
+# Server-wide settings that change extraction results; part of every cache key
+ENGINE_OPTIONS = {
+    "max_side": IMAGE_MAX_SIDE,
+    "target_text_px": IMAGE_TARGET_TEXT_PX,
+    "tile_size": IMAGE_TILE_SIZE,
+    "tile_overlap": IMAGE_TILE_OVERLAP,
+    "pipeline": ENGINE_PIPELINE,
+    "rec_batch_size": REC_BATCH_SIZE,
+    "artifact_format": ARTIFACT_FORMAT,
+    "inference_profile": INFERENCE_PROFILE,
+}
+ARTIFACT_OPTIONS = {
+    "artifact_quality": ARTIFACT_QUALITY,
+    "artifact_png_compression": ARTIFACT_PNG_COMPRESSION,
+    "artifact_workers": ARTIFACT_WORKERS,
+}
+REGION_CACHE_OPTIONS = {
+    "region_cache_path": str(OUTPUT_DIR / "_cache" / "regions.sqlite3"),
+    "region_cache_entries": REGION_CACHE_ENTRIES,
+    "region_cache_mb": REGION_CACHE_MB,
+}
+artifact_writer = get_artifact_writer(ARTIFACT_WORKERS, ARTIFACT_FORMAT, ARTIFACT_QUALITY, ARTIFACT_PNG_COMPRESSION)
+
+if WORK_QUEUE_WORKER and ENGINE_MODE == "remote":
+    raise ValueError("A worker node (WORK_QUEUE_WORKER) runs its engines itself: use ENGINE_MODE thread or process")
+work_queue = None
+if ENGINE_MODE == "remote" or WORK_QUEUE_WORKER:
+    work_queue = WorkQueue(WORK_QUEUE_PATH, lease_s=WORK_QUEUE_LEASE_S, max_attempts=WORK_QUEUE_MAX_ATTEMPTS)
+
+engine_pool = create_engine_pool(
+    mode=ENGINE_MODE,
+    workers=ENGINE_WORKERS,
+    queue_size=ENGINE_QUEUE_SIZE,
+    threads_per_worker=ENGINE_THREADS or profile_threads(INFERENCE_PROFILE, ENGINE_WORKERS),
+    service_kwargs={
+        **{key: value for key, value in ENGINE_OPTIONS.items() if key not in ("tile_size", "tile_overlap")},
+        **ARTIFACT_OPTIONS, **REGION_CACHE_OPTIONS, "rec_batch_wait_ms": REC_BATCH_WAIT_MS
+    },
+    work_queue=work_queue,
+    work_options=options_key(ENGINE_OPTIONS),
+)
+queue_consumer = QueueConsumer(work_queue, engine_pool, options_key(ENGINE_OPTIONS)) if WORK_QUEUE_WORKER else None
+tiled_pages = asyncio.Semaphore(max(1, IMAGE_TILED_PAGES))
+
+result_cache = ResultCache(
+    max_entries=RESULT_CACHE_SIZE,
+    ttl_s=RESULT_CACHE_TTL,
+    disk_dir=OUTPUT_DIR / "_cache" / "results" if RESULT_CACHE_DISK_MB > 0 else None,
+    disk_max_bytes=RESULT_CACHE_DISK_MB * 1024 * 1024,
+)
+
+metrics.bind_engine_pool(lambda: engine_pool.in_flight, lambda: engine_pool.capacity)
+
+app.add_middleware(BodySizeLimitMiddleware, limits={
+    "/extract": UPLOAD_MAX_BYTES + FORM_OVERHEAD_BYTES,
+    "/extract/batch": BATCH_MAX_BYTES + FORM_OVERHEAD_BYTES,
+    "/jobs": BATCH_MAX_BYTES + FORM_OVERHEAD_BYTES,
+})
+
+@app.get("/cache/stats", tags=["system"])
+def cache_stats():
+    return result_cache.stats()
+
+@app.get("/metrics", tags=["system"])
+def prometheus_metrics():
+    body, content_type = metrics.render_metrics()
+    return Response(body, media_type=content_type)
+
+async def read_image(upload: UploadFile) -> memoryview:
+    """
+    The upload as one read-only buffer, shared by validation, caching,
+    storage and decoding. Answers 413 over UPLOAD_MAX_MB.
+    """
+    try:
+        image_bytes = await run_in_threadpool(read_upload, upload.file, UPLOAD_MAX_BYTES)
+    except UploadTooLargeError as e:
+        raise HTTPException(status_code=413, detail=str(e))
+    # Free the spooled copy now instead of after the response
+    await upload.close()
+    return image_bytes
+
+def validate_image(image_bytes):
+    # Header only; the engine worker does the one full decode
+    try:
+        probe_image(image_bytes, IMAGE_MAX_PIXELS)
+    except ImageTooLargeError as e:
+        raise HTTPException(status_code=413, detail=str(e))
+    except InvalidImageError:
+        raise HTTPException(status_code=400, detail="Invalid image file.")
+
+def queue_full_error(e: QueueFullError) -> HTTPException:
+    return HTTPException(
+        status_code=503,
+        detail="Inference queue is full, retry later.",
+        headers={"Retry-After": str(e.retry_after)},
+    )
+
+async def iter_page(image_bytes, filename, request_id, store_outputs, return_annotated,
+                    ocr_engine, layout_engine="paddle", wait_for_slot=False, profile=False, triage=False):
+    """
+    Persists the input, then answers from the result cache or streams the
+    page through the engine pool. Yields the page's events (see
+    app.services.streaming); the closing meta event carries the timings.
+    With `profile`, inference is profiled into the request directory; with
+    `triage`, blank and figure-only pages skip the engines.
+    """
+    request_dir = storage.request_dir(request_id)
+    t_persist_start = time.perf_counter()
+    input_write = None
+    if store_outputs:
+        request_dir.mkdir(parents=True, exist_ok=True)
+        input_path = request_dir / f"input_{filename or 'image'}"
+        input_write = artifact_writer.submit(request_dir, lambda writer: storage.store_input(input_path, image_bytes))
+    persist_ms = int((time.perf_counter() - t_persist_start) * 1000)
+
+    # Options that change the result are part of the cache key; output paths
+    # only exist when the original run stored them
+    cache_key = None
+    if result_cache.enabled:
+        t_cache_start = time.perf_counter()
+        cache_key = await run_in_threadpool(
+            ResultCache.make_key,
+            image_bytes,
+            ocr_engine=ocr_engine,
+            layout_engine=layout_engine,
+            store_outputs=store_outputs,
+            return_annotated=return_annotated,
+            triage=triage,
+            **ENGINE_OPTIONS,
+        )
+        cached = await run_in_threadpool(result_cache.get, cache_key)
+        source_status = None
+        if cached is not None and store_outputs:
+            # The outputs are the source request's, unless they were swept since
+            source_status = await run_in_threadpool(artifacts_status, cached["meta"]["request_id"])
+            if source_status is None:
+                cached = None
+        if cached is not None:
+            source_request_id = cached["meta"]["request_id"]
+            cached["meta"]["request_id"] = request_id
+            cached["meta"]["timings_ms"] = {
+                "preprocess": 0, "layout": 0, "ocr": 0, "crop": 0,
+                "persist": persist_ms,
+                "cache_lookup": int((time.perf_counter() - t_cache_start) * 1000),
+            }
+            cached["meta"]["cache"] = {"hit": True, "source_request_id": source_request_id}
+            if store_outputs:
+                cached["exports"]["artifacts_status"] = source_status
+            metrics.observe_page(cached, ocr_engine)
+            for event in page_events(cached):
+                yield event
+            return
+
+    profile_path = None
+    if profile:
+        request_dir.mkdir(parents=True, exist_ok=True)
+        profile_path = str(request_dir / "profile.prof")
+
+    queue_stats = {}
+    events = []
+    if IMAGE_TILE_SIZE and max(probe_image(image_bytes)) > IMAGE_TILE_SIZE:
+        source = iter_tiled_page(
+            image_bytes, request_id, request_dir, store_outputs, return_annotated, ocr_engine,
+            layout_engine, queue_stats, wait_for_slot, profile_path, triage
+        )
+    else:
+        source = engine_pool.stream(
+            "iter_extraction",
+            stats=queue_stats,
+            wait_for_slot=wait_for_slot,
+            profile_path=profile_path,
+            image_bytes=image_bytes,
+            request_id=request_id,
+            output_dir=request_dir if store_outputs else None,
+            store_outputs=store_outputs,
+            return_annotated=return_annotated,
+            ocr_engine=ocr_engine,
+            layout_engine=layout_engine,
+            triage=triage
+        )
+    try:
+        async for event in source:
+            events.append(event)
+            if event["type"] == "meta":
+                if cache_key is not None:
+                    await run_in_threadpool(result_cache.put, cache_key, collect_page(events))
+                    event["data"]["meta"]["cache"] = {"hit": False, "source_request_id": None}
+                event["data"]["meta"]["timings_ms"].update(queue_stats, persist=persist_ms)
+                if store_outputs:
+                    event["data"]["exports"]["artifacts_status"] = await run_in_threadpool(
+                        artifacts_status, request_id
+                    )
+                if profile_path is not None:
+                    event["data"]["exports"]["profile_path"] = f"/outputs/{request_id}/profile.prof"
+                metrics.observe_page(event["data"], ocr_engine)
+            yield event
+    except QueueFullError:
+        if store_outputs:
+            # The input may still be being written into the directory
+            await asyncio.wrap_future(input_write)
+            await run_in_threadpool(shutil.rmtree, request_dir, ignore_errors=True)
+        raise
+
+async def iter_tiled_page(image_bytes, request_id, request_dir, store_outputs, return_annotated, ocr_engine,
+                          layout_engine, stats, wait_for_slot=False, profile_path=None, triage=False):
+    """
+    Extracts a page larger than IMAGE_TILE_SIZE: decoded here once, its
+    tiles run in parallel on the engine pool and their regions merged (see
+    app.services.tiling). Yields the page's events once all tiles are done.
+    Until then the page holds its decoded pixels, their downscaled copy and
+    up to one tile copy per engine worker; tiled_pages caps how many pages
+    do so at once.
+    """
+    # The first tile is admitted like a whole page; the others wait for it
+    if not wait_for_slot and (engine_pool.in_flight >= engine_pool.capacity or tiled_pages.locked()):
+        raise QueueFullError(engine_pool.retry_after())
+    async with tiled_pages:
+        t_start = time.perf_counter()
+        img = await run_in_threadpool(decode_image, image_bytes)
+        page_triage = await run_in_threadpool(triage_page, img) if triage else None
+        if page_triage and page_triage.decision != "text":
+            events = await run_in_threadpool(list, triaged_events(
+                img, page_triage, (time.perf_counter() - t_start) * 1000, request_id,
+                request_dir if store_outputs else None, store_outputs, return_annotated, ocr_engine, layout_engine,
+                artifact_writer
+            ))
+        else:
+            events = await tiled_events(
+                img, t_start, request_id, request_dir, store_outputs, return_annotated, ocr_engine,
+                layout_engine, stats, profile_path, page_triage
+            )
+        del img
+    for event in events:
+        yield event
+
+async def tiled_events(img, t_start, request_id, request_dir, store_outputs, return_annotated, ocr_engine,
+                       layout_engine, stats, profile_path, page_triage):
+    """The events of a decoded page run in tiles on the engine pool."""
+    scale, tiled = await run_in_threadpool(
+        plan_inference, img, IMAGE_MAX_SIDE, IMAGE_TARGET_TEXT_PX, IMAGE_TILE_SIZE
+    )
+    engine_img = await run_in_threadpool(resize_image, img, scale)
+    height, width = engine_img.shape[:2]
+    tiles = plan_tiles(width, height, IMAGE_TILE_SIZE, IMAGE_TILE_OVERLAP) if tiled else [(0, 0, width, height)]
+    preprocess_ms = (time.perf_counter() - t_start) * 1000
+
+    t_infer_start = time.perf_counter()
+    regions, engine_times, tile_stats = await run_tiles(
+        engine_pool, engine_img, tiles, ocr_engine, layout_engine, profile_path
+    )
+    stats.update(tile_stats)
+    if engine_times is None:
+        engine_times = {"layout": time.perf_counter() - t_infer_start, "det": 0.0, "rec": 0.0}
+    return await run_in_threadpool(list, region_events(
+        img, engine_img.shape, regions, engine_times, preprocess_ms, request_id,
+        request_dir if store_outputs else None, store_outputs, return_annotated, ocr_engine, layout_engine,
+        artifact_writer, len(tiles), page_triage
+    ))
+
+async def extract_page(image_bytes, filename, request_id, store_outputs, return_annotated,
+                       ocr_engine, layout_engine="paddle", wait_for_slot=False, profile=False, triage=False):
+    """Runs iter_page to the end. Returns the ExtractResponse data for the page."""
+    return collect_page([
+        event async for event in iter_page(
+            image_bytes, filename, request_id, store_outputs, return_annotated,
+            ocr_engine, layout_engine, wait_for_slot, profile, triage
+        )
+    ])
+
+def pdf_blocks(page):
+    """The blocks of an ExtractResponse, figures carrying the file of their stored crop."""
+    figure_files = {
+        tuple(figure["bbox"]): storage.output_file(figure["image_path"])
+        for figure in page["figures"] if figure["image_path"]
+    }
+    blocks = []
+    for block in page["blocks"]:
+        if block["type"] == "figure" and figure_files.get(tuple(block["bbox"])):
+            block = {**block, "image_file": figure_files[tuple(block["bbox"])]}
+        blocks.append(block)
+    return blocks
+
+async def wait_for_outputs(files, timeout_s):
+    """Waits (up to `timeout_s`) until the background writes of the files' requests are done."""
+    deadline = time.monotonic() + timeout_s
+    for request_dir in {path.parent for path in files}:
+        while time.monotonic() < deadline:
+            status = await run_in_threadpool(artifact_status, request_dir)
+            if not status or status["status"] != "pending":
+                break
+            await asyncio.sleep(0.05)
+
+async def add_pdf_export(response_data, pages, request_id, ocr_engine, pdf_mode="reflow", images=None):
+    """
+    Builds the PDF of `pages` (ExtractResponse data, one PDF page each) on a
+    worker thread. In reflow mode the stored figure crops are embedded; in
+    searchable mode each page is its upload from `images` (same order as
+    `pages`) under an invisible text layer.
+    """
+    t_start = time.perf_counter()
+    try:
+        pdf_service = get_pdf_service(PDF_IMAGE_QUALITY, PDF_RECOMPRESS_IMAGES)
+        request_dir = storage.request_dir(request_id)
+        pdf_path = request_dir / "output.pdf"
+        await run_in_threadpool(request_dir.mkdir, parents=True, exist_ok=True)
+        if pdf_mode == "searchable":
+            await run_in_threadpool(pdf_service.create_searchable_document, zip(images, pages), pdf_path)
+        else:
+            page_blocks = [pdf_blocks(page) for page in pages]
+            figure_files = [b["image_file"] for blocks in page_blocks for b in blocks if "image_file" in b]
+            await wait_for_outputs(figure_files, PDF_FIGURE_WAIT_S)
+            await run_in_threadpool(pdf_service.create_document, page_blocks, pdf_path)
+        response_data["exports"]["pdf_path"] = f"/outputs/{request_id}/output.pdf"
+    except Exception as e:
+        print(f"PDF Generation failed: {e}")
+        # We don't fail the whole request, just log it or add error to response
+        response_data["errors"] = response_data.get("errors", []) + [f"PDF generation failed: {str(e)}"]
+    pdf_s = time.perf_counter() - t_start
+    response_data["meta"]["timings_ms"]["pdf"] = int(pdf_s * 1000)
+    metrics.observe_stage("pdf", pdf_s, ocr_engine)
+
+def ensure_capacity():
+    # Checked before a streaming response starts, while a 503 can still be sent
+    if engine_pool.in_flight >= engine_pool.capacity:
+        raise queue_full_error(QueueFullError(engine_pool.retry_after()))
+
+async def encode_stream(media_type, events):
+    """Encodes events for a StreamingResponse; a failure ends the stream with an error event."""
+    try:
+        async for event in events:
+            yield encode_event(media_type, event)
+    except QueueFullError as e:
+        detail = {"detail": "Inference queue is full, retry later.", "retry_after": e.retry_after}
+        yield encode_event(media_type, {"type": "error", "data": detail})
+    except Exception as e:
+        print(f"Streaming extraction failed: {e}")
+        yield encode_event(media_type, {"type": "error", "data": {"detail": str(e)}})
+
+def select_engines(ocr_engine: str, layout_engine: str):
+    """Resolves the requested engines, or answers 400 if this server cannot run them."""
+    try:
+        ocr_engine, layout_engine = resolve_engines(ocr_engine, layout_engine)
+        check_available(ocr_engine)
+    except (UnknownEngineError, EngineUnavailableError) as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    return ocr_engine, layout_engine
+
+def select_pdf_mode(pdf_mode: str) -> str:
+    pdf_mode = (pdf_mode or "reflow").lower()
+    if pdf_mode not in PDF_MODES:
+        raise HTTPException(
+            status_code=400, detail=f"Unknown pdf_mode '{pdf_mode}', expected one of: {', '.join(PDF_MODES)}."
+        )
+    return pdf_mode
+
+def select_triage(triage: Optional[bool]) -> bool:
+    """The request's triage choice, or PAGE_TRIAGE when it made none."""
+    return PAGE_TRIAGE if triage is None else triage
+
+def select_fields(fields: Optional[str]):
+    try:
+        return parse_fields(fields)
+    except InvalidFieldsError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+def wants_profile(x_profile: Optional[str]) -> bool:
+    return ALLOW_PROFILING and (x_profile or "").lower() in ("1", "true", "yes")
 
 @app.post("/extract")
+@metrics.tracked("extract")
 async def extract(
     file: UploadFile = File(...),
     store_outputs: bool = Form(True), 
     return_annotated: bool = Form(True), 
     ocr_engine: str = Form("paddle"),
-    generate_pdf: bool = Form(False)
+    layout_engine: str = Form("paddle"),
+    generate_pdf: bool = Form(False),
+    pdf_mode: str = Form("reflow"),
+    triage: Optional[bool] = Form(None),
+    fields: Optional[str] = Form(None),
+    include_lines: bool = Form(True),
+    accept: Optional[str] = Header(None),
+    accept_encoding: Optional[str] = Header(None),
+    x_profile: Optional[str] = Header(None)
 ):
+    """
+    Extracts one page. With `Accept: application/x-ndjson` or
+    `text/event-stream` the result streams as events instead: blocks and
+    figures as they are built, then the closing meta record. `fields` and
+    `include_lines` cut the result down (see app.services.serialization).
+    """
     if not file.content_type or not file.content_type.startswith("image/"):
         raise HTTPException(status_code=400, detail="Only image uploads are supported.")
+    ocr_engine, layout_engine = select_engines(ocr_engine, layout_engine)
+    pdf_mode = select_pdf_mode(pdf_mode)
+    triage = select_triage(triage)
+    projection = select_fields(fields)
     
     request_id = str(uuid.uuid4())
-    image_bytes = await file.read()
+    t_upload_start = time.perf_counter()
+    image_bytes = await read_image(file)
+    upload_s = time.perf_counter() - t_upload_start
+    metrics.observe_upload("extract", len(image_bytes))
+    metrics.observe_stage("upload", upload_s, ocr_engine)
+    profile = wants_profile(x_profile)
     
     # Validate image
-    try:
-        with Image.open(BytesIO(image_bytes)) as img:
-            width, height = img.size
-            if width <= 0 or height <= 0:
-                raise ValueError("Invalid image dimensions")
-    except Exception:
-        raise HTTPException(status_code=400, detail="Invalid image file.")
+    validate_image(image_bytes)
 
-    request_dir = OUTPUT_DIR / request_id
-    if store_outputs:
-        request_dir.mkdir(parents=True, exist_ok=True)
-        input_path = request_dir / f"input_{file.filename or 'image'}"
-        input_path.write_bytes(image_bytes)
+    media_type = negotiate_stream_format(accept)
+    if media_type:
+        ensure_capacity()
+        events = shape_events(extract_events(
+            image_bytes, file.filename, request_id, store_outputs, return_annotated,
+            ocr_engine, layout_engine, generate_pdf, pdf_mode, upload_s, profile, triage
+        ), projection, include_lines)
+        return StreamingResponse(encode_stream(media_type, events), media_type=media_type)
 
-    response_data = None
     try:
-        service = get_extraction_service()
-        response_data = service.run_extraction(
-            image_bytes=image_bytes, 
-            request_id=request_id, 
-            output_dir=request_dir if store_outputs else None, 
-            store_outputs=store_outputs, 
-            return_annotated=return_annotated
+        response_data = await extract_page(
+            image_bytes, file.filename, request_id, store_outputs, return_annotated, ocr_engine,
+            layout_engine, profile=profile, triage=triage
         )
+    except QueueFullError as e:
+        raise queue_full_error(e)
+    except EngineUnavailableError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    except InvalidImageError:
+        # Header looked fine but the pixel data does not decode
+        raise HTTPException(status_code=400, detail="Invalid image file.")
     except Exception as e:
         # In production, log generic error and return 500
         print(f"Extraction failed: {e}")
         raise HTTPException(status_code=500, detail=str(e))
 
+    response_data["meta"]["timings_ms"]["upload"] = int(upload_s * 1000)
     if generate_pdf and store_outputs:
+        await add_pdf_export(response_data, [response_data], request_id, ocr_engine, pdf_mode, [image_bytes])
+
+    # Encoding and compressing the body stay off the event loop
+    return await run_in_threadpool(
+        render, shape_page(response_data, projection, include_lines), accept, accept_encoding,
+        RESPONSE_COMPRESS_MIN_BYTES
+    )
+
+async def extract_events(image_bytes, filename, request_id, store_outputs, return_annotated,
+                         ocr_engine, layout_engine, generate_pdf, pdf_mode, upload_s, profile, triage=False):
+    page = {"blocks": [], "figures": [], "meta": None}
+    async for event in iter_page(
+        image_bytes, filename, request_id, store_outputs, return_annotated, ocr_engine,
+        layout_engine, profile=profile, triage=triage
+    ):
+        if event["type"] == "block":
+            page["blocks"].append(event["data"])
+        elif event["type"] == "figure":
+            page["figures"].append(event["data"])
+        elif event["type"] == "meta":
+            event["data"]["meta"]["timings_ms"]["upload"] = int(upload_s * 1000)
+            page["meta"] = event["data"]["meta"]
+            if generate_pdf and store_outputs:
+                await add_pdf_export(event["data"], [page], request_id, ocr_engine, pdf_mode, [image_bytes])
+        yield event
+
+async def collect_pages(files: List[UploadFile]):
+    """
+    Expands image and zip uploads into validated (filename, bytes) pages in
+    upload order. Raises 400/413 HTTP errors for bad or oversized uploads.
+    """
+    pages = []
+    for upload in files:
+        if is_zip_upload(upload.content_type, upload.filename):
+            try:
+                pages.extend(await run_in_threadpool(
+                    read_zip_pages, upload.file, BATCH_MAX_PAGES - len(pages), BATCH_MAX_BYTES
+                ))
+            except BatchTooLargeError as e:
+                raise HTTPException(status_code=413, detail=str(e))
+            except zipfile.BadZipFile:
+                raise HTTPException(status_code=400, detail=f"Invalid zip file: {upload.filename}")
+        elif upload.content_type and upload.content_type.startswith("image/"):
+            pages.append((upload.filename, await read_image(upload)))
+        else:
+            raise HTTPException(status_code=400, detail="Only image or zip uploads are supported.")
+        if len(pages) > BATCH_MAX_PAGES:
+            raise HTTPException(status_code=413, detail=f"A batch may contain at most {BATCH_MAX_PAGES} pages.")
+
+    if not pages:
+        raise HTTPException(status_code=400, detail="No images found in the upload.")
+    for _, image_bytes in pages:
+        validate_image(image_bytes)
+    return pages
+
+@app.post("/extract/batch")
+@metrics.tracked("extract_batch")
+async def extract_batch(
+    files: List[UploadFile] = File(...),
+    store_outputs: bool = Form(True),
+    return_annotated: bool = Form(True),
+    ocr_engine: str = Form("paddle"),
+    layout_engine: str = Form("paddle"),
+    generate_pdf: bool = Form(False),
+    pdf_mode: str = Form("reflow"),
+    triage: Optional[bool] = Form(None),
+    fields: Optional[str] = Form(None),
+    include_lines: bool = Form(True),
+    accept: Optional[str] = Header(None),
+    accept_encoding: Optional[str] = Header(None)
+):
+    """
+    Extracts many pages in one request. `files` may be images, zip archives
+    of images, or a mix; pages keep upload order (zip members by name).
+    Pages run concurrently, one per engine worker, and come back in page order.
+    When streamed (see /extract), each page is sent as soon as it finishes.
+    `fields` and `include_lines` cut down every page as on /extract.
+    """
+    t_start = time.perf_counter()
+    ocr_engine, layout_engine = select_engines(ocr_engine, layout_engine)
+    pdf_mode = select_pdf_mode(pdf_mode)
+    triage = select_triage(triage)
+    projection = select_fields(fields)
+    pages = await collect_pages(files)
+    metrics.observe_upload("extract_batch", sum(len(image_bytes) for _, image_bytes in pages))
+
+    # Reject a batch outright when the pool is already saturated; once
+    # admitted, pages wait for free workers instead of failing one by one
+    ensure_capacity()
+
+    batch_id = str(uuid.uuid4())
+    media_type = negotiate_stream_format(accept)
+    if media_type:
+        events = batch_events(
+            pages, batch_id, t_start, store_outputs, return_annotated, ocr_engine, layout_engine,
+            generate_pdf, pdf_mode, triage, projection, include_lines
+        )
+        return StreamingResponse(encode_stream(media_type, events), media_type=media_type)
+
+    slots = batch_slots()
+    tasks = [
+        asyncio.create_task(extract_batch_page(
+            slots, image_bytes, filename, str(uuid.uuid4()), store_outputs,
+            return_annotated, ocr_engine, layout_engine, triage
+        ))
+        for filename, image_bytes in pages
+    ]
+    try:
+        results = await asyncio.gather(*tasks)
+    except InvalidImageError:
+        raise HTTPException(status_code=400, detail="Invalid image file.")
+    except EngineUnavailableError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    except Exception as e:
+        print(f"Batch extraction failed: {e}")
+        raise HTTPException(status_code=500, detail=str(e))
+    finally:
+        # A failed page fails the batch: stop the pages that have not run yet
+        for task in tasks:
+            task.cancel()
+
+    response_data = {
+        "meta": {
+            "batch_id": batch_id,
+            "page_count": len(results),
+            "timings_ms": {"total": int((time.perf_counter() - t_start) * 1000)},
+        },
+        "pages": list(results),
+        "exports": {"pdf_path": None},
+    }
+
+    if generate_pdf and store_outputs:
+        await add_pdf_export(response_data, results, batch_id, ocr_engine, pdf_mode,
+                             [image_bytes for _, image_bytes in pages])
+
+    response_data["pages"] = [shape_page(page, projection, include_lines) for page in results]
+    return await run_in_threadpool(render, response_data, accept, accept_encoding, RESPONSE_COMPRESS_MIN_BYTES)
+
+def batch_slots() -> asyncio.Semaphore:
+    """
+    Pages of one batch run at most one per engine worker at a time, so a
+    batch never takes the queue slots other requests are admitted to.
+    """
+    return asyncio.Semaphore(engine_pool.workers)
+
+async def extract_batch_page(slots, image_bytes, filename, request_id, store_outputs, return_annotated,
+                             ocr_engine, layout_engine, triage):
+    async with slots:
+        return await extract_page(
+            image_bytes, filename, request_id, store_outputs, return_annotated,
+            ocr_engine, layout_engine, wait_for_slot=True, triage=triage
+        )
+
+async def batch_events(pages, batch_id, t_start, store_outputs, return_annotated, ocr_engine,
+                       layout_engine, generate_pdf, pdf_mode="reflow", triage=False, projection=None,
+                       include_lines=True):
+    """
+    Yields a `page` event per page in completion order, then the closing
+    meta record. Unlike the JSON response, a failed page does not fail the
+    batch; it is reported with status `failed`. Page results are cut down
+    by `projection` and `include_lines` (the PDF is built from the full pages).
+    """
+    slots = batch_slots()
+
+    async def run_page(index, filename, image_bytes):
+        page = {"index": index, "filename": filename, "status": "completed", "error": None, "result": None}
         try:
-            pdf_service = get_pdf_service()
-            pdf_path = request_dir / "output.pdf"
-            pdf_service.create_pdf(response_data["blocks"], pdf_path)
-            response_data["exports"]["pdf_path"] = f"/outputs/{request_id}/output.pdf"
+            page["result"] = await extract_batch_page(
+                slots, image_bytes, filename, str(uuid.uuid4()), store_outputs, return_annotated,
+                ocr_engine, layout_engine, triage
+            )
         except Exception as e:
-            print(f"PDF Generation failed: {e}")
-            # We don't fail the whole request, just log it or add error to response
-            response_data["errors"] = response_data.get("errors", []) + [f"PDF generation failed: {str(e)}"]
+            print(f"Batch page {index} failed: {e}")
+            page.update(status="failed", error=str(e))
+        return page
 
-    return response_data
+    tasks = [
+        asyncio.create_task(run_page(index, filename, image_bytes))
+        for index, (filename, image_bytes) in enumerate(pages)
+    ]
+    results = [None] * len(tasks)
+    try:
+        for next_page in asyncio.as_completed(tasks):
+            page = await next_page
+            results[page["index"]] = page["result"]
+            if page["result"] is not None:
+                page = {**page, "result": shape_page(page["result"], projection, include_lines)}
+            yield {"type": "page", "data": page}
+    finally:
+        # The client went away: stop the pages that have not run yet
+        for task in tasks:
+            task.cancel()
 
+    closing = {
+        "meta": {
+            "batch_id": batch_id,
+            "page_count": len(results),
+            "timings_ms": {"total": int((time.perf_counter() - t_start) * 1000)},
+        },
+        "exports": {"pdf_path": None},
+    }
+    if generate_pdf and store_outputs:
+        completed = [index for index, result in enumerate(results) if result is not None]
+        await add_pdf_export(closing, [results[i] for i in completed], batch_id, ocr_engine, pdf_mode,
+                             [pages[i][1] for i in completed])
+    yield {"type": "meta", "data": closing}
 
+async def process_job_page(job, page, image_bytes):
+    options = job["options"]
+    return await extract_page(
+        image_bytes, page["filename"], str(uuid.uuid4()), options["store_outputs"],
+        options["return_annotated"], options["ocr_engine"],
+        # Jobs created before layout_engine existed used the default
+        options.get("layout_engine", "paddle"), wait_for_slot=True,
+        triage=options.get("triage", PAGE_TRIAGE)
+    )
 
+job_manager = JobManager(OUTPUT_DIR, process_job_page, concurrency=JOB_CONCURRENCY, storage=storage)
 
-    return {"status": "ok"}
+def artifacts_status(request_id: str) -> Optional[str]:
+    status = artifact_status(storage.request_dir(request_id))
+    return status["status"] if status else None
+
+@app.get("/artifacts/{request_id}")
+async def get_artifacts(request_id: str):
+    """Tells whether the stored outputs of a request have all been written."""
+    try:
+        request_id = str(uuid.UUID(request_id))
+    except ValueError:
+        raise HTTPException(status_code=404, detail="No outputs stored for this request.")
+    status = await run_in_threadpool(artifact_status, storage.request_dir(request_id))
+    if status is None:
+        raise HTTPException(status_code=404, detail="No outputs stored for this request.")
+    return {"request_id": request_id, **status}
+
+def parse_job_id(job_id: str) -> str:
+    # Job ids double as directory names, so only accept real UUIDs
+    try:
+        return str(uuid.UUID(job_id))
+    except ValueError:
+        raise HTTPException(status_code=404, detail="Job not found.")
+
+@app.post("/jobs", status_code=202)
+@metrics.tracked("jobs")
+async def create_job(
+    files: List[UploadFile] = File(...),
+    store_outputs: bool = Form(True),
+    return_annotated: bool = Form(True),
+    ocr_engine: str = Form("paddle"),
+    layout_engine: str = Form("paddle"),
+    triage: Optional[bool] = Form(None),
+):
+    """
+    Queues a multi-page extraction and returns immediately. Poll
+    GET /jobs/{job_id} for progress and per-page results, or stream it.
+    """
+    ocr_engine, layout_engine = select_engines(ocr_engine, layout_engine)
+    pages = await collect_pages(files)
+    metrics.observe_upload("jobs", sum(len(image_bytes) for _, image_bytes in pages))
+    job = await job_manager.create_job(pages, {
+        "store_outputs": store_outputs,
+        "return_annotated": return_annotated,
+        "ocr_engine": ocr_engine,
+        "layout_engine": layout_engine,
+        "triage": select_triage(triage),
+    })
+    return await job_manager.get_job(job["job_id"], include_results=False)
+
+@app.get("/jobs/{job_id}")
+async def get_job(job_id: str, include_results: bool = True, accept: Optional[str] = Header(None)):
+    """
+    Returns the job state. Streamed (see /extract), it sends every finished
+    page as it completes and ends with the job state once the job is done.
+    """
+    job_id = parse_job_id(job_id)
+    media_type = negotiate_stream_format(accept)
+    job = await job_manager.get_job(job_id, include_results=include_results and not media_type)
+    if job is None:
+        raise HTTPException(status_code=404, detail="Job not found.")
+    if media_type:
+        return StreamingResponse(encode_stream(media_type, job_manager.watch(job_id)), media_type=media_type)
+    return job
+
+@app.delete("/jobs/{job_id}")
+async def cancel_job(job_id: str):
+    job = await job_manager.cancel_job(parse_job_id(job_id))
+    if job is None:
+        raise HTTPException(status_code=404, detail="Job not found.")
+    return job
@@ -0,0 +1,190 @@
+"""
+Background writing of a request's output files (input copy, figure crops,
+annotated preview), so disk I/O stays off the request path.
+
+Writes of one request run as a single task on a thread pool. While any task
+of a request is in flight, its directory holds a `.pending.<host>-<pid>`
+marker, whose mtime the writer refreshes every MARKER_REFRESH_S; a task
+that fails leaves a `.failed` file with the error. Files are written under a
+temporary name and renamed into place, so a file that exists is complete.
+artifact_status() reads these markers, which works no matter which process
+or container (API node, engine worker, worker node) wrote the files: a
+marker not refreshed for MARKER_LEASE_S belongs to a writer that died.
+"""
+import logging
+import os
+import socket
+import threading
+import time
+import uuid
+from concurrent.futures import Future, ThreadPoolExecutor, wait
+from pathlib import Path
+from typing import Any, Callable, Dict, List, Optional
+
+import cv2
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+# Image formats for figure crops and the annotated preview, by file extension
+IMAGE_FORMATS = {"png": ".png", "jpeg": ".jpg", "webp": ".webp"}
+PENDING_PREFIX = ".pending."
+FAILED_FILE = ".failed"
+# Writers refresh their pending markers this often; markers older than the lease are abandoned
+MARKER_REFRESH_S = 10
+MARKER_LEASE_S = 60
+
+
+def pending_marker_name() -> str:
+    """This process's pending marker: unique across the containers sharing the volume."""
+    return f"{PENDING_PREFIX}{socket.gethostname()}-{os.getpid()}"
+
+
+def marker_alive(marker: Path, now: Optional[float] = None) -> bool:
+    """Whether the writer of a pending marker refreshed it within MARKER_LEASE_S."""
+    try:
+        mtime = marker.stat().st_mtime
+    except OSError:
+        return False
+    return (time.time() if now is None else now) - mtime < MARKER_LEASE_S
+
+
+def artifact_status(request_dir: Path) -> Optional[Dict[str, Any]]:
+    """
+    Returns {"status": "pending" | "ready" | "failed", "error"} for the
+    outputs of a request, or None if it stored none.
+    """
+    try:
+        names = os.listdir(request_dir)
+    except (FileNotFoundError, NotADirectoryError):
+        return None
+    if FAILED_FILE in names:
+        try:
+            error = (request_dir / FAILED_FILE).read_text().strip()
+        except OSError:
+            error = None
+        return {"status": "failed", "error": error or "Writing outputs failed"}
+    markers = [name for name in names if name.startswith(PENDING_PREFIX)]
+    if any(marker_alive(request_dir / name) for name in markers):
+        return {"status": "pending", "error": None}
+    if markers:
+        # The writers are gone; their outputs will never finish
+        return {"status": "failed", "error": "Writing outputs was interrupted"}
+    return {"status": "ready", "error": None}
+
+
+class ArtifactWriter:
+    """
+    Writes request outputs on `workers` background threads, encoding images
+    as `image_format` ('png', 'jpeg' or 'webp') at `quality` (JPEG/WebP,
+    1-100) or `png_compression` (0-9).
+    """
+
+    def __init__(self, workers: int = 4, image_format: str = "png", quality: int = 90,
+                 png_compression: int = 3):
+        if image_format not in IMAGE_FORMATS:
+            raise ValueError(f"Unknown artifact format: {image_format}")
+        self.image_format = image_format
+        self.extension = IMAGE_FORMATS[image_format]
+        if image_format == "jpeg":
+            self._params = [cv2.IMWRITE_JPEG_QUALITY, quality]
+        elif image_format == "webp":
+            self._params = [cv2.IMWRITE_WEBP_QUALITY, quality]
+        else:
+            self._params = [cv2.IMWRITE_PNG_COMPRESSION, png_compression]
+        self._executor = ThreadPoolExecutor(max_workers=max(1, workers), thread_name_prefix="artifacts")
+        self._lock = threading.Lock()
+        # request_dir -> tasks of this process still writing into it
+        self._in_flight: Dict[Path, int] = {}
+        self._futures: "set[Future]" = set()
+        self._marker_name = pending_marker_name()
+        self._stopped = threading.Event()
+        threading.Thread(target=self._refresh_markers, name="artifact-markers", daemon=True).start()
+
+    def _refresh_markers(self):
+        while not self._stopped.wait(MARKER_REFRESH_S):
+            with self._lock:
+                request_dirs = list(self._in_flight)
+            for request_dir in request_dirs:
+                try:
+                    os.utime(request_dir / self._marker_name)
+                except OSError:
+                    pass
+
+    def submit(self, request_dir: Path, task: Callable[["ArtifactWriter"], None]) -> Future:
+        """
+        Runs `task(writer)` in the background; its writes count towards the
+        status of `request_dir`, which must exist.
+        """
+        marker = request_dir / self._marker_name
+        with self._lock:
+            if not self._in_flight.get(request_dir):
+                marker.touch()
+            self._in_flight[request_dir] = self._in_flight.get(request_dir, 0) + 1
+
+        def run():
+            try:
+                task(self)
+            except Exception as e:
+                logger.error(f"Writing outputs to {request_dir} failed: {e}")
+                try:
+                    (request_dir / FAILED_FILE).write_text(str(e))
+                except OSError:
+                    pass
+            finally:
+                with self._lock:
+                    self._in_flight[request_dir] -= 1
+                    if not self._in_flight[request_dir]:
+                        del self._in_flight[request_dir]
+                        marker.unlink(missing_ok=True)
+
+        future = self._executor.submit(run)
+        with self._lock:
+            self._futures.add(future)
+        future.add_done_callback(self._forget)
+        return future
+
+    def _forget(self, future: Future):
+        with self._lock:
+            self._futures.discard(future)
+
+    def write_bytes(self, path: Path, data):
+        # Unique per write: the same artifact may be written twice at once
+        # (a task retried on another worker node, a cache hit racing the original)
+        tmp_path = path.with_name(f".{path.name}.{os.getpid()}.{uuid.uuid4().hex}.tmp")
+        tmp_path.write_bytes(data)
+        tmp_path.replace(path)
+
+    def write_image(self, path: Path, img: np.ndarray):
+        """Encodes `img` in the writer's format and writes it to `path`."""
+        ok, encoded = cv2.imencode(self.extension, img, self._params)
+        if not ok:
+            raise ValueError(f"Could not encode {path.name}")
+        self.write_bytes(path, encoded)
+
+    def flush(self, timeout: Optional[float] = None):
+        """Waits for every task submitted so far."""
+        with self._lock:
+            futures: List[Future] = list(self._futures)
+        wait(futures, timeout=timeout)
+
+    def shutdown(self, wait: bool = True):
+        self._executor.shutdown(wait=wait)
+        self._stopped.set()
+
+
+_writer: Optional[ArtifactWriter] = None
+_writer_lock = threading.Lock()
+
+
+def get_artifact_writer(workers: int = 4, image_format: str = "png", quality: int = 90,
+                        png_compression: int = 3) -> ArtifactWriter:
+    """
+    The writer shared by everything in this process that stores outputs.
+    The first caller's settings apply.
+    """
+    global _writer
+    with _writer_lock:
+        if _writer is None:
+            _writer = ArtifactWriter(workers, image_format, quality, png_compression)
+        return _writer
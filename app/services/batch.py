@@ -0,0 +1,47 @@
+import re
+import zipfile
+from pathlib import Path
+from typing import BinaryIO, List, Optional, Tuple
+
+IMAGE_EXTENSIONS = {".png", ".jpg", ".jpeg", ".webp", ".bmp", ".tif", ".tiff"}
+ZIP_CONTENT_TYPES = {"application/zip", "application/x-zip-compressed", "application/x-zip"}
+
+
+class BatchTooLargeError(ValueError):
+    """Raised when a batch upload exceeds the configured page or size limits."""
+
+
+def is_zip_upload(content_type: Optional[str], filename: Optional[str]) -> bool:
+    if content_type in ZIP_CONTENT_TYPES:
+        return True
+    return bool(filename) and filename.lower().endswith(".zip")
+
+
+def natural_key(name: str):
+    """Sort key that orders 'page2' before 'page10'."""
+    return [int(part) if part.isdigit() else part.lower() for part in re.split(r"(\d+)", name)]
+
+
+def read_zip_pages(fileobj: BinaryIO, max_pages: int, max_bytes: int) -> List[Tuple[str, bytes]]:
+    """
+    Reads the images in a zip archive as (filename, bytes) pages, ordered
+    naturally by their path inside the archive. Other files, directories and
+    macOS resource forks are skipped.
+
+    Limits are checked against the archive's declared sizes before anything
+    is decompressed; zipfile never reads past a member's declared size.
+    """
+    with zipfile.ZipFile(fileobj) as archive:
+        members = [
+            m for m in archive.infolist()
+            if not m.is_dir()
+            and Path(m.filename).suffix.lower() in IMAGE_EXTENSIONS
+            and not m.filename.startswith("__MACOSX/")
+            and not Path(m.filename).name.startswith(".")
+        ]
+        if len(members) > max_pages:
+            raise BatchTooLargeError(f"Too many pages in zip archive (limit {max_pages}).")
+        if sum(m.file_size for m in members) > max_bytes:
+            raise BatchTooLargeError(f"Zip contents exceed {max_bytes // (1024 * 1024)} MB.")
+        members.sort(key=lambda m: natural_key(m.filename))
+        return [(Path(m.filename).name, archive.read(m)) for m in members]
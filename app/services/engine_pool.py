@@ -0,0 +1,566 @@
+import abc
+import asyncio
+import logging
+import math
+import multiprocessing
+import threading
+import time
+from collections import deque
+from concurrent.futures import CancelledError, Future, ThreadPoolExecutor, ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from multiprocessing import shared_memory
+from typing import Any, AsyncIterator, Callable, Dict, List, Optional, Tuple
+
+from app.services.engine_worker import init_worker, profiled, timed_call, worker_call
+from app.services.extraction import ExtractionService
+
+logger = logging.getLogger(__name__)
+
+# How often a remote pool polls the work queue for results, and recounts its worker nodes
+RESULT_POLL_S = 0.05
+FLEET_REFRESH_S = 1.0
+
+
+class QueueFullError(Exception):
+    """Raised when the inference queue has no free slot for a new request."""
+
+    def __init__(self, retry_after: int):
+        super().__init__("Inference queue is full")
+        self.retry_after = retry_after
+
+
+class EngineCrashedError(Exception):
+    """Raised when an engine worker process died while handling a request."""
+
+
+class EnginePool(abc.ABC):
+    """
+    Runs ExtractionService calls on a dedicated executor so inference never
+    blocks the event loop.
+
+    At most `workers` calls run at once and at most `queue_size` more may
+    wait for a free worker; anything beyond that is rejected with
+    QueueFullError so the API can answer immediately instead of piling up.
+    Subclasses decide where the calls actually run.
+    """
+
+    def __init__(self, workers: int = 1, queue_size: int = 8):
+        self._workers = max(1, workers)
+        self.queue_size = max(0, queue_size)
+        self._lock = threading.Lock()
+        self._in_flight = 0
+        # Callers waiting for a free slot, as (loop, future) in arrival order;
+        # each released slot wakes the first of them
+        self._waiters: "deque[Tuple[asyncio.AbstractEventLoop, asyncio.Future]]" = deque()
+        # Exponential moving average of a single call, used for Retry-After
+        self._avg_run_s = 1.0
+
+    @property
+    def workers(self) -> int:
+        return self._workers
+
+    @property
+    def capacity(self) -> int:
+        return self.workers + self.queue_size
+
+    @property
+    def in_flight(self) -> int:
+        return self._in_flight
+
+    @property
+    def queue_depth(self) -> int:
+        return max(0, self._in_flight - self.workers)
+
+    def retry_after(self) -> int:
+        """Seconds until a queue slot is likely to free up (at least 1)."""
+        waves = max(1, self.queue_depth) / self.workers
+        return max(1, math.ceil(waves * self._avg_run_s))
+
+    def _reserve_locked(self) -> Optional[int]:
+        """Takes a slot if one is free; returns the queue depth it got, or None."""
+        if self._in_flight >= self.capacity:
+            return None
+        self._in_flight += 1
+        return max(0, self._in_flight - self.workers)
+
+    def _release(self, future: Optional[Future] = None):
+        run_s = None
+        if future is not None and not future.cancelled() and future.exception() is None:
+            run_s = future.result()[2]
+        with self._lock:
+            self._in_flight -= 1
+            if run_s is not None:
+                self._avg_run_s = 0.8 * self._avg_run_s + 0.2 * run_s
+            self._wake_waiter_locked()
+
+    def _wake_waiter_locked(self):
+        # Called from any thread (futures complete on the workers' threads)
+        while self._waiters:
+            loop, waiter = self._waiters.popleft()
+            try:
+                loop.call_soon_threadsafe(_resolve, waiter)
+                return
+            except RuntimeError:
+                # Its event loop is closed
+                continue
+
+    def _wake_waiters(self):
+        """Wakes every waiting caller, e.g. after capacity grew."""
+        with self._lock:
+            while self._waiters:
+                self._wake_waiter_locked()
+
+    @abc.abstractmethod
+    def _submit(self, method: str, kwargs: Dict[str, Any], profile_path: Optional[str] = None) -> Future:
+        """
+        Schedules `method` on a worker. The returned future resolves to
+        (result, started, run_s) where `started` is a time.monotonic() stamp.
+        """
+
+    async def run(self, method: str, wait_for_slot: bool = False, profile_path: Optional[str] = None,
+                  **kwargs) -> Tuple[Any, Dict[str, int]]:
+        """
+        Calls `method` on a worker's service with `kwargs`.
+
+        Returns the method's result together with queue statistics
+        (`queue_depth` at admission and `queue_wait` in milliseconds).
+        Raises QueueFullError without queueing when the pool is saturated,
+        unless `wait_for_slot` is set, in which case it waits for a slot.
+        With `profile_path`, the call runs under cProfile and its stats are
+        dumped there.
+        """
+        enqueued = time.monotonic()
+        depth = await self._admit(wait_for_slot)
+        try:
+            future = self._submit(method, kwargs, profile_path=profile_path)
+        except Exception:
+            self._release()
+            raise
+        # Release from the future itself so a cancelled request that is still
+        # running on a worker keeps holding its slot until the worker is free.
+        future.add_done_callback(self._release)
+        result, started, _ = await asyncio.wrap_future(future)
+
+        wait_ms = max(0, int((started - enqueued) * 1000))
+        return result, {"queue_depth": depth, "queue_wait": wait_ms}
+
+    async def _admit(self, wait_for_slot: bool) -> int:
+        loop = asyncio.get_running_loop()
+        woken = False
+        while True:
+            with self._lock:
+                depth = self._reserve_locked()
+                if depth is not None:
+                    return depth
+                if not wait_for_slot:
+                    raise QueueFullError(self.retry_after())
+                waiter = loop.create_future()
+                # A caller that was woken but beaten to the slot keeps its turn
+                if woken:
+                    self._waiters.appendleft((loop, waiter))
+                else:
+                    self._waiters.append((loop, waiter))
+            try:
+                await waiter
+            except asyncio.CancelledError:
+                with self._lock:
+                    try:
+                        self._waiters.remove((loop, waiter))
+                    except ValueError:
+                        # Already woken: pass the free slot on
+                        self._wake_waiter_locked()
+                raise
+            woken = True
+
+    @abc.abstractmethod
+    def _submit_stream(self, method: str, kwargs: Dict[str, Any],
+                       on_start: Callable[[float], None], on_item: Callable[[Any], None],
+                       profile_path: Optional[str] = None) -> Future:
+        """
+        Schedules generator `method` on a worker. `on_start` gets the
+        time.monotonic() stamp the worker picked the call up at, and `on_item`
+        every yielded item; both may be called from any thread. The returned
+        future resolves like _submit's once the generator is exhausted.
+        """
+
+    async def stream(self, method: str, stats: Optional[Dict[str, int]] = None,
+                     wait_for_slot: bool = False, profile_path: Optional[str] = None,
+                     **kwargs) -> AsyncIterator[Any]:
+        """
+        Iterates, as they are produced, the items yielded by generator
+        `method` of a worker's service. Admission and profiling work as in
+        run(); the queue statistics are written into `stats` before the
+        first item.
+        """
+        loop = asyncio.get_running_loop()
+        items: asyncio.Queue = asyncio.Queue()
+        finished = object()
+        enqueued = time.monotonic()
+        depth = await self._admit(wait_for_slot)
+        if stats is not None:
+            stats.update(queue_depth=depth, queue_wait=0)
+
+        def on_start(started: float):
+            if stats is not None:
+                stats["queue_wait"] = max(0, int((started - enqueued) * 1000))
+
+        def on_item(item: Any):
+            loop.call_soon_threadsafe(items.put_nowait, item)
+
+        try:
+            future = self._submit_stream(method, kwargs, on_start, on_item, profile_path)
+        except Exception:
+            self._release()
+            raise
+        future.add_done_callback(self._release)
+        future.add_done_callback(lambda _: loop.call_soon_threadsafe(items.put_nowait, finished))
+
+        while True:
+            item = await items.get()
+            if item is finished:
+                break
+            yield item
+        # Surface a failure of the worker after the items it did produce
+        future.result()
+
+    @abc.abstractmethod
+    async def warmup(self) -> List[Dict[str, Any]]:
+        """
+        Loads and warms the service of every worker. Returns one report
+        (the service's warmup() result) per worker.
+        """
+
+    @abc.abstractmethod
+    def shutdown(self, wait: bool = True):
+        """Stops the workers, waiting for running calls if `wait`."""
+
+
+class ThreadEnginePool(EnginePool):
+    """
+    Engine pool backed by threads. Each worker thread owns its own service
+    (and therefore its own model instance).
+    """
+
+    def __init__(self, workers: int = 1, queue_size: int = 8,
+                 service_factory: Optional[Callable[[], Any]] = None):
+        super().__init__(workers, queue_size)
+        self._service_factory = service_factory or ExtractionService
+        self._executor = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix="engine")
+        self._local = threading.local()
+
+    def _service(self):
+        service = getattr(self._local, "service", None)
+        if service is None:
+            logger.info(f"Creating extraction service for {threading.current_thread().name}")
+            service = self._local.service = self._service_factory()
+        return service
+
+    def _submit(self, method: str, kwargs: Dict[str, Any], profile_path: Optional[str] = None) -> Future:
+        return self._executor.submit(
+            lambda: timed_call(self._service(), method, kwargs, profile_path=profile_path)
+        )
+
+    def _submit_stream(self, method, kwargs, on_start, on_item, profile_path=None) -> Future:
+        def iterate():
+            service = self._service()
+            started = time.monotonic()
+            on_start(started)
+            with profiled(profile_path):
+                for item in getattr(service, method)(**kwargs):
+                    on_item(item)
+            return None, started, time.monotonic() - started
+
+        return self._executor.submit(iterate)
+
+    async def warmup(self) -> List[Dict[str, Any]]:
+        # Hold every warmed thread at a barrier until all have warmed, so each
+        # of the `workers` calls lands on a different thread
+        barrier = threading.Barrier(self.workers)
+
+        def warm():
+            report = self._service().warmup()
+            try:
+                barrier.wait(timeout=600)
+            except threading.BrokenBarrierError:
+                pass
+            return report
+
+        futures = [self._executor.submit(warm) for _ in range(self.workers)]
+        try:
+            return await asyncio.gather(*(asyncio.wrap_future(f) for f in futures))
+        except BaseException:
+            barrier.abort()
+            raise
+
+    def shutdown(self, wait: bool = True):
+        self._executor.shutdown(wait=wait, cancel_futures=True)
+
+
+class ProcessEnginePool(EnginePool):
+    """
+    Engine pool backed by worker processes, each holding its own service, so
+    inference and Python post-processing scale past the GIL.
+
+    Bytes-like arguments (the uploaded image) are handed to workers through
+    shared memory instead of being pickled. If a worker dies the whole
+    executor is replaced, so crashed workers come back automatically; the
+    request that was running fails with EngineCrashedError.
+    """
+
+    def __init__(self, workers: int = 1, queue_size: int = 8,
+                 threads_per_worker: Optional[int] = None,
+                 service_factory: str = "app.services.extraction:ExtractionService",
+                 service_kwargs: Optional[Dict[str, Any]] = None):
+        super().__init__(workers, queue_size)
+        self.threads_per_worker = threads_per_worker
+        # The factory is passed by import path so that unpickling it in a fresh
+        # worker does not import Paddle before the thread settings are applied
+        self._service_factory = service_factory
+        if service_kwargs is None:
+            service_kwargs = {"cpu_threads": threads_per_worker}
+        self._service_kwargs = service_kwargs
+        self._executor_lock = threading.Lock()
+        self._executor = self._new_executor()
+
+    def _new_executor(self) -> ProcessPoolExecutor:
+        # Paddle is not fork-safe once initialised, so always spawn
+        return ProcessPoolExecutor(
+            max_workers=self.workers,
+            mp_context=multiprocessing.get_context("spawn"),
+            initializer=init_worker,
+            initargs=(self._service_factory, self._service_kwargs, self.threads_per_worker),
+        )
+
+    def _restart(self, broken: ProcessPoolExecutor):
+        with self._executor_lock:
+            if self._executor is broken:
+                logger.warning("Engine worker died, restarting worker processes")
+                self._executor = self._new_executor()
+                broken.shutdown(wait=False, cancel_futures=True)
+
+    def _submit(self, method: str, kwargs: Dict[str, Any], profile_path: Optional[str] = None,
+                collect: bool = False) -> Future:
+        kwargs = dict(kwargs)
+        shared, segments = {}, []
+        try:
+            for key, value in list(kwargs.items()):
+                if isinstance(value, (bytes, bytearray, memoryview)) and len(value) > 0:
+                    shm = shared_memory.SharedMemory(create=True, size=len(value))
+                    segments.append(shm)
+                    shm.buf[:len(value)] = value
+                    shared[key] = (shm.name, len(value))
+                    del kwargs[key]
+
+            executor = self._executor
+            try:
+                inner = executor.submit(worker_call, method, kwargs, shared, collect, profile_path)
+            except BrokenProcessPool:
+                self._restart(executor)
+                executor = self._executor
+                inner = executor.submit(worker_call, method, kwargs, shared, collect, profile_path)
+        except Exception:
+            self._free(segments)
+            raise
+
+        # Mark the outer future running straight away: cancelling the
+        # awaiting request must not free its slot while a worker still runs it
+        outer = Future()
+        outer.set_running_or_notify_cancel()
+
+        def done(f: Future):
+            self._free(segments)
+            if f.cancelled():
+                outer.set_exception(CancelledError())
+                return
+            exc = f.exception()
+            if isinstance(exc, BrokenProcessPool):
+                self._restart(executor)
+                exc = EngineCrashedError("Engine worker process crashed")
+            if exc is not None:
+                outer.set_exception(exc)
+            else:
+                outer.set_result(f.result())
+
+        inner.add_done_callback(done)
+        return outer
+
+    def _submit_stream(self, method, kwargs, on_start, on_item, profile_path=None) -> Future:
+        # Generators cannot be iterated across processes, so the worker
+        # collects all items and they are replayed here once it is done:
+        # process mode streams at the granularity of a whole call.
+        future = self._submit(method, kwargs, profile_path=profile_path, collect=True)
+        future.add_done_callback(lambda f: _replay(f, on_start, on_item))
+        return future
+
+    async def warmup(self) -> List[Dict[str, Any]]:
+        # Workers warm their service in the initializer, so a crashed worker is
+        # replaced by a warm one too. One call per worker makes the executor
+        # start all of its processes and waits until they are up.
+        futures = [self._executor.submit(worker_call, "warmup", {}, {}) for _ in range(self.workers)]
+        results = await asyncio.gather(*(asyncio.wrap_future(f) for f in futures))
+        return [report for report, _, _ in results]
+
+    @staticmethod
+    def _free(segments):
+        for shm in segments:
+            shm.close()
+            shm.unlink()
+
+    def shutdown(self, wait: bool = True):
+        self._executor.shutdown(wait=wait, cancel_futures=True)
+
+
+class RemoteEnginePool(EnginePool):
+    """
+    Engine pool whose calls run on worker nodes: each call becomes a task in
+    `queue` (an app.services.work_queue.WorkQueue on the volume all nodes
+    share), taken by the first free worker node with the same `options`.
+
+    `workers` is the number of engine workers those nodes have between
+    them, recounted every FLEET_REFRESH_S, so capacity grows as worker nodes are added; with none alive,
+    calls wait in the queue for one to start. As in process mode,
+    generators run to the end on the worker node and their items are
+    replayed here. A call whose worker node stopped responding is retried
+    on another one, up to the queue's attempts, then fails with
+    EngineCrashedError.
+    """
+
+    def __init__(self, queue, options: str, queue_size: int = 8):
+        # One worker until the first count of the worker nodes' slots
+        super().__init__(1, queue_size)
+        self.queue = queue
+        self.options = options
+        # task id -> (future, time.monotonic() it was queued at)
+        self._pending: Dict[int, Tuple[Future, float]] = {}
+        self._pending_lock = threading.Lock()
+        # Writes to the queue (uploads included) stay off the event loop
+        self._writer = ThreadPoolExecutor(max_workers=2, thread_name_prefix="work-queue")
+        self._stopped = threading.Event()
+        self._poller = threading.Thread(target=self._poll, name="work-queue-poller", daemon=True)
+        self._poller.start()
+
+    def _count_fleet(self, fleet: List[Dict[str, Any]]):
+        """
+        Takes the slots of the worker nodes in `fleet` as the pool's
+        workers. Callers waiting for a slot try again if they grew.
+        """
+        workers = max(1, sum(node["slots"] for node in fleet))
+        grew = workers > self._workers
+        self._workers = workers
+        if grew:
+            self._wake_waiters()
+
+    def _enqueue(self, future: Future, method: str, kwargs: Dict[str, Any], profile_path: Optional[str],
+                 collect: bool):
+        try:
+            task_id = self.queue.put(self.options, method, kwargs, collect=collect, profile_path=profile_path)
+        except Exception as e:
+            future.set_exception(e)
+            return
+        with self._pending_lock:
+            self._pending[task_id] = (future, time.monotonic())
+
+    def _submit(self, method: str, kwargs: Dict[str, Any], profile_path: Optional[str] = None,
+                collect: bool = False) -> Future:
+        # Running from the start, like ProcessEnginePool's: a cancelled
+        # request keeps its slot while a worker node still runs its task
+        future = Future()
+        future.set_running_or_notify_cancel()
+        self._writer.submit(self._enqueue, future, method, kwargs, profile_path, collect)
+        return future
+
+    def _submit_stream(self, method, kwargs, on_start, on_item, profile_path=None) -> Future:
+        future = self._submit(method, kwargs, profile_path=profile_path, collect=True)
+        future.add_done_callback(lambda f: _replay(f, on_start, on_item))
+        return future
+
+    def _poll(self):
+        # The worker nodes are counted here rather than when a call is
+        # admitted, which would query the queue on the event loop
+        fleet_checked = 0.0
+        while not self._stopped.wait(RESULT_POLL_S):
+            if time.monotonic() - fleet_checked >= FLEET_REFRESH_S:
+                fleet_checked = time.monotonic()
+                try:
+                    self._count_fleet(self.queue.fleet(self.options))
+                except Exception as e:
+                    logger.warning(f"Counting worker nodes failed: {e}")
+            with self._pending_lock:
+                task_ids = list(self._pending)
+            try:
+                finished = self.queue.take(task_ids)
+            except Exception as e:
+                logger.warning(f"Polling the work queue failed: {e}")
+                continue
+            for task in finished:
+                with self._pending_lock:
+                    future, enqueued = self._pending.pop(task.id, (None, 0.0))
+                if future is None:
+                    continue
+                if task.status == "done":
+                    future.set_result((task.value, enqueued + task.queue_wait_s, task.run_s))
+                elif task.status == "failed":
+                    future.set_exception(task.value)
+                else:
+                    future.set_exception(EngineCrashedError("Worker nodes crashed or stopped responding on every attempt"))
+
+    async def warmup(self) -> List[Dict[str, Any]]:
+        # Worker nodes warm up before they take work: wait for the first one
+        while True:
+            fleet = await asyncio.to_thread(self.queue.fleet, self.options)
+            if fleet:
+                self._count_fleet(fleet)
+                return fleet
+            await asyncio.sleep(FLEET_REFRESH_S)
+
+    def shutdown(self, wait: bool = True):
+        self._stopped.set()
+        self._writer.shutdown(wait=wait, cancel_futures=True)
+        with self._pending_lock:
+            pending, self._pending = self._pending, {}
+        try:
+            self.queue.discard(list(pending))
+        except Exception as e:
+            logger.warning(f"Discarding queued tasks failed: {e}")
+        for future, _ in pending.values():
+            future.set_exception(CancelledError())
+
+
+def _resolve(waiter: asyncio.Future):
+    if not waiter.done():
+        waiter.set_result(None)
+
+
+def _replay(future: Future, on_start: Callable[[float], None], on_item: Callable[[Any], None]):
+    """Feeds the items a whole generator call collected to a stream's callbacks."""
+    if future.cancelled() or future.exception() is not None:
+        return
+    items, started, _ = future.result()
+    on_start(started)
+    for item in items:
+        on_item(item)
+
+
+def create_engine_pool(mode: str = "thread", workers: int = 1, queue_size: int = 8,
+                       threads_per_worker: Optional[int] = None,
+                       service_kwargs: Optional[Dict[str, Any]] = None,
+                       work_queue=None, work_options: str = "") -> EnginePool:
+    """
+    Builds the engine pool selected by ENGINE_MODE ('thread', 'process' or
+    'remote'). `service_kwargs` are passed on to every worker's
+    ExtractionService; remote pools send their calls through `work_queue` to
+    worker nodes with `work_options` instead.
+    """
+    if mode == "remote":
+        if work_queue is None:
+            raise ValueError("ENGINE_MODE=remote needs a work queue")
+        return RemoteEnginePool(work_queue, work_options, queue_size=queue_size)
+    service_kwargs = {"cpu_threads": threads_per_worker, **(service_kwargs or {})}
+    if mode == "process":
+        return ProcessEnginePool(workers=workers, queue_size=queue_size,
+                                 threads_per_worker=threads_per_worker,
+                                 service_kwargs=service_kwargs)
+    if mode == "thread":
+        factory = lambda: ExtractionService(**service_kwargs)
+        return ThreadEnginePool(workers=workers, queue_size=queue_size, service_factory=factory)
+    raise ValueError(f"Unknown engine mode: {mode}")
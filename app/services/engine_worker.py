@@ -0,0 +1,124 @@
+"""
+Entry points for ProcessEnginePool worker processes.
+
+Keep this module free of heavy imports: a spawned worker imports it before
+init_worker runs, and the thread settings below only take effect if they are
+in the environment before Paddle is first imported.
+"""
+import cProfile
+import importlib
+import logging
+import os
+import sys
+import time
+from contextlib import contextmanager
+from multiprocessing import resource_tracker, shared_memory
+from typing import Any, Dict, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+# Read by the OpenMP / MKL / OpenBLAS runtimes that Paddle links against
+THREAD_ENV_VARS = ("OMP_NUM_THREADS", "MKL_NUM_THREADS", "OPENBLAS_NUM_THREADS")
+
+# The service owned by this worker process
+_service = None
+
+
+def resolve_factory(path: str):
+    """Resolves a 'package.module:attribute' path to the object it names."""
+    module_name, _, attr = path.partition(":")
+    return getattr(importlib.import_module(module_name), attr)
+
+
+@contextmanager
+def profiled(path: Optional[str]):
+    """Runs the block under cProfile and dumps the stats to `path`; a no-op without one."""
+    if path is None:
+        yield
+        return
+    profiler = cProfile.Profile()
+    try:
+        profiler.enable()
+    except ValueError as e:
+        # Python 3.12+ allows one active profiler per process
+        logger.warning(f"Not profiling to {path}: {e}")
+        yield
+        return
+    try:
+        yield
+    finally:
+        profiler.disable()
+        try:
+            profiler.dump_stats(path)
+        except OSError as e:
+            logger.warning(f"Could not write profile {path}: {e}")
+
+
+def timed_call(service, method: str, kwargs: Dict[str, Any], collect: bool = False,
+               profile_path: Optional[str] = None):
+    """
+    Calls `method` and returns (result, started, run_s). With `collect`, the
+    method is a generator and the result is the list of items it yielded.
+    """
+    started = time.monotonic()
+    with profiled(profile_path):
+        result = getattr(service, method)(**kwargs)
+        if collect:
+            result = list(result)
+    return result, started, time.monotonic() - started
+
+
+def init_worker(factory_path: str, factory_kwargs: Dict[str, Any], threads: Optional[int]):
+    global _service
+    # Spawned workers inherit the parent's sys.path, which by now includes the
+    # package directories paddleocr inserts into it on import. Left in place
+    # they shadow the paddleocr package itself with its paddleocr.py module.
+    # paddleocr adds them back when it is imported here.
+    sys.path[:] = [p for p in sys.path if not os.path.isfile(os.path.join(p or ".", "__init__.py"))]
+    if threads:
+        for var in THREAD_ENV_VARS:
+            os.environ[var] = str(threads)
+    logger.info(f"Engine worker {os.getpid()} starting (threads={threads or 'default'})")
+    _service = resolve_factory(factory_path)(**factory_kwargs)
+    if hasattr(_service, "warmup"):
+        _service.warmup()
+
+
+def _attach_shared_memory(name: str) -> shared_memory.SharedMemory:
+    shm = shared_memory.SharedMemory(name=name)
+    # The parent owns the segment and unlinks it. Without this the worker's
+    # resource tracker would also try to clean it up when the worker exits.
+    resource_tracker.unregister(shm._name, "shared_memory")
+    return shm
+
+
+def worker_call(method: str, kwargs: Dict[str, Any], shared: Dict[str, Tuple[str, int]],
+                collect: bool = False, profile_path: Optional[str] = None):
+    """
+    Runs `method` on this worker's service. `shared` maps argument names to
+    (segment name, size) of shared memory the parent filled in for them.
+    """
+    segments = []
+    try:
+        for key, (name, size) in shared.items():
+            shm = _attach_shared_memory(name)
+            segments.append(shm)
+            kwargs[key] = shm.buf[:size]
+        return timed_call(_service, method, kwargs, collect, profile_path)
+    finally:
+        # Views into the segments must be dropped before they can be closed.
+        # Arrays the service built on them may outlive the call (held by the
+        # traceback of an exception it raised): the mapping then stays until
+        # they are collected, rather than masking the call's own error.
+        for key in shared:
+            view = kwargs.pop(key, None)
+            if view is not None:
+                try:
+                    view.release()
+                except BufferError:
+                    pass
+        for shm in segments:
+            try:
+                shm.close()
+            except BufferError:
+                logger.debug(f"Shared memory {shm.name} is still in use, left mapped")
@@ -0,0 +1,219 @@
+"""
+The OCR and layout engines a request selects with `ocr_engine` and
+`layout_engine`.
+
+Layout comes from PP-Structure's layout model ("paddle") or is skipped
+("none"), in which case the page's text lines are grouped into paragraph
+blocks by their spacing. Text is read by an OCR reader: PaddleOCR's text
+system, Tesseract or docTR. The last two are optional dependencies and are
+only loaded when a request asks for them.
+"""
+import importlib.util
+import shutil
+import time
+from typing import Any, Dict, List, Optional, Tuple
+
+import cv2
+import numpy as np
+
+from app.services.pipeline import classify_lines, detect_lines, to_lines
+
+OCR_ENGINES = ("paddle", "doctr", "tesseract")
+LAYOUT_ENGINES = ("paddle", "none")
+DEFAULT_OCR_ENGINE = "paddle"
+DEFAULT_LAYOUT_ENGINE = "paddle"
+# Earlier versions of the API contract named the layout model after detectron2
+LAYOUT_ALIASES = {"detectron2": "paddle"}
+
+# Module each optional OCR engine needs, and the executable it drives (if any)
+OPTIONAL_ENGINES = {"doctr": ("doctr", None), "tesseract": ("pytesseract", "tesseract")}
+
+# A gap between lines wider than this many line heights starts a new block
+PARAGRAPH_GAP = 1.0
+
+
+class UnknownEngineError(ValueError):
+    """Raised for an ocr_engine or layout_engine this server does not know."""
+
+
+class EngineUnavailableError(RuntimeError):
+    """Raised when a known OCR engine is not installed on this server."""
+
+    def __init__(self, engine: str):
+        super().__init__(engine)
+        self.engine = engine
+
+    def __str__(self):
+        return f"OCR engine '{self.engine}' is not installed on this server."
+
+
+def resolve_engines(ocr_engine: Optional[str], layout_engine: Optional[str]) -> Tuple[str, str]:
+    """Validates and normalises the engines a request asked for."""
+    ocr_engine = (ocr_engine or DEFAULT_OCR_ENGINE).lower()
+    layout_engine = (layout_engine or DEFAULT_LAYOUT_ENGINE).lower()
+    layout_engine = LAYOUT_ALIASES.get(layout_engine, layout_engine)
+    if ocr_engine not in OCR_ENGINES:
+        raise UnknownEngineError(f"Unknown ocr_engine '{ocr_engine}', expected one of: {', '.join(OCR_ENGINES)}.")
+    if layout_engine not in LAYOUT_ENGINES:
+        raise UnknownEngineError(
+            f"Unknown layout_engine '{layout_engine}', expected one of: {', '.join(LAYOUT_ENGINES)}."
+        )
+    return ocr_engine, layout_engine
+
+
+def check_available(ocr_engine: str):
+    """Raises EngineUnavailableError unless the engine's optional dependencies are installed."""
+    module, executable = OPTIONAL_ENGINES.get(ocr_engine, (None, None))
+    if module and importlib.util.find_spec(module) is None:
+        raise EngineUnavailableError(ocr_engine)
+    if executable and shutil.which(executable) is None:
+        raise EngineUnavailableError(ocr_engine)
+
+
+def _quad(x1: float, y1: float, x2: float, y2: float) -> List[List[float]]:
+    return [[x1, y1], [x2, y1], [x2, y2], [x1, y2]]
+
+
+class PaddleReader:
+    """Plain text detection and recognition with the models of a PPStructure engine."""
+
+    def __init__(self, text_system, recognize=None):
+        self.text_system = text_system
+        # Recognition goes through the shared batcher in pipeline mode
+        self.recognize = recognize or text_system.text_recognizer
+
+    def read(self, img: np.ndarray) -> Tuple[List[Dict[str, Any]], Dict[str, float]]:
+        boxes, crops, det_s = detect_lines(self.text_system, img)
+        crops, cls_s = classify_lines(self.text_system, crops)
+        rec_res, rec_s = self.recognize(crops) if crops else ([], 0.0)
+        lines = to_lines(boxes, rec_res, self.text_system.drop_score)
+        return lines, {'det': det_s + cls_s, 'rec': rec_s}
+
+
+class TesseractReader:
+    """Tesseract through pytesseract; words are joined into Tesseract's own lines."""
+
+    def __init__(self, lang: str = "eng"):
+        import pytesseract
+        self._tesseract = pytesseract
+        self.lang = lang
+
+    def read(self, img: np.ndarray) -> Tuple[List[Dict[str, Any]], Dict[str, float]]:
+        t_start = time.perf_counter()
+        data = self._tesseract.image_to_data(
+            cv2.cvtColor(img, cv2.COLOR_BGR2RGB), lang=self.lang, output_type=self._tesseract.Output.DICT
+        )
+        words: Dict[Tuple[int, int, int], List[int]] = {}
+        for i, text in enumerate(data["text"]):
+            if text.strip() and float(data["conf"][i]) >= 0:
+                words.setdefault((data["block_num"][i], data["par_num"][i], data["line_num"][i]), []).append(i)
+        lines = []
+        for indices in words.values():
+            x1 = min(data["left"][i] for i in indices)
+            y1 = min(data["top"][i] for i in indices)
+            x2 = max(data["left"][i] + data["width"][i] for i in indices)
+            y2 = max(data["top"][i] + data["height"][i] for i in indices)
+            lines.append({
+                'text': " ".join(data["text"][i] for i in indices),
+                'confidence': float(np.mean([float(data["conf"][i]) for i in indices])) / 100,
+                'text_region': _quad(x1, y1, x2, y2),
+            })
+        # Tesseract does not time detection and recognition separately
+        return lines, {'det': 0.0, 'rec': time.perf_counter() - t_start}
+
+
+class DoctrReader:
+    """docTR's pretrained detection + recognition predictor."""
+
+    def __init__(self):
+        from doctr.models import ocr_predictor
+        self.model = ocr_predictor(pretrained=True)
+
+    def read(self, img: np.ndarray) -> Tuple[List[Dict[str, Any]], Dict[str, float]]:
+        t_start = time.perf_counter()
+        height, width = img.shape[:2]
+        page = self.model([cv2.cvtColor(img, cv2.COLOR_BGR2RGB)]).pages[0]
+        lines = []
+        for block in page.blocks:
+            for line in block.lines:
+                if not line.words:
+                    continue
+                # docTR geometry is relative to the page size
+                (x1, y1), (x2, y2) = line.geometry
+                lines.append({
+                    'text': " ".join(word.value for word in line.words),
+                    'confidence': float(np.mean([word.confidence for word in line.words])),
+                    'text_region': _quad(x1 * width, y1 * height, x2 * width, y2 * height),
+                })
+        return lines, {'det': 0.0, 'rec': time.perf_counter() - t_start}
+
+
+def _line_bounds(line: Dict[str, Any]) -> Tuple[float, float, float, float]:
+    points = np.asarray(line['text_region'], dtype=np.float32)
+    return (*points.min(axis=0), *points.max(axis=0))
+
+
+def group_lines(lines: List[Dict[str, Any]], width: int, height: int) -> List[Dict[str, Any]]:
+    """
+    Groups lines, top to bottom, into paragraph regions (PPStructure's
+    region format) wherever the vertical gap between consecutive lines is
+    wider than PARAGRAPH_GAP line heights.
+    """
+    if not lines:
+        return []
+    bounds = [_line_bounds(line) for line in lines]
+    order = sorted(range(len(lines)), key=lambda i: (bounds[i][1], bounds[i][0]))
+    line_height = float(np.median([b[3] - b[1] for b in bounds])) or 1.0
+
+    groups = [[order[0]]]
+    for prev, i in zip(order, order[1:]):
+        if bounds[i][1] - bounds[prev][3] > PARAGRAPH_GAP * line_height:
+            groups.append([])
+        groups[-1].append(i)
+
+    regions = []
+    for group in groups:
+        x1 = min(bounds[i][0] for i in group)
+        y1 = min(bounds[i][1] for i in group)
+        x2 = max(bounds[i][2] for i in group)
+        y2 = max(bounds[i][3] for i in group)
+        regions.append({
+            'type': 'text',
+            'bbox': [
+                max(0, int(np.floor(x1))), max(0, int(np.floor(y1))),
+                min(width, int(np.ceil(x2))), min(height, int(np.ceil(y2))),
+            ],
+            'res': [lines[i] for i in group],
+        })
+    return regions
+
+
+def read_regions(engine, img: np.ndarray, reader) -> Tuple[List[Dict[str, Any]], Dict[str, float]]:
+    """
+    Runs PP-Structure's layout model, then `reader` on every non-table
+    region. Returns regions and stage times like StructureSystem.
+    """
+    layout_res, layout_s = engine.layout_predictor(img)
+    time_dict = {'layout': layout_s, 'det': 0.0, 'rec': 0.0}
+    regions = []
+    for layout_region in layout_res:
+        x1, y1, x2, y2 = (int(v) for v in layout_region['bbox'])
+        roi_img = img[y1:y2, x1:x2, :]
+        region = {'type': layout_region['label'].lower(), 'bbox': [x1, y1, x2, y2], 'img': roi_img, 'res': ''}
+        regions.append(region)
+        if layout_region['label'] == 'table' or roi_img.size == 0:
+            continue
+        lines, times = reader.read(roi_img)
+        for line in lines:
+            line['text_region'] = [[x + x1, y + y1] for x, y in line['text_region']]
+        region['res'] = lines
+        time_dict['det'] += times['det']
+        time_dict['rec'] += times['rec']
+    return regions, time_dict
+
+
+def read_page(img: np.ndarray, reader) -> Tuple[List[Dict[str, Any]], Dict[str, float]]:
+    """Reads the whole page without a layout model (layout_engine=none)."""
+    lines, times = reader.read(img)
+    height, width = img.shape[:2]
+    return group_lines(lines, width, height), {'layout': 0.0, **times}
@@ -1,198 +1,440 @@
 import cv2
 import numpy as np
 import logging
+import time
 from pathlib import Path
 from paddleocr import PPStructure
-from paddleocr.ppstructure.recovery.recovery_to_doc import sorted_layout_boxes
-from PIL import Image
+# The class PPStructure derives from, as paddleocr itself imports it;
+# paddleocr.ppstructure.predict_system would load a second copy of its module
+from paddleocr.paddleocr import StructureSystem
+from typing import Optional
+
+from app.services.artifacts import get_artifact_writer
+from app.services.engines import (
+    DEFAULT_LAYOUT_ENGINE, DEFAULT_OCR_ENGINE, DoctrReader, EngineUnavailableError, PaddleReader,
+    TesseractReader, check_available, read_page, read_regions, resolve_engines,
+)
+from app.services.image_ingest import decode_image, resize_image
+from app.services.inference_profiles import DEFAULT_INFERENCE_PROFILE, profile_engine_kwargs
+from app.services.layout import line_bboxes, reading_order
+from app.services.pipeline import get_recognition_batcher, run_pipeline
+from app.services.region_cache import CachedTextSystem, get_region_cache
+from app.services.streaming import collect_page
+from app.services.tiling import plan_inference
+from app.services.triage import PageTriage, triage_page
 
 logger = logging.getLogger(__name__)
 
+def _synthetic_page() -> np.ndarray:
+    """A small book-like page (title, a few text lines, a figure) for warm-up."""
+    page = np.full((1000, 800, 3), 255, dtype=np.uint8)
+    cv2.putText(page, "Chapter One", (80, 120), cv2.FONT_HERSHEY_SIMPLEX, 1.6, (0, 0, 0), 3)
+    for i in range(8):
+        cv2.putText(page, "The quick brown fox jumps over the lazy dog.", (80, 200 + i * 40),
+                    cv2.FONT_HERSHEY_SIMPLEX, 0.8, (0, 0, 0), 2)
+    cv2.rectangle(page, (80, 560), (720, 900), (90, 90, 90), -1)
+    return page
+
+def _remap_regions(results, sx: float, sy: float, width: int, height: int):
+    """
+    Maps region bboxes from the resized image back onto the original. Line
+    polygons are scaled when their boxes are computed (layout.line_bboxes).
+    """
+    for region in results:
+        x1, y1, x2, y2 = region['bbox']
+        region['bbox'] = [
+            min(width, max(0, int(round(x1 * sx)))),
+            min(height, max(0, int(round(y1 * sy)))),
+            min(width, max(0, int(round(x2 * sx)))),
+            min(height, max(0, int(round(y2 * sy)))),
+        ]
+
+def _write_artifacts(writer, img: np.ndarray, figure_crops, annotated_file: Optional[Path], boxes):
+    """
+    Writes the figure crops, then draws the block boxes onto the page
+    itself (the request is done with it, so no copy is needed) and writes
+    the annotated preview. Crops are views into the page, hence the order.
+    """
+    for path, crop_img in figure_crops:
+        writer.write_image(path, crop_img)
+    if annotated_file is not None:
+        for block_id, (x1, y1, x2, y2) in boxes:
+            cv2.rectangle(img, (x1, y1), (x2, y2), (0, 255, 0), 2)
+            cv2.putText(img, block_id, (x1, y1-5), cv2.FONT_HERSHEY_SIMPLEX, 0.5, (0,255,0), 1)
+        writer.write_image(annotated_file, img)
+
 class ExtractionService:
-    def __init__(self):
+    def __init__(self, cpu_threads: Optional[int] = None, max_side: int = 0, target_text_px: int = 0,
+                 pipeline: bool = False, rec_batch_size: int = 32, rec_batch_wait_ms: float = 5,
+                 artifact_format: str = "png", artifact_quality: int = 90, artifact_png_compression: int = 3,
+                 artifact_workers: int = 4,
+                 region_cache_path: Optional[str] = None, region_cache_entries: int = 100_000,
+                 region_cache_mb: int = 0, inference_profile: str = DEFAULT_INFERENCE_PROFILE):
         # Initialize PP-Structure (English)
         # table=False because we focus on general layout/text/figures for this MVP
         # recovery=True allows us to get structured results
-        logger.info("Initializing PaddleOCR PP-Structure...")
+        # cpu_threads caps Paddle's CPU math threads; None keeps Paddle's default
+        # max_side / target_text_px downscale large pages before inference (0 = off)
+        # pipeline splits layout/detection from batched recognition (see app.services.pipeline)
+        # artifact_* configure the background writer of figure crops and annotated previews
+        # region_cache_* reuse the text of regions seen before (see app.services.region_cache)
+        # inference_profile picks models and CPU settings (see app.services.inference_profiles)
+        logger.info(f"Initializing PaddleOCR PP-Structure ({inference_profile} profile)...")
+        t_load_start = time.perf_counter()
+        engine_kwargs = profile_engine_kwargs(inference_profile)
+        if cpu_threads:
+            engine_kwargs["cpu_threads"] = cpu_threads
+        if pipeline:
+            engine_kwargs["rec_batch_num"] = rec_batch_size
         self.engine = PPStructure(
             show_log=False,
             image_orientation=False,
             lang='en',
             layout=True,
             table=False, 
-            ocr=True
+            ocr=True,
+            **engine_kwargs
         )
+        self.load_ms = int((time.perf_counter() - t_load_start) * 1000)
+        self.warmup_ms = None
+        # PPStructure.__call__ throws away the per-stage times its base class
+        # (StructureSystem) measures; calling the base directly keeps them
+        self._structure_call = None
+        if isinstance(self.engine, StructureSystem):
+            self._structure_call = StructureSystem.__call__
+        self.max_side = max_side
+        self.target_text_px = target_text_px
+        self.recognition = None
+        if pipeline:
+            self.recognition = get_recognition_batcher(
+                self.engine.text_system.text_recognizer, rec_batch_size, rec_batch_wait_ms
+            )
+        self.region_cache = None
+        if region_cache_path and region_cache_mb > 0:
+            cache = get_region_cache(Path(region_cache_path), region_cache_entries, region_cache_mb * 1024 * 1024)
+            self.region_cache = self.engine.text_system = CachedTextSystem(
+                self.engine.text_system, cache, namespace=f"paddle-{inference_profile}"
+            )
+        self.artifacts = get_artifact_writer(
+            artifact_workers, artifact_format, artifact_quality, artifact_png_compression
+        )
+        # OCR readers other than PPStructure's own pass, created on first use
+        self._readers = {}
+
+    def get_reader(self, ocr_engine: str):
+        """Returns the (cached) reader of `ocr_engine`, loading it on first use."""
+        reader = self._readers.get(ocr_engine)
+        if reader is None:
+            check_available(ocr_engine)
+            logger.info(f"Loading OCR engine {ocr_engine}...")
+            try:
+                if ocr_engine == "paddle":
+                    recognize = self.recognition.recognize if self.recognition is not None else None
+                    reader = PaddleReader(self.engine.text_system, recognize)
+                elif ocr_engine == "tesseract":
+                    reader = TesseractReader()
+                else:
+                    reader = DoctrReader()
+            except ImportError:
+                raise EngineUnavailableError(ocr_engine)
+            self._readers[ocr_engine] = reader
+        return reader
+
+    def warmup(self):
+        """
+        Runs the engine once on a synthetic page so the first real request does
+        not pay for lazy initialisation. Safe to call more than once.
+        Returns the model load and warm-up times in milliseconds.
+        """
+        if self.warmup_ms is None:
+            t_start = time.perf_counter()
+            self._run_engine(_synthetic_page())
+            self.warmup_ms = int((time.perf_counter() - t_start) * 1000)
+            logger.info(f"Engine warmed up in {self.warmup_ms} ms (load {self.load_ms} ms)")
+        return {"load_ms": self.load_ms, "warmup_ms": self.warmup_ms}
+
+    def _run_engine(self, img: np.ndarray, ocr_engine: str = DEFAULT_OCR_ENGINE,
+                    layout_engine: str = DEFAULT_LAYOUT_ENGINE):
+        """
+        Runs the requested engines on the page. Returns the regions and the
+        engines' own stage times in seconds (layout, det, rec), or None if
+        not available. With the region cache, the times also count the
+        regions it answered (region_cache_hits) and did not
+        (region_cache_misses).
+        """
+        if self.region_cache is None:
+            return self._call_engines(img, ocr_engine, layout_engine)
+        hits, misses = self.region_cache.hits, self.region_cache.misses
+        results, engine_times = self._call_engines(img, ocr_engine, layout_engine)
+        if engine_times is not None:
+            engine_times = {
+                **engine_times,
+                "region_cache_hits": self.region_cache.hits - hits,
+                "region_cache_misses": self.region_cache.misses - misses,
+            }
+        return results, engine_times
+
+    def _call_engines(self, img: np.ndarray, ocr_engine: str, layout_engine: str):
+        if layout_engine == "none":
+            return read_page(img, self.get_reader(ocr_engine))
+        if ocr_engine != "paddle":
+            return read_regions(self.engine, img, self.get_reader(ocr_engine))
+        if self.recognition is not None:
+            return run_pipeline(self.engine, img, self.recognition.recognize, self.region_cache)
+        if self._structure_call is None:
+            return self.engine(img), None
+        return self._structure_call(self.engine, img)
+
+    def extract_tile(self, pixels, shape, ocr_engine: str = DEFAULT_OCR_ENGINE,
+                     layout_engine: str = DEFAULT_LAYOUT_ENGINE):
+        """
+        Runs the engines on one tile of a page, given as its raw BGR pixels
+        (a flat buffer of `shape`). Returns the regions in tile coordinates,
+        without their crops, and the engines' stage times.
+        """
+        tile = np.frombuffer(pixels, np.uint8).reshape(shape)
+        results, engine_times = self._run_engine(tile, *resolve_engines(ocr_engine, layout_engine))
+        return [{key: value for key, value in region.items() if key != 'img'} for region in results], engine_times
     
-    def run_extraction(self, image_bytes: bytes, request_id: str, output_dir: Path, store_outputs: bool, return_annotated: bool):
+    def run_extraction(self, image_bytes: bytes, request_id: str, output_dir: Path, store_outputs: bool, return_annotated: bool,
+                       ocr_engine: str = DEFAULT_OCR_ENGINE, layout_engine: str = DEFAULT_LAYOUT_ENGINE,
+                       triage: bool = False):
         """
         Runs layout analysis and OCR on the provided image bytes.
         Returns the structured response data (meta, blocks, figures, exports).
+        With `triage`, blank and figure-only pages skip the engines (see
+        app.services.triage).
         """
-        import time
-        t_start = time.time()
-        
-        # 1. Load image
-        # Convert bytes to numpy array for cv2
-        nparr = np.frombuffer(image_bytes, np.uint8)
-        img = cv2.imdecode(nparr, cv2.IMREAD_COLOR)
-        if img is None:
-             raise ValueError("Could not decode image")
+        return collect_page(self.iter_extraction(
+            image_bytes, request_id, output_dir, store_outputs, return_annotated, ocr_engine, layout_engine, triage
+        ))
+
+    def iter_extraction(self, image_bytes: bytes, request_id: str, output_dir: Path, store_outputs: bool, return_annotated: bool,
+                        ocr_engine: str = DEFAULT_OCR_ENGINE, layout_engine: str = DEFAULT_LAYOUT_ENGINE,
+                        triage: bool = False):
+        """
+        Same as run_extraction, but yields streaming events (see
+        app.services.streaming): each block and figure as soon as it is
+        built, then a closing `meta` event with meta and exports.
+        """
+        t_start = time.perf_counter()
+        ocr_engine, layout_engine = resolve_engines(ocr_engine, layout_engine)
         
-        height, width, _ = img.shape
-        t_preprocess = (time.time() - t_start) * 1000
+        # 1. Load image (the only full decode of the upload)
+        img = decode_image(image_bytes)
+
+        page_triage = triage_page(img) if triage else None
+        if page_triage and page_triage.decision != "text":
+            yield from triaged_events(
+                img, page_triage, (time.perf_counter() - t_start) * 1000, request_id, output_dir, store_outputs,
+                return_annotated, ocr_engine, layout_engine, self.artifacts
+            )
+            return
+
+        # Downscale large pages; results are mapped back to the original below.
+        # Pages large enough to be tiled never get here (see iter_tiled_page in app.main)
+        scale, _ = plan_inference(img, self.max_side, self.target_text_px)
+        engine_img = resize_image(img, scale)
+        t_preprocess = (time.perf_counter() - t_start) * 1000
         
         # 2. Run Inference
-        t_layout_start = time.time()
+        t_layout_start = time.perf_counter()
         # parameters: img: ndarray
-        results = self.engine(img)
-        t_layout_end = time.time()
-        
-        # PaddleOCR returns a list of dicts. For PP-Structure, usually just one item for a single page image?
-        # Actually PPStructure returns a list of regions.
-        
-        blocks = []
-        figures = []
-        
-        # Helper to convert layout to our schema
-        # Paddle result structure: [{'type': 'text', 'bbox': [x1, y1, x2, y2], 'img': array, 'res': [{'text': '...', 'confidence': 0.9}, ...]}, ...]
-        
-        # We need to sort by reading order manually or rely on Paddle. 
-        # paddleocr.ppstructure.recovery.recovery_to_doc.sorted_layout_boxes sorts them.
-        # But `results` is ALREADY a list of regions.
-        
-        # Let's standardize the format
-        # Each 'region' in results has:
-        # - type: str
-        # - bbox: [x1, y1, x2, y2]
-        # - video-frame irrelevant
-        # - res: list of dict(text, confidence, text_region) OR single dict (for table)
-        # - img: cropped image of the region
+        results, engine_times = self._run_engine(engine_img, ocr_engine, layout_engine)
+        if engine_times is None:
+            engine_times = {"layout": time.perf_counter() - t_layout_start, "det": 0.0, "rec": 0.0}
+        yield from region_events(
+            img, engine_img.shape, results, engine_times, t_preprocess, request_id, output_dir, store_outputs,
+            return_annotated, ocr_engine, layout_engine, self.artifacts, page_triage=page_triage
+        )
+
+
+def triaged_events(img: np.ndarray, page_triage: PageTriage, t_preprocess: float, request_id: str,
+                   output_dir: Path, store_outputs: bool, return_annotated: bool, ocr_engine: str,
+                   layout_engine: str, artifacts):
+    """
+    The streaming events of a page triage found blank (no blocks) or
+    figure-only (one figure, cropped as usual), without running the engines.
+    """
+    return region_events(
+        img, img.shape, page_triage.regions, {"layout": 0.0, "det": 0.0, "rec": 0.0}, t_preprocess, request_id,
+        output_dir, store_outputs, return_annotated, ocr_engine, layout_engine, artifacts, page_triage=page_triage
+    )
+
+
+def region_events(img: np.ndarray, engine_shape, results, engine_times, t_preprocess: float, request_id: str,
+                  output_dir: Path, store_outputs: bool, return_annotated: bool, ocr_engine: str, layout_engine: str,
+                  artifacts, tiles: int = 1, page_triage: Optional[PageTriage] = None):
+    """
+    Turns the engines' regions for `img` into the page's streaming events.
+    `results` are in the coordinates of the image the engines ran on
+    (`engine_shape`); `engine_times` are their stage times in seconds.
+    Figure crops and the annotated preview go to `artifacts`. The
+    `page_triage` decision, if triage ran, is reported in meta.
+    """
+    height, width = img.shape[:2]
+    processed_height, processed_width = engine_shape[:2]
+    scaled = (processed_width, processed_height) != (width, height)
+    if scaled:
+        _remap_regions(results, width / processed_width, height / processed_height, width, height)
+    # PaddleOCR returns a list of dicts. For PP-Structure, usually just one item for a single page image?
+    # Actually PPStructure returns a list of regions.
+    
+    blocks = []
+    figures = []
+    
+    # Helper to convert layout to our schema
+    # Paddle result structure: [{'type': 'text', 'bbox': [x1, y1, x2, y2], 'img': array, 'res': [{'text': '...', 'confidence': 0.9}, ...]}, ...]
+    
+    # Let's standardize the format
+    # Each 'region' in results has:
+    # - type: str
+    # - bbox: [x1, y1, x2, y2]
+    # - video-frame irrelevant
+    # - res: list of dict(text, confidence, text_region) OR single dict (for table)
+    # - img: cropped image of the region
+    
+    # Reading order: top to bottom, column by column on multi-column pages
+    results = [results[i] for i in reading_order([region['bbox'] for region in results], width)]
+
+    # Line boxes of the whole page in one pass, in page coordinates
+    page_lines = [line for region in results if isinstance(region.get('res'), list) for line in region['res']]
+    page_line_bboxes = iter(line_bboxes(
+        page_lines, width / processed_width, height / processed_height, width, height
+    ))
+    
+    # PPStructure runs OCR internally on the text regions, so layout and OCR
+    # can only be told apart with the engine's own stage times
+    layout_time = engine_times['layout']
+    total_ocr_time = engine_times['det'] + engine_times['rec']
+    
+    crop_time_start = time.perf_counter()
+    figure_crops = []
+    
+    for idx, region in enumerate(results):
+        region_type = region.get('type', 'unknown').lower()
+        bbox = region.get('bbox') # [x1, y1, x2, y2]
         
-        # Sorting
-        # We can implement a simple top-to-bottom sort based on bbox y1
-        results.sort(key=lambda x: x['bbox'][1])
+        # Map Paddle types to our Contract types
+        # Paddle: title, text, figure, table, header, footer, reference, equation
+        # Contract: title, text, list, table, figure
+        mapped_type = 'text'
+        if region_type == 'figure': mapped_type = 'figure'
+        elif region_type == 'table': mapped_type = 'table'
+        elif region_type == 'title': mapped_type = 'title'
+        elif region_type == 'list': mapped_type = 'list'
         
-        total_ocr_time = 0 # Included in layout time for PPStructure usually, unless we separate it. 
-                           # Implementation detail: PPStructure runs OCR internally on text regions.
+        block_id = f"b{idx+1}"
         
-        crop_time_start = time.time()
+        # Extract text and lines
+        block_text = ""
+        block_lines = []
+        block_conf = 0.0
         
-        for idx, region in enumerate(results):
-            region_type = region.get('type', 'unknown').lower()
-            bbox = region.get('bbox') # [x1, y1, x2, y2]
-            
-            # Map Paddle types to our Contract types
-            # Paddle: title, text, figure, table, header, footer, reference, equation
-            # Contract: title, text, list, table, figure
-            mapped_type = 'text'
-            if region_type == 'figure': mapped_type = 'figure'
-            elif region_type == 'table': mapped_type = 'table'
-            elif region_type == 'title': mapped_type = 'title'
-            elif region_type == 'list': mapped_type = 'list'
-            
-            block_id = f"b{idx+1}"
-            
-            # Extract text and lines
-            block_text = ""
-            block_lines = []
-            block_conf = 0.0
-            
-            res = region.get('res')
-            if isinstance(res, list):
-                # Text region
-                texts = [line['text'] for line in res]
-                block_text = "\n".join(texts)
-                confs = [line['confidence'] for line in res]
-                block_conf = float(np.mean(confs)) if confs else 0.0
-                
-                for line_res in res:
-                    line_text = line_res['text']
-                    line_conf = line_res['confidence']
-                    # Re-calculate line bbox if possible, or just skip local bbox if not provided
-                    # PPStructure often provides text_region inside res
-                    # but let's keep it simple for MVP
-                    block_lines.append({
-                        "bbox": [0,0,0,0], # Placeholder, extraction is complex here without more parsing
-                        "text": line_text,
-                        "confidence": line_conf
-                    })
-            
-            # Check for Figure
-            if mapped_type == 'figure':
-                # Save cropped image
-                fig_id = f"f{len(figures)+1}"
-                rel_path = None
-                if store_outputs:
-                    # The 'img' key in region contains the crop, but it might be drawn on? 
-                    # Actually safer to crop from original myself or use region['img']
-                    # region['img'] is an ndarray
-                    crop_img = region.get('img')
-                    if crop_img is not None:
-                         # Save it
-                         fname = f"{fig_id}_{region_type}.png"
-                         # output_dir is /outputs/<request_id>/
-                         # We need to make sure we don't save if not requested, but logic says store_outputs
-                         # rel_path is "figures/..." relative to request dir?
-                         # Contract says: relative path ... typically under /outputs/<request_id>/...
-                         save_path = output_dir / fname
-                         cv2.imwrite(str(save_path), crop_img)
-                         rel_path = f"/outputs/{request_id}/{fname}"
-
-                figures.append({
-                    "id": fig_id,
-                    "bbox": bbox,
-                    "image_path": rel_path or "", # Contract requires string
-                    "caption": None,
-                    "confidence": region.get('score', 0.9) # Layout score
-                })
-            
-            blocks.append({
-                "id": block_id,
-                "type": mapped_type,
-                "bbox": bbox,
-                "order": idx + 1,
-                "text": block_text,
-                "confidence": block_conf,
-                "lines": block_lines
-            })
-
-        t_crop_end = time.time()
+        res = region.get('res')
+        if isinstance(res, list):
+            # Text region
+            texts = [line['text'] for line in res]
+            block_text = "\n".join(texts)
+            confs = np.fromiter((line['confidence'] for line in res), dtype=np.float64, count=len(res))
+            block_conf = float(confs.mean()) if len(res) else 0.0
+            # page_line_bboxes goes last: zip must not pull a box past this block's lines
+            block_lines = [
+                {"bbox": line_bbox, "text": text, "confidence": conf}
+                for text, conf, line_bbox in zip(texts, confs.tolist(), page_line_bboxes)
+            ]
         
-        annotated_path = None
-        if store_outputs and return_annotated:
-            # We can use paddle's utility or draw ourselves. 
-            # Draw ourselves for simplicity and consistency
-            vis_img = img.copy()
-            for b in blocks:
-                x1, y1, x2, y2 = b['bbox']
-                cv2.rectangle(vis_img, (x1, y1), (x2, y2), (0, 255, 0), 2)
-                # Put ID
-                cv2.putText(vis_img, b['id'], (x1, y1-5), cv2.FONT_HERSHEY_SIMPLEX, 0.5, (0,255,0), 1)
-            
-            save_path = output_dir / "annotated.png"
-            cv2.imwrite(str(save_path), vis_img)
-            annotated_path = f"/outputs/{request_id}/annotated.png"
+        # Check for Figure
+        if mapped_type == 'figure':
+            # Save cropped image
+            fig_id = f"f{len(figures)+1}"
+            rel_path = None
+            if store_outputs:
+                # The 'img' key in region contains the crop, but it might be drawn on? 
+                # Actually safer to crop from original myself or use region['img']
+                # region['img'] is an ndarray, cut from the downscaled page if resized
+                # (tiled pages have none)
+                if not scaled and 'img' in region:
+                    crop_img = region['img']
+                else:
+                    x1, y1, x2, y2 = bbox
+                    crop_img = img[y1:y2, x1:x2]
+                if crop_img is not None:
+                     # Written in the background once the page is done
+                     fname = f"{fig_id}_{region_type}{artifacts.extension}"
+                     # output_dir is /outputs/<request_id>/
+                     # Contract says: relative path ... typically under /outputs/<request_id>/...
+                     figure_crops.append((output_dir / fname, crop_img))
+                     rel_path = f"/outputs/{request_id}/{fname}"
 
+            figure = {
+                "id": fig_id,
+                "bbox": bbox,
+                "image_path": rel_path or "", # Contract requires string
+                "caption": None,
+                "confidence": region.get('score', 0.9) # Layout score
+            }
+            figures.append(figure)
+            yield {"type": "figure", "data": figure}
         
-        timings = {
-            "preprocess": int(t_preprocess),
-            "layout": int((t_layout_end - t_layout_start) * 1000),
-            "ocr": int(total_ocr_time * 1000), # Embedded in layout for PPStructure
-            "crop": int((t_crop_end - crop_time_start) * 1000)
+        block = {
+            "id": block_id,
+            "type": mapped_type,
+            "bbox": bbox,
+            "order": idx + 1,
+            "text": block_text,
+            "confidence": block_conf,
+            "lines": block_lines
         }
-        
-        return {
-            "meta": {
-                "request_id": request_id,
-                "image": {"width": width, "height": height},
-                "timings_ms": timings
-            },
-            "blocks": blocks,
-            "figures": figures,
+        blocks.append(block)
+        yield {"type": "block", "data": block}
+
+    t_crop_end = time.perf_counter()
+    
+    annotated_path = None
+    annotated_file = None
+    if store_outputs and return_annotated:
+        annotated_file = output_dir / f"annotated{artifacts.extension}"
+        annotated_path = f"/outputs/{request_id}/{annotated_file.name}"
+    if figure_crops or annotated_file:
+        artifacts.submit(output_dir, lambda writer: _write_artifacts(
+            writer, img, figure_crops, annotated_file, [(b['id'], b['bbox']) for b in blocks]
+        ))
+    t_annotate_end = time.perf_counter()
+
+    
+    timings = {
+        "preprocess": int(t_preprocess),
+        "layout": int(layout_time * 1000),
+        "ocr": int(total_ocr_time * 1000),
+        "crop": int((t_crop_end - crop_time_start) * 1000),
+        "annotate": int((t_annotate_end - t_crop_end) * 1000)
+    }
+    if "region_cache_hits" in engine_times:
+        timings["region_cache_hits"] = int(engine_times["region_cache_hits"])
+        timings["region_cache_misses"] = int(engine_times["region_cache_misses"])
+    
+    image_meta = {"width": width, "height": height, "processed_width": processed_width,
+                  "processed_height": processed_height}
+    if tiles > 1:
+        image_meta["tiles"] = tiles
+    meta = {
+        "request_id": request_id,
+        "image": image_meta,
+        "engines": {"ocr": ocr_engine, "layout": layout_engine},
+        "timings_ms": timings
+    }
+    if page_triage:
+        meta["triage"] = page_triage.meta()
+    yield {
+        "type": "meta",
+        "data": {
+            "meta": meta,
             "exports": {
                 "annotated_image_path": annotated_path
             }
         }
+    }
 
 # Global instance
 _service = None
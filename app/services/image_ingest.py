@@ -0,0 +1,148 @@
+import io
+from typing import Optional, Tuple
+
+import cv2
+import numpy as np
+from PIL import Image
+
+
+class InvalidImageError(ValueError):
+    """Raised when uploaded bytes are not a decodable image."""
+
+    def __init__(self, message: str = "Could not decode image"):
+        super().__init__(message)
+
+
+class ImageTooLargeError(InvalidImageError):
+    """Raised when an image has more pixels than allowed (e.g. a decompression bomb)."""
+
+    def __init__(self, max_pixels: int):
+        super().__init__(f"Image exceeds the limit of {max_pixels} pixels.")
+        # Keep the constructor argument so the error survives pickling
+        self.args = (max_pixels,)
+        self.max_pixels = max_pixels
+
+    def __str__(self):
+        return f"Image exceeds the limit of {self.max_pixels} pixels."
+
+
+class BufferReader(io.RawIOBase):
+    """
+    A seekable binary file over a bytes-like object. Unlike BytesIO, which
+    copies anything that is not `bytes`, it reads straight from the buffer,
+    so PIL can parse the header of a memoryview upload without a copy.
+    """
+
+    def __init__(self, data):
+        self._view = memoryview(data).cast("B")
+        self._pos = 0
+
+    def readable(self) -> bool:
+        return True
+
+    def seekable(self) -> bool:
+        return True
+
+    def readinto(self, buffer) -> int:
+        chunk = self._view[self._pos:self._pos + len(buffer)]
+        buffer[:len(chunk)] = chunk
+        self._pos += len(chunk)
+        return len(chunk)
+
+    def seek(self, offset: int, whence: int = io.SEEK_SET) -> int:
+        base = {io.SEEK_SET: 0, io.SEEK_CUR: self._pos, io.SEEK_END: len(self._view)}[whence]
+        self._pos = max(0, base + offset)
+        return self._pos
+
+    def tell(self) -> int:
+        return self._pos
+
+
+def probe_image(image_bytes, max_pixels: Optional[int] = None) -> Tuple[int, int]:
+    """
+    Reads only the image header and returns its (width, height), so limits
+    are enforced before any pixel data is decompressed.
+    """
+    try:
+        with Image.open(BufferReader(image_bytes)) as img:
+            width, height = img.size
+    except Image.DecompressionBombError:
+        # PIL refuses images over twice its own limit before we can size them
+        raise ImageTooLargeError(max_pixels or Image.MAX_IMAGE_PIXELS * 2)
+    except Exception:
+        raise InvalidImageError()
+    if width <= 0 or height <= 0:
+        raise InvalidImageError()
+    if max_pixels and width * height > max_pixels:
+        raise ImageTooLargeError(max_pixels)
+    return width, height
+
+
+def decode_image(image_bytes, max_pixels: Optional[int] = None) -> np.ndarray:
+    """
+    The single decode of an upload: a header probe, then one full decode
+    into the BGR ndarray the engines take. OpenCV applies the EXIF
+    orientation, so phone photos come out upright.
+    """
+    probe_image(image_bytes, max_pixels)
+    # frombuffer wraps the upload (or shared-memory view) without copying it
+    img = cv2.imdecode(np.frombuffer(image_bytes, np.uint8), cv2.IMREAD_COLOR)
+    if img is None:
+        raise InvalidImageError()
+    return img
+
+
+# Long side of the thumbnail the text height is measured on
+TEXT_PROBE_SIDE = 1024
+# Fewer glyph-like components than this and the page is not treated as text
+MIN_GLYPHS = 20
+# Text-driven downscaling never takes the long side below the detector's input size
+MIN_SCALED_SIDE = 960
+
+
+def estimate_text_height(img: np.ndarray) -> Optional[float]:
+    """
+    Estimates the typical glyph height of the page, in pixels of `img`, as
+    the median height of glyph-sized connected components on a binarized
+    thumbnail. Returns None when the page has too little text-like ink.
+    """
+    height, width = img.shape[:2]
+    probe_scale = min(1.0, TEXT_PROBE_SIDE / max(height, width))
+    if probe_scale < 1.0:
+        img = cv2.resize(img, None, fx=probe_scale, fy=probe_scale, interpolation=cv2.INTER_AREA)
+    gray = cv2.cvtColor(img, cv2.COLOR_BGR2GRAY) if img.ndim == 3 else img
+    _, binary = cv2.threshold(gray, 0, 255, cv2.THRESH_BINARY_INV | cv2.THRESH_OTSU)
+    _, _, stats, _ = cv2.connectedComponentsWithStats(binary, connectivity=8)
+    widths = stats[1:, cv2.CC_STAT_WIDTH]
+    heights = stats[1:, cv2.CC_STAT_HEIGHT]
+    # Glyphs are small and not much wider than tall; rules, figures and noise are not
+    glyphs = (heights >= 3) & (heights <= gray.shape[0] * 0.05) & (widths <= heights * 3)
+    if np.count_nonzero(glyphs) < MIN_GLYPHS:
+        return None
+    return float(np.median(heights[glyphs])) / probe_scale
+
+
+def plan_scale(img: np.ndarray, max_side: int = 0, target_text_px: int = 0) -> float:
+    """
+    Picks the factor (at most 1, never upscaling) to resize the page by
+    before inference: small enough that the long side fits `max_side` and
+    the estimated text height comes down to about `target_text_px`. Either
+    limit is off when 0.
+    """
+    height, width = img.shape[:2]
+    long_side = max(height, width)
+    scale = 1.0
+    if max_side:
+        scale = min(scale, max_side / long_side)
+    if target_text_px:
+        text_height = estimate_text_height(img)
+        if text_height:
+            text_scale = max(target_text_px / text_height, MIN_SCALED_SIDE / long_side)
+            scale = min(scale, text_scale)
+    return scale
+
+
+def resize_image(img: np.ndarray, scale: float) -> np.ndarray:
+    if scale >= 1.0:
+        return img
+    return cv2.resize(img, None, fx=scale, fy=scale, interpolation=cv2.INTER_AREA)
@@ -0,0 +1,71 @@
+"""
+Inference profiles: the models and CPU settings PPStructure is built with,
+trading a little accuracy for throughput.
+
+- accurate: PaddleOCR's default English models (PP-OCRv3 detection,
+  PP-OCRv4 recognition, PicoDet layout) in FP32 on Paddle's plain CPU
+  kernels. What the service always ran.
+- balanced: the same models on oneDNN (MKLDNN) kernels, which also makes
+  Paddle honour the CPU thread count, with recognition in larger batches.
+  Results are nearly identical; throughput is higher on x86 CPUs.
+- fast: INT8-quantized ("slim") detection and recognition models on oneDNN,
+  and text detection on a smaller image. Lower accuracy, fastest. The
+  models are PaddleOCR's English slim ones, en_PP-OCRv3_det_slim and
+  en_PP-OCRv3_rec_slim: there is no quantized PP-OCRv4 recognizer, so
+  recognition falls back one model generation. Both recognizers read
+  ppocr/utils/en_dict.txt, so the fast profile outputs the same character
+  set as the others. Its accuracy cost has not been measured with the
+  service's own pages; run benchmarks.profiles before choosing it.
+
+The layout model is the same in every profile: PicoDet is the only English
+layout model PaddleOCR ships. Models missing from ~/.paddleocr are
+downloaded on first use, like the default ones.
+Use benchmarks.profiles to measure what each profile costs in accuracy
+(character error rate) and buys in pages per second on your pages.
+"""
+import os
+from typing import Any, Dict, Optional
+
+DEFAULT_INFERENCE_PROFILE = "accurate"
+
+_SLIM_MODELS = {
+    "det_model_dir": "https://paddleocr.bj.bcebos.com/PP-OCRv3/english/en_PP-OCRv3_det_slim_infer.tar",
+    "rec_model_dir": "https://paddleocr.bj.bcebos.com/PP-OCRv3/english/en_PP-OCRv3_rec_slim_infer.tar",
+}
+
+# PPStructure arguments of each profile
+INFERENCE_PROFILES: Dict[str, Dict[str, Any]] = {
+    "accurate": {},
+    "balanced": {"enable_mkldnn": True, "rec_batch_num": 16},
+    "fast": {"enable_mkldnn": True, "rec_batch_num": 16, "det_limit_side_len": 736, **_SLIM_MODELS},
+}
+
+
+class UnknownInferenceProfileError(ValueError):
+    """Raised for an inference profile that is not in INFERENCE_PROFILES."""
+
+    def __init__(self, profile: str):
+        super().__init__(profile)
+        self.profile = profile
+
+    def __str__(self):
+        return f"Unknown inference profile '{self.profile}', expected one of: {', '.join(INFERENCE_PROFILES)}."
+
+
+def profile_engine_kwargs(profile: str) -> Dict[str, Any]:
+    """The PPStructure arguments of `profile`."""
+    try:
+        return dict(INFERENCE_PROFILES[profile])
+    except KeyError:
+        raise UnknownInferenceProfileError(profile)
+
+
+def profile_threads(profile: str, workers: int) -> Optional[int]:
+    """
+    CPU threads per engine worker when none are configured: Paddle's own
+    default for `accurate`, otherwise the machine's cores shared out between
+    the workers (oneDNN would use 10 each, however many cores there are).
+    """
+    if not profile_engine_kwargs(profile).get("enable_mkldnn"):
+        return None
+    return max(1, (os.cpu_count() or 1) // max(1, workers))
@@ -0,0 +1,291 @@
+import asyncio
+import json
+import logging
+import os
+import time
+import uuid
+from collections import OrderedDict
+from pathlib import Path
+from typing import Any, AsyncIterator, Awaitable, Callable, Dict, List, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+ACTIVE_STATUSES = ("queued", "running")
+# Finished jobs kept in memory for clients still polling them; older ones are read from job.json
+FINISHED_JOBS_CACHED = 256
+
+# Async callable that extracts one page: (job, page, image_bytes) -> ExtractResponse data
+PageProcessor = Callable[[Dict[str, Any], Dict[str, Any], bytes], Awaitable[Dict[str, Any]]]
+
+
+def _write_text(path: Path, text: str):
+    tmp_path = path.with_suffix(f".{os.getpid()}.{uuid.uuid4().hex}.tmp")
+    tmp_path.write_text(text)
+    tmp_path.replace(path)
+
+
+def _write_json(path: Path, data: Dict[str, Any]):
+    _write_text(path, json.dumps(data))
+
+
+class JobManager:
+    """
+    Runs long multi-page extractions in the background.
+
+    Every job is persisted in its directory (`output_dir/<job_id>/`, or where
+    `storage` shards it to): the uploaded pages
+    in `inputs/`, one result file per finished page in `pages/` and the job
+    state in `job.json`. Active jobs also leave a marker in
+    `output_dir/_jobs/active/`, so unfinished work is picked up again after
+    a restart without scanning every request directory.
+
+    Pages of all jobs share one FIFO queue worked by `concurrency` workers.
+    Only active jobs and the FINISHED_JOBS_CACHED most recently finished
+    ones are held in memory; the others are served from their job.json.
+    """
+
+    def __init__(self, output_dir: Path, process_page: PageProcessor, concurrency: int = 2,
+                 storage=None):
+        self.output_dir = output_dir
+        self.storage = storage
+        self.process_page = process_page
+        self.concurrency = max(1, concurrency)
+        self._active_dir = output_dir / "_jobs" / "active"
+        # Active jobs, and recently finished ones, least recently finished first
+        self._jobs: Dict[str, Dict[str, Any]] = {}
+        self._finished: "OrderedDict[str, Dict[str, Any]]" = OrderedDict()
+        # Orders job.json writes, which overlap when pages of a job finish together
+        self._save_lock = asyncio.Lock()
+        self._queue: "asyncio.Queue[Tuple[str, int]]" = asyncio.Queue()
+        self._workers: List[asyncio.Task] = []
+        # job_id -> queues of the clients streaming that job
+        self._listeners: Dict[str, List[asyncio.Queue]] = {}
+
+    def job_dir(self, job_id: str) -> Path:
+        if self.storage is not None:
+            return self.storage.request_dir(job_id)
+        return self.output_dir / job_id
+
+    def is_active(self, job_id: str) -> bool:
+        """Whether `job_id` is an unfinished job, whose files must be kept."""
+        return (self._active_dir / job_id).exists()
+
+    async def start(self):
+        self._active_dir.mkdir(parents=True, exist_ok=True)
+        for marker in sorted(self._active_dir.iterdir()):
+            job = await asyncio.to_thread(self._load, marker.name)
+            if job is None or job["status"] not in ACTIVE_STATUSES:
+                marker.unlink(missing_ok=True)
+                continue
+            pending = [p["index"] for p in job["pages"] if p["status"] == "pending"]
+            logger.info(f"Resuming job {job['job_id']} with {len(pending)} pending pages")
+            for index in pending:
+                self._queue.put_nowait((job["job_id"], index))
+            await self._finish_if_done(job)
+        self._workers = [asyncio.create_task(self._worker()) for _ in range(self.concurrency)]
+
+    async def stop(self):
+        for task in self._workers:
+            task.cancel()
+        await asyncio.gather(*self._workers, return_exceptions=True)
+        self._workers = []
+
+    async def create_job(self, pages: List[Tuple[str, bytes]], options: Dict[str, Any]) -> Dict[str, Any]:
+        job_id = str(uuid.uuid4())
+        now = time.time()
+        job = {
+            "job_id": job_id,
+            "status": "queued",
+            "created_at": now,
+            "updated_at": now,
+            "options": options,
+            "progress": {"total": len(pages), "completed": 0, "failed": 0},
+            "pages": [
+                {
+                    "index": index,
+                    "filename": filename,
+                    "input": f"{index + 1:05d}_{Path(filename or 'image').name}",
+                    "status": "pending",
+                    "error": None,
+                }
+                for index, (filename, _) in enumerate(pages)
+            ],
+        }
+        await asyncio.to_thread(self._create_files, job, pages)
+        self._jobs[job_id] = job
+        for index in range(len(pages)):
+            self._queue.put_nowait((job_id, index))
+        return job
+
+    async def get_job(self, job_id: str, include_results: bool = True) -> Optional[Dict[str, Any]]:
+        """Returns the job state, with each finished page's result when asked."""
+        job = self._jobs.get(job_id) or self._finished.get(job_id)
+        if job is None:
+            job = await asyncio.to_thread(self._load, job_id)
+            if job is None:
+                return None
+        view = {**job, "pages": [dict(p) for p in job["pages"]]}
+        if include_results:
+            await asyncio.to_thread(self._attach_results, view)
+        return view
+
+    async def cancel_job(self, job_id: str) -> Optional[Dict[str, Any]]:
+        """Cancels the job's pending pages. Pages already running still finish."""
+        job = self._jobs.get(job_id)
+        if job is None:
+            return await self.get_job(job_id, include_results=False)
+        if job["status"] in ACTIVE_STATUSES:
+            job["status"] = "cancelled"
+            for page in job["pages"]:
+                if page["status"] == "pending":
+                    page["status"] = "cancelled"
+            await self._save(job)
+            (self._active_dir / job_id).unlink(missing_ok=True)
+            self._retire(job)
+            self._notify(job_id, {"type": "job"})
+        return await self.get_job(job_id, include_results=False)
+
+    async def watch(self, job_id: str) -> AsyncIterator[Dict[str, Any]]:
+        """
+        Streams a job as events (see app.services.streaming): a `page` event
+        for every finished page, those finished earlier first, then a closing
+        `job` event with the job state once it is no longer active.
+        """
+        queue: asyncio.Queue = asyncio.Queue()
+        # Listen before taking the snapshot so no page can slip in between
+        self._listeners.setdefault(job_id, []).append(queue)
+        try:
+            job = await self.get_job(job_id, include_results=False)
+            if job is None:
+                return
+            sent = set()
+            for page in job["pages"]:
+                if page["status"] in ("completed", "failed"):
+                    sent.add(page["index"])
+                    # One result in memory at a time, however long the job
+                    result = await asyncio.to_thread(self._page_result, job_id, page)
+                    yield {"type": "page", "data": {**page, "result": result}}
+            active = job["status"] in ACTIVE_STATUSES
+            while active:
+                event = await queue.get()
+                if event["type"] == "job":
+                    active = False
+                elif event["data"]["index"] not in sent:
+                    sent.add(event["data"]["index"])
+                    yield event
+            yield {"type": "job", "data": await self.get_job(job_id, include_results=False)}
+        finally:
+            listeners = self._listeners.get(job_id, [])
+            listeners.remove(queue)
+            if not listeners:
+                self._listeners.pop(job_id, None)
+
+    def _notify(self, job_id: str, event: Dict[str, Any]):
+        for queue in self._listeners.get(job_id, []):
+            queue.put_nowait(event)
+
+    async def _worker(self):
+        while True:
+            job_id, index = await self._queue.get()
+            try:
+                await self._run_page(job_id, index)
+            except Exception as e:
+                logger.error(f"Job {job_id} page {index} failed unexpectedly: {e}")
+            finally:
+                self._queue.task_done()
+
+    async def _run_page(self, job_id: str, index: int):
+        job = self._jobs.get(job_id)
+        if job is None or job["status"] not in ACTIVE_STATUSES:
+            return
+        page = job["pages"][index]
+        if page["status"] != "pending":
+            return
+        if job["status"] == "queued":
+            job["status"] = "running"
+            await self._save(job)
+
+        page["status"] = "running"
+        result = None
+        try:
+            image_bytes = await asyncio.to_thread(
+                (self.job_dir(job_id) / "inputs" / page["input"]).read_bytes
+            )
+            result = await self.process_page(job, page, image_bytes)
+            await asyncio.to_thread(_write_json, self._result_path(job_id, index), result)
+            page["status"] = "completed"
+            job["progress"]["completed"] += 1
+        except Exception as e:
+            logger.error(f"Job {job_id} page {index} failed: {e}")
+            page.update(status="failed", error=str(e))
+            job["progress"]["failed"] += 1
+        self._notify(job_id, {"type": "page", "data": {**page, "result": result}})
+
+        if job["status"] == "cancelled":
+            # Keep the outcome of the page that was running when cancelled
+            await self._save(job)
+            return
+        await self._finish_if_done(job)
+
+    async def _finish_if_done(self, job: Dict[str, Any]):
+        progress = job["progress"]
+        if progress["completed"] + progress["failed"] == progress["total"]:
+            job["status"] = "failed" if progress["completed"] == 0 and progress["total"] else "completed"
+            await self._save(job)
+            (self._active_dir / job["job_id"]).unlink(missing_ok=True)
+            self._retire(job)
+            self._notify(job["job_id"], {"type": "job"})
+        else:
+            await self._save(job)
+
+    def _retire(self, job: Dict[str, Any]):
+        """Moves a job that is no longer active to the bounded cache of finished jobs."""
+        self._jobs.pop(job["job_id"], None)
+        self._finished[job["job_id"]] = job
+        while len(self._finished) > FINISHED_JOBS_CACHED:
+            self._finished.popitem(last=False)
+
+    async def _save(self, job: Dict[str, Any]):
+        job["updated_at"] = time.time()
+        # The state as of now: the job keeps changing while this save waits
+        text = json.dumps(job)
+        async with self._save_lock:
+            await asyncio.to_thread(_write_text, self.job_dir(job["job_id"]) / "job.json", text)
+
+    def _result_path(self, job_id: str, index: int) -> Path:
+        return self.job_dir(job_id) / "pages" / f"{index + 1:05d}.json"
+
+    def _create_files(self, job: Dict[str, Any], pages: List[Tuple[str, bytes]]):
+        job_dir = self.job_dir(job["job_id"])
+        (job_dir / "inputs").mkdir(parents=True)
+        (job_dir / "pages").mkdir()
+        for page, (_, image_bytes) in zip(job["pages"], pages):
+            (job_dir / "inputs" / page["input"]).write_bytes(image_bytes)
+        _write_json(job_dir / "job.json", job)
+        self._active_dir.mkdir(parents=True, exist_ok=True)
+        (self._active_dir / job["job_id"]).touch()
+
+    def _load(self, job_id: str) -> Optional[Dict[str, Any]]:
+        try:
+            job = json.loads((self.job_dir(job_id) / "job.json").read_text())
+        except (OSError, ValueError):
+            return None
+        # Pages that were running when the process stopped never finished
+        for page in job["pages"]:
+            if page["status"] == "running":
+                page["status"] = "pending"
+        if job["status"] in ACTIVE_STATUSES:
+            self._jobs[job_id] = job
+        return job
+
+    def _attach_results(self, job: Dict[str, Any]):
+        for page in job["pages"]:
+            page["result"] = self._page_result(job["job_id"], page)
+
+    def _page_result(self, job_id: str, page: Dict[str, Any]) -> Optional[Dict[str, Any]]:
+        if page["status"] != "completed":
+            return None
+        try:
+            return json.loads(self._result_path(job_id, page["index"]).read_text())
+        except (OSError, ValueError):
+            return None
@@ -0,0 +1,111 @@
+"""
+Page geometry after inference: the reading order of a page's regions and
+the page-coordinate boxes of their text lines.
+
+reading_order() is a banded XY-cut. Regions are swept top to bottom into
+bands separated by horizontal whitespace; a band's column gutters are the
+vertical whitespace between its regions. Consecutive bands that fit the
+same gutters (no region crosses one, and each is at least half as wide
+as its column) form a run that is read column by column. A region that
+spans the gutters (a title, a wide figure) or is much narrower than the
+columns (a page number) starts a new run, so such elements stay between
+the columns they separate.
+Every step is a sort or a linear sweep, so a page costs O(n log n).
+"""
+from typing import Any, Dict, List, Sequence
+
+import numpy as np
+
+# Whitespace narrower than this fraction of the page width is not a gutter
+MIN_GUTTER = 0.01
+# A region narrower than this fraction of its column does not continue the column
+MIN_COLUMN_FILL = 0.5
+
+
+def _gutters(boxes: np.ndarray, min_gap: float) -> List[float]:
+    """Midpoints of the vertical whitespace between the boxes, left to right."""
+    order = np.argsort(boxes[:, 0], kind="stable")
+    x1, x2 = boxes[order, 0], np.maximum.accumulate(boxes[order, 2])
+    gaps = np.nonzero(x1[1:] - x2[:-1] > min_gap)[0]
+    return ((x2[gaps] + x1[gaps + 1]) / 2).tolist()
+
+
+def _column_widths(boxes: np.ndarray, gutters: Sequence[float]) -> np.ndarray:
+    """Width of each column the gutters delimit, from the boxes in it."""
+    columns = np.searchsorted(np.asarray(gutters), (boxes[:, 0] + boxes[:, 2]) / 2)
+    left = np.full(len(gutters) + 1, np.inf)
+    right = np.full(len(gutters) + 1, -np.inf)
+    np.minimum.at(left, columns, boxes[:, 0])
+    np.maximum.at(right, columns, boxes[:, 2])
+    return np.maximum(right - left, 0)
+
+
+def _fits(boxes: np.ndarray, gutters: Sequence[float], widths: np.ndarray) -> bool:
+    """True if every box stays within one column and fills enough of its width."""
+    mids = np.asarray(gutters)
+    # A box crosses a gutter when the gutters left of its two edges differ
+    left, right = np.searchsorted(mids, boxes[:, 0]), np.searchsorted(mids, boxes[:, 2])
+    if np.any(left != right):
+        return False
+    return bool(np.all(boxes[:, 2] - boxes[:, 0] >= MIN_COLUMN_FILL * widths[left]))
+
+
+def reading_order(bboxes: Sequence[Sequence[float]], page_width: float) -> List[int]:
+    """
+    Indices of `bboxes` ([x1, y1, x2, y2] each) in reading order: top to
+    bottom, and column by column where the page is set in columns.
+    """
+    if len(bboxes) == 0:
+        return []
+    boxes = np.asarray(bboxes, dtype=np.float64).reshape(-1, 4)
+    min_gap = MIN_GUTTER * page_width
+    by_top = np.lexsort((boxes[:, 0], boxes[:, 1]))
+
+    # Bands: a region starts a new band when it begins below everything above it
+    bottoms = np.maximum.accumulate(boxes[by_top, 3])
+    starts = np.nonzero(boxes[by_top[1:], 1] >= bottoms[:-1])[0] + 1
+    bands = np.split(by_top, starts)
+
+    # Runs: consecutive bands that share one set of column gutters
+    runs: List[List[np.ndarray]] = []
+    gutters: List[List[float]] = []
+    widths = np.zeros(0)
+    for band in bands:
+        band_boxes = boxes[band]
+        if runs and gutters[-1] and _fits(band_boxes, gutters[-1], widths):
+            runs[-1].append(band)
+        else:
+            runs.append([band])
+            gutters.append(_gutters(band_boxes, min_gap))
+            if gutters[-1]:
+                widths = _column_widths(band_boxes, gutters[-1])
+
+    order: List[int] = []
+    for run, run_gutters in zip(runs, gutters):
+        members = np.concatenate(run)
+        if run_gutters:
+            member_boxes = boxes[members]
+            centers = (member_boxes[:, 0] + member_boxes[:, 2]) / 2
+            columns = np.searchsorted(np.asarray(run_gutters), centers)
+            members = members[np.lexsort((member_boxes[:, 0], member_boxes[:, 1], columns))]
+        order.extend(members.tolist())
+    return order
+
+
+def line_bboxes(lines: List[Dict[str, Any]], sx: float = 1.0, sy: float = 1.0,
+                width: float = np.inf, height: float = np.inf) -> List[List[int]]:
+    """
+    Axis-aligned [x1, y1, x2, y2] boxes of OCR lines from their
+    `text_region` quadrilaterals, scaled by (sx, sy) and clipped to the page.
+    Lines without a polygon get [0, 0, 0, 0].
+    """
+    boxes = np.zeros((len(lines), 4), dtype=np.float64)
+    polygons = [(i, line['text_region']) for i, line in enumerate(lines) if line.get('text_region') is not None]
+    if polygons:
+        index = np.fromiter((i for i, _ in polygons), dtype=np.intp, count=len(polygons))
+        points = np.asarray([polygon for _, polygon in polygons], dtype=np.float64).reshape(len(polygons), -1, 2)
+        points *= (sx, sy)
+        boxes[index, :2] = np.floor(points.min(axis=1))
+        boxes[index, 2:] = np.ceil(points.max(axis=1))
+        np.clip(boxes, 0, (width, height, width, height), out=boxes)
+    return boxes.astype(np.int64).tolist()
@@ -0,0 +1,137 @@
+"""
+Prometheus metrics of the extraction API, served by GET /metrics.
+
+Stage times are recorded from each page's `timings_ms`, so pages extracted
+in engine worker processes are counted in the API process like any other.
+"""
+import functools
+import time
+from contextlib import contextmanager
+from typing import Any, Callable, Dict
+
+from prometheus_client import CONTENT_TYPE_LATEST, Counter, Gauge, Histogram, generate_latest
+
+# Seconds; extraction of one page ranges from milliseconds (cache hit) to minutes
+LATENCY_BUCKETS = (0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300)
+UPLOAD_BUCKETS = tuple(2 ** n * 1024 for n in range(4, 20, 2))  # 16 KB .. 256 MB
+MEGAPIXEL_BUCKETS = (0.5, 1, 2, 4, 8, 12, 16, 24, 32, 48, 64, 100)
+
+# timings_ms keys that are not stage durations
+NON_STAGE_TIMINGS = {"queue_depth", "queue_wait", "region_cache_hits", "region_cache_misses"}
+# ocr_engine is client input; anything else is labelled "other" to bound label cardinality
+OCR_ENGINE_LABELS = {"paddle", "doctr", "tesseract"}
+
+REQUESTS = Counter(
+    "extraction_requests_total", "Requests handled, by endpoint, OCR engine and status code.",
+    ["endpoint", "ocr_engine", "status"],
+)
+REQUEST_SECONDS = Histogram(
+    "extraction_request_seconds", "Time to answer a request (to the first byte when streamed).",
+    ["endpoint", "ocr_engine"], buckets=LATENCY_BUCKETS,
+)
+REQUESTS_IN_PROGRESS = Gauge(
+    "extraction_requests_in_progress", "Requests being handled.", ["endpoint"],
+)
+UPLOAD_BYTES = Histogram(
+    "extraction_upload_bytes", "Size of the uploaded request body.", ["endpoint"],
+    buckets=UPLOAD_BUCKETS,
+)
+PAGES = Counter(
+    "extraction_pages_total", "Pages extracted, by OCR engine and whether the result cache answered.",
+    ["ocr_engine", "cache"],
+)
+PAGE_MEGAPIXELS = Histogram(
+    "extraction_page_megapixels", "Size of the extracted pages as uploaded.", ["ocr_engine"],
+    buckets=MEGAPIXEL_BUCKETS,
+)
+STAGE_SECONDS = Histogram(
+    "extraction_stage_seconds", "Time spent in each extraction stage of a page.",
+    ["stage", "ocr_engine"], buckets=LATENCY_BUCKETS,
+)
+QUEUE_WAIT_SECONDS = Histogram(
+    "engine_queue_wait_seconds", "Time pages waited for a free inference worker.", ["ocr_engine"],
+    buckets=LATENCY_BUCKETS,
+)
+REGION_CACHE_LOOKUPS = Counter(
+    "region_cache_lookups_total", "Text regions looked up in the region cache, by result.", ["result"],
+)
+ENGINE_IN_FLIGHT = Gauge(
+    "engine_in_flight", "Calls running on or waiting for the inference workers.",
+)
+ENGINE_CAPACITY = Gauge(
+    "engine_capacity", "Calls the inference pool admits at once (workers plus queue).",
+)
+
+
+def bind_engine_pool(in_flight: Callable[[], float], capacity: Callable[[], float]):
+    # Both read at scrape time: a remote pool's capacity follows its worker nodes
+    ENGINE_IN_FLIGHT.set_function(in_flight)
+    ENGINE_CAPACITY.set_function(capacity)
+
+
+def observe_upload(endpoint: str, size: int):
+    UPLOAD_BYTES.labels(endpoint).observe(size)
+
+
+def observe_stage(stage: str, seconds: float, ocr_engine: str):
+    STAGE_SECONDS.labels(stage, engine_label(ocr_engine)).observe(seconds)
+
+
+def engine_label(ocr_engine: str) -> str:
+    return ocr_engine if ocr_engine in OCR_ENGINE_LABELS else "other"
+
+
+def observe_page(response: Dict[str, Any], ocr_engine: str):
+    """Records the stage times and size of one extracted page."""
+    ocr_engine = engine_label(ocr_engine)
+    meta = response["meta"]
+    cache = meta.get("cache") or {}
+    PAGES.labels(ocr_engine, "hit" if cache.get("hit") else "miss").inc()
+    image = meta.get("image") or {}
+    if image.get("width") and image.get("height"):
+        PAGE_MEGAPIXELS.labels(ocr_engine).observe(image["width"] * image["height"] / 1e6)
+    for stage, ms in meta["timings_ms"].items():
+        if stage == "queue_wait":
+            QUEUE_WAIT_SECONDS.labels(ocr_engine).observe(ms / 1000)
+        elif stage in ("region_cache_hits", "region_cache_misses"):
+            REGION_CACHE_LOOKUPS.labels("hit" if stage == "region_cache_hits" else "miss").inc(ms)
+        elif stage not in NON_STAGE_TIMINGS:
+            STAGE_SECONDS.labels(stage, ocr_engine).observe(ms / 1000)
+
+
+@contextmanager
+def track_request(endpoint: str, ocr_engine: str):
+    """
+    Counts a request with its latency and status code. Exceptions carrying
+    a `status_code` (HTTPException) count with it, any other as 500.
+    """
+    ocr_engine = engine_label(ocr_engine)
+    in_progress = REQUESTS_IN_PROGRESS.labels(endpoint)
+    in_progress.inc()
+    t_start = time.perf_counter()
+    status = 200
+    try:
+        yield
+    except Exception as e:
+        status = getattr(e, "status_code", 500)
+        raise
+    finally:
+        in_progress.dec()
+        REQUEST_SECONDS.labels(endpoint, ocr_engine).observe(time.perf_counter() - t_start)
+        REQUESTS.labels(endpoint, ocr_engine, str(status)).inc()
+
+
+def render_metrics():
+    """Returns the exposition body and its content type."""
+    return generate_latest(), CONTENT_TYPE_LATEST
+
+
+def tracked(endpoint: str):
+    """Decorates an async endpoint with track_request, labelled by its `ocr_engine` argument."""
+    def decorator(func):
+        @functools.wraps(func)
+        async def wrapper(*args, **kwargs):
+            with track_request(endpoint, kwargs.get("ocr_engine", "paddle")):
+                return await func(*args, **kwargs)
+        return wrapper
+    return decorator
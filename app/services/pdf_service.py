@@ -1,86 +1,202 @@
+import functools
+import io
+import logging
+from concurrent.futures import Future, ThreadPoolExecutor
+from pathlib import Path
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+from xml.sax.saxutils import escape
+
+import cv2
 from reportlab.lib.pagesizes import letter
+from reportlab.lib.styles import ParagraphStyle, getSampleStyleSheet
 from reportlab.pdfgen import canvas
-from reportlab.lib.units import inch
-from reportlab.lib import colors
-from reportlab.platypus import SimpleDocTemplate, Paragraph, Spacer, Image as PlatypusImage
-from reportlab.lib.styles import getSampleStyleSheet, ParagraphStyle
-from pathlib import Path
-import logging
-from typing import List, Dict, Any
+from reportlab.platypus import Frame, Image as PlatypusImage, KeepInFrame, Paragraph, Spacer
+
+from app.services.searchable_pdf import SearchablePDFWriter
 
 logger = logging.getLogger(__name__)
 
+# "reflow" typesets the extracted text; "searchable" keeps the page images under a text layer
+PDF_MODES = ("reflow", "searchable")
+PAGE_SIZE = letter
+MARGIN = 72
+# Figures are embedded at no more than this resolution, as JPEG
+FIGURE_DPI = 150
+FIGURE_JPEG_QUALITY = 85
+# Tallest a figure may be drawn, as a fraction of the frame height
+FIGURE_MAX_HEIGHT = 0.45
+# Threads decoding and downsampling figures ahead of the page being drawn
+FIGURE_WORKERS = 4
+
+
+@functools.lru_cache(maxsize=None)
+def _styles() -> Dict[str, ParagraphStyle]:
+    """Paragraph styles, built once per process (getSampleStyleSheet is not cheap)."""
+    sample = getSampleStyleSheet()
+    normal = sample["Normal"]
+    return {
+        "title": sample["Title"],
+        "text": normal,
+        "figure": ParagraphStyle("FigureCaption", parent=normal, fontName="Helvetica-Oblique"),
+    }
+
+
+def _draw_if_fits(pdf, story, x: float, top: float, width: float, height: float) -> bool:
+    """
+    Draws `story` top-down from (x, top), wrapping every flowable once,
+    if it fits in `height`. Returns False, having drawn nothing, if not.
+    """
+    sizes, total = [], 0.0
+    for flowable in story:
+        _, flowable_height = flowable.wrap(width, height)
+        total += flowable_height
+        if total > height:
+            return False
+        sizes.append(flowable_height)
+    y = top
+    for flowable, flowable_height in zip(story, sizes):
+        y -= flowable_height
+        flowable.drawOn(pdf, x, y)
+    return True
+
+
+def _paragraph_text(text: str) -> str:
+    # Paragraph parses a mini-markup: escape OCR text and keep its line breaks
+    return escape(text).replace("\n", "<br/>")
+
+
 class PDFService:
-    def __init__(self):
-        pass
+    def __init__(self, figure_dpi: int = FIGURE_DPI, figure_workers: int = FIGURE_WORKERS,
+                 image_quality: int = 85, recompress_images: bool = False):
+        self.figure_dpi = figure_dpi
+        self.figure_workers = figure_workers
+        # Page images of searchable PDFs
+        self.image_quality = image_quality
+        self.recompress_images = recompress_images
 
     def create_pdf(self, blocks: List[Dict[str, Any]], output_path: Path):
         """
         Generates a PDF from the extracted blocks.
-        
+
         Args:
             blocks: List of block dictionaries (from extraction service).
+                A {"type": "page_break"} entry starts a new PDF page, which is
+                how multi-page documents are combined into one PDF. Figure
+                blocks with an `image_file` get that image embedded.
             output_path: Path where the PDF should be saved.
         """
+        pages = [[]]
+        for block in blocks:
+            if block.get("type") == "page_break":
+                pages.append([])
+            else:
+                pages[-1].append(block)
+        return self.create_document(pages, output_path)
+
+    def create_document(self, pages: Iterable[List[Dict[str, Any]]], output_path: Path):
+        """
+        Writes one PDF page per source page. Content that would not fit is
+        scaled down to the page rather than spilling onto another. Figures
+        are decoded and downsampled on `figure_workers` threads while
+        earlier pages are drawn.
+        """
+        pages = list(pages)
+        width, height = PAGE_SIZE
+        frame_width, frame_height = width - 2 * MARGIN, height - 2 * MARGIN
         try:
-            doc = SimpleDocTemplate(
-                str(output_path),
-                pagesize=letter,
-                rightMargin=72,
-                leftMargin=72,
-                topMargin=72,
-                bottomMargin=72
-            )
-            
-            story = []
-            styles = getSampleStyleSheet()
-            
-            # Custom styles
-            title_style = styles["Title"]
-            normal_style = styles["Normal"]
-            
-            # Create a style for code/monospaced text if needed, or just improve Normal
-            # For now, we map types to styles
-            
-            for block in blocks:
-                block_type = block.get("type", "text")
-                text = block.get("text", "")
-                
-                # ReportLab Paragraphs don't handle newlines well in default Normal style without <br/>
-                # We need to replace newlines with <br/> for Paragraph
-                formatted_text = text.replace("\n", "<br/>")
-                
-                if block_type == "title":
-                    story.append(Paragraph(formatted_text, title_style))
-                    story.append(Spacer(1, 12))
-                elif block_type == "figure":
-                    # If we have an image path, we could try to embed it
-                    # But the extraction service might not have saved it or we might not have the path here easily
-                    # depending on how 'blocks' is constructed.
-                    # For MVP, we'll just note it's a figure or try to show caption/text
-                    story.append(Paragraph(f"<i>[Figure: {formatted_text}]</i>", normal_style))
-                    story.append(Spacer(1, 12))
-                elif block_type == "table":
-                     # Tables are complex. For now, dump text.
-                    story.append(Paragraph(f"<b>[Table]</b><br/>{formatted_text}", normal_style))
-                    story.append(Spacer(1, 12))
-                else:
-                    # Generic text
-                    story.append(Paragraph(formatted_text, normal_style))
-                    story.append(Spacer(1, 12))
-            
-            doc.build(story)
-            logger.info(f"PDF generated successfully at {output_path}")
+            with ThreadPoolExecutor(max_workers=max(1, self.figure_workers)) as pool:
+                figures = {
+                    id(block): pool.submit(self._figure, block["image_file"], frame_width,
+                                           frame_height * FIGURE_MAX_HEIGHT)
+                    for blocks in pages for block in blocks
+                    if block.get("type") == "figure" and block.get("image_file")
+                }
+                pdf = canvas.Canvas(str(output_path), pagesize=PAGE_SIZE, pageCompression=1)
+                for blocks in pages:
+                    frame = Frame(MARGIN, MARGIN, frame_width, frame_height, leftPadding=0,
+                                  rightPadding=0, topPadding=0, bottomPadding=0)
+                    story = self._page_story(blocks, figures)
+                    if not _draw_if_fits(pdf, story, MARGIN, height - MARGIN, frame_width, frame_height):
+                        frame.addFromList([KeepInFrame(frame_width, frame_height, story, mode="shrink")], pdf)
+                    pdf.showPage()
+                pdf.save()
+            page_count = len(pages)
+            logger.info(f"PDF with {page_count} pages generated at {output_path}")
             return output_path
-            
+
         except Exception as e:
             logger.error(f"Failed to generate PDF: {e}")
             raise
 
+    def create_searchable_document(self, pages: Iterable[Tuple[bytes, Dict[str, Any]]], output_path: Path):
+        """
+        Writes a searchable PDF: per (image bytes, ExtractResponse data) of
+        `pages`, the page image with the extracted text invisibly on top.
+        Pages are written as they are consumed, so `pages` may be a
+        generator reading one page at a time.
+        """
+        try:
+            with SearchablePDFWriter(output_path, self.image_quality, self.recompress_images) as writer:
+                for image_bytes, page in pages:
+                    writer.add_page(image_bytes, page)
+            logger.info(f"Searchable PDF with {writer.page_count} pages generated at {output_path}")
+            return output_path
+
+        except Exception as e:
+            logger.error(f"Failed to generate searchable PDF: {e}")
+            raise
+
+    def _page_story(self, blocks: List[Dict[str, Any]], figures: Dict[int, Future]) -> list:
+        styles = _styles()
+        story = []
+        for block in blocks:
+            block_type = block.get("type", "text")
+            text = _paragraph_text(block.get("text", ""))
+            if block_type == "title":
+                story.append(Paragraph(text, styles["title"]))
+            elif block_type == "figure":
+                image = figures[id(block)].result() if id(block) in figures else None
+                if image is not None:
+                    story.append(image)
+                    if text:
+                        story.append(Paragraph(text, styles["figure"]))
+                else:
+                    story.append(Paragraph(f"[Figure: {text}]", styles["figure"]))
+            elif block_type == "table":
+                # Tables are complex. For now, dump text.
+                story.append(Paragraph(f"<b>[Table]</b><br/>{text}", styles["text"]))
+            else:
+                story.append(Paragraph(text, styles["text"]))
+            story.append(Spacer(1, 12))
+        return story
+
+    def _figure(self, image_file: Path, max_width: float, max_height: float) -> Optional[PlatypusImage]:
+        """
+        The figure crop as a flowable, downsampled to `figure_dpi` at the
+        size it is drawn at, or None if it cannot be read.
+        """
+        img = cv2.imread(str(image_file), cv2.IMREAD_COLOR)
+        if img is None:
+            logger.warning(f"Could not embed figure {image_file}")
+            return None
+        height, width = img.shape[:2]
+        # Natural size at figure_dpi, shrunk to fit the space available
+        draw_w = width / self.figure_dpi * 72
+        draw_h = height / self.figure_dpi * 72
+        fit = min(1.0, max_width / draw_w, max_height / draw_h)
+        if fit < 1.0:
+            size = (max(1, round(width * fit)), max(1, round(height * fit)))
+            img = cv2.resize(img, size, interpolation=cv2.INTER_AREA)
+        # JPEG is stored as-is in the PDF (DCT), instead of being re-compressed raw
+        ok, encoded = cv2.imencode(".jpg", img, [cv2.IMWRITE_JPEG_QUALITY, FIGURE_JPEG_QUALITY])
+        if not ok:
+            return None
+        return PlatypusImage(io.BytesIO(encoded.tobytes()), width=draw_w * fit, height=draw_h * fit)
+
 _service = None
 
-def get_pdf_service():
+def get_pdf_service(image_quality: int = 85, recompress_images: bool = False):
     global _service
     if _service is None:
-        _service = PDFService()
+        _service = PDFService(image_quality=image_quality, recompress_images=recompress_images)
     return _service
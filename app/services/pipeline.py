@@ -0,0 +1,199 @@
+"""
+Two-stage extraction: layout and text detection per page, then text
+recognition of all the page's line crops in batched calls.
+
+PPStructure runs detection and recognition region by region, so a text-dense
+page makes many small recognition calls. Here every line crop of the page is
+recognized together, and a RecognitionBatcher can merge the crops of pages
+that are extracted concurrently on different engine threads.
+"""
+import copy
+import logging
+import queue
+import threading
+import time
+from concurrent.futures import Future
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+import numpy as np
+from paddleocr.tools.infer.predict_system import sorted_boxes
+from paddleocr.tools.infer.utility import get_rotate_crop_image
+
+logger = logging.getLogger(__name__)
+
+# Formatting tokens a table-trained recognizer may emit; PPStructure strips them too
+STYLE_TOKENS = (
+    '<strike>', '<sup>', '</sub>', '<b>', '</b>', '<sub>', '</sup>', '<overline>',
+    '</overline>', '<underline>', '</underline>', '<i>', '</i>'
+)
+
+# (crops) -> ([(text, score), ...], seconds)
+Recognize = Callable[[List[np.ndarray]], Tuple[List[Tuple[str, float]], float]]
+
+
+class RecognitionBatcher:
+    """
+    Runs text recognition on one dedicated thread for crops submitted from
+    any number of threads. Crops that arrive within `max_wait_ms` of the
+    first waiting ones are recognized in the same call, up to `batch_size`
+    crops per call (a single page with more crops still goes in one call).
+    """
+
+    def __init__(self, recognizer, batch_size: int = 32, max_wait_ms: float = 5):
+        self.recognizer = recognizer
+        self.batch_size = batch_size
+        self.max_wait_s = max_wait_ms / 1000
+        self._requests: "queue.Queue[Tuple[List[np.ndarray], Future]]" = queue.Queue()
+        self._thread = threading.Thread(target=self._run, name="recognition", daemon=True)
+        self._thread.start()
+
+    def recognize(self, crops: List[np.ndarray]) -> Tuple[List[Tuple[str, float]], float]:
+        """Blocks until `crops` are recognized. Returns their results and the seconds waited."""
+        if not crops:
+            return [], 0.0
+        t_start = time.perf_counter()
+        future: Future = Future()
+        self._requests.put((crops, future))
+        results = future.result()
+        return results, time.perf_counter() - t_start
+
+    def _collect(self) -> List[Tuple[List[np.ndarray], Future]]:
+        batch = [self._requests.get()]
+        size = len(batch[0][0])
+        deadline = time.monotonic() + self.max_wait_s
+        while size < self.batch_size:
+            timeout = deadline - time.monotonic()
+            if timeout <= 0:
+                break
+            try:
+                request = self._requests.get(timeout=timeout)
+            except queue.Empty:
+                break
+            batch.append(request)
+            size += len(request[0])
+        return batch
+
+    def _run(self):
+        while True:
+            batch = self._collect()
+            crops = [crop for request_crops, _ in batch for crop in request_crops]
+            try:
+                results, _ = self.recognizer(crops)
+            except Exception as e:
+                for _, future in batch:
+                    future.set_exception(e)
+                continue
+            start = 0
+            for request_crops, future in batch:
+                future.set_result(results[start:start + len(request_crops)])
+                start += len(request_crops)
+
+
+def detect_lines(text_system, img: np.ndarray) -> Tuple[np.ndarray, List[np.ndarray], float]:
+    """
+    Detects the text lines of `img` with a PaddleOCR text system. Returns the
+    line boxes in reading order, their rectified crops and the seconds taken.
+    """
+    dt_boxes, elapse = text_system.text_detector(img)
+    if dt_boxes is None or len(dt_boxes) == 0:
+        return [], [], elapse
+    boxes = sorted_boxes(dt_boxes)
+    return boxes, [get_rotate_crop_image(img, copy.deepcopy(box)) for box in boxes], elapse
+
+
+def classify_lines(text_system, crops: List[np.ndarray]) -> Tuple[List[np.ndarray], float]:
+    """Turns upside-down line crops upright when the text system has an angle classifier."""
+    if not crops or not text_system.use_angle_cls:
+        return crops, 0.0
+    crops, _, elapse = text_system.text_classifier(crops)
+    return crops, elapse
+
+
+def to_lines(boxes, rec_res, drop_score: float, x: float = 0, y: float = 0) -> List[Dict[str, Any]]:
+    """
+    Builds PPStructure-style line results, dropping lines scored below
+    `drop_score`. (x, y) offsets the boxes, e.g. from a region to the page.
+    """
+    lines = []
+    for box, (text, score) in zip(boxes, rec_res):
+        if score < drop_score:
+            continue
+        for token in STYLE_TOKENS:
+            text = text.replace(token, '')
+        lines.append({
+            'text': text,
+            'confidence': float(score),
+            'text_region': (box + [x, y]).tolist(),
+        })
+    return lines
+
+
+def run_pipeline(engine, img: np.ndarray, recognize: Recognize,
+                 region_cache=None) -> Tuple[List[Dict[str, Any]], Dict[str, float]]:
+    """
+    Extracts a page with the models of a PPStructure `engine`, using
+    `recognize` for stage two. Regions found in `region_cache` (a
+    CachedTextSystem) skip both stages. Returns regions and stage times
+    (seconds) in the same form as PPStructure's StructureSystem.
+    """
+    text_system = engine.text_system
+    time_dict = {'layout': 0.0, 'det': 0.0, 'rec': 0.0}
+
+    # Stage one: layout, then text detection inside each non-table region
+    layout_res, elapse = engine.layout_predictor(img)
+    time_dict['layout'] = elapse
+    regions, crops, owners = [], [], []
+    for layout_region in layout_res:
+        x1, y1, x2, y2 = (int(v) for v in layout_region['bbox'])
+        roi_img = img[y1:y2, x1:x2, :]
+        region = {'type': layout_region['label'].lower(), 'bbox': [x1, y1, x2, y2], 'img': roi_img, 'res': []}
+        regions.append(region)
+        if layout_region['label'] == 'table':
+            # Tables are not recognized (table=False), as in PPStructure
+            region['res'] = ''
+            continue
+        key = None
+        if region_cache is not None:
+            key, cached = region_cache.lookup(roi_img)
+            if cached is not None:
+                region['res'] = to_lines(*cached, text_system.drop_score, x1, y1)
+                continue
+        boxes, region_crops, elapse = detect_lines(text_system, roi_img)
+        time_dict['det'] += elapse
+        if region_crops:
+            owners.append((region, boxes, key))
+            crops.extend(region_crops)
+        elif region_cache is not None:
+            region_cache.remember(key, [], [])
+
+    crops, elapse = classify_lines(text_system, crops)
+    time_dict['det'] += elapse
+
+    # Stage two: every line of the page in batched recognition calls
+    rec_res, elapse = recognize(crops)
+    time_dict['rec'] = elapse
+    start = 0
+    for region, boxes, key in owners:
+        x1, y1 = region['bbox'][:2]
+        region_res = rec_res[start:start + len(boxes)]
+        region['res'] = to_lines(boxes, region_res, text_system.drop_score, x1, y1)
+        if region_cache is not None:
+            region_cache.remember(key, boxes, region_res)
+        start += len(boxes)
+    return regions, time_dict
+
+
+_batcher: Optional[RecognitionBatcher] = None
+_batcher_lock = threading.Lock()
+
+
+def get_recognition_batcher(recognizer, batch_size: int, max_wait_ms: float) -> RecognitionBatcher:
+    """
+    The batcher shared by every engine thread of this process. The first
+    caller's recognizer serves all of them.
+    """
+    global _batcher
+    with _batcher_lock:
+        if _batcher is None:
+            _batcher = RecognitionBatcher(recognizer, batch_size, max_wait_ms)
+        return _batcher
@@ -0,0 +1,276 @@
+"""
+Cache of OCR results by the look of a text region.
+
+Books repeat the same running header, footer, chapter title and page
+furniture on every page. Instead of detecting and recognizing those regions
+again, the text system looks each region crop up by a perceptual
+fingerprint: the crop binarized and trimmed to its ink. Crops whose ink is
+the same size, give or take a pixel, are compared: ink in one that is more
+than SHIFT_PX away from any ink in the other is new, and they match only if
+no WINDOW x WINDOW window holds more than MAX_NEW_INK new ink pixels.
+Scanning noise and a slightly shifted crop add a little new ink anywhere; a
+changed glyph (a page number) adds a lot in one place. Lines are stored
+relative to the ink, so a hit is placed correctly even when the layout
+model framed the region a little differently.
+
+Only regions of at most MAX_CACHED_LINES lines are stored: page furniture
+is a line or two, while a body paragraph is never seen twice and would only
+crowd the cache out.
+
+Entries are kept in a SQLite database, shared by every worker process and
+thread using the same file, bounded by entry count and total size and
+evicted least recently used first. Running totals kept by triggers tell
+when the bounds are exceeded; eviction then removes a batch of the oldest
+entries (EVICT_SLACK of the bounds) so it does not run on every insert.
+"""
+import json
+import logging
+import sqlite3
+import threading
+import time
+from pathlib import Path
+from typing import Any, List, NamedTuple, Optional, Tuple
+
+import cv2
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+# Bump when a change to fingerprinting or to the OCR models invalidates stored entries
+REGION_CACHE_VERSION = 1
+# Ink may move this many pixels between two crops of the same region...
+SHIFT_PX = 1
+# ...and this many ink pixels of any WINDOW x WINDOW window may be new
+WINDOW = 16
+MAX_NEW_INK = 8
+# Crops with less contrast than this (grey levels) hold no text worth caching
+MIN_CONTRAST = 48
+# Stored crops of about the same size compared per lookup, most recently used first
+MAX_CANDIDATES = 32
+# Regions with more lines than this are body text, not page furniture, and are not stored
+MAX_CACHED_LINES = 2
+# Eviction frees this fraction of the bounds on top of what is over them
+EVICT_SLACK = 0.01
+
+
+class Fingerprint(NamedTuple):
+    # OCR engine (and cache version) the lines come from
+    namespace: str
+    # Packed ink bits and their (height, width)
+    bits: bytes
+    shape: Tuple[int, int]
+    # Top-left corner of the ink in the crop
+    origin: Tuple[int, int]
+
+
+def fingerprint(crop: np.ndarray, namespace: str) -> Optional[Fingerprint]:
+    """The fingerprint of a region crop, or None if the crop holds no ink."""
+    if crop is None or crop.size == 0:
+        return None
+    gray = cv2.cvtColor(crop, cv2.COLOR_BGR2GRAY) if crop.ndim == 3 else crop
+    if int(gray.max()) - int(gray.min()) < MIN_CONTRAST:
+        return None
+    _, ink = cv2.threshold(gray, 0, 1, cv2.THRESH_BINARY_INV | cv2.THRESH_OTSU)
+    x, y, w, h = cv2.boundingRect(ink)
+    if not w or not h:
+        return None
+    bits = np.packbits(ink[y:y + h, x:x + w]).tobytes()
+    return Fingerprint(f"{namespace}:{REGION_CACHE_VERSION}", bits, (h, w), (x, y))
+
+
+def _ink(key: Fingerprint, height: int, width: int) -> np.ndarray:
+    """The fingerprint's ink as uint8 0/1, padded to (height, width)."""
+    ink = np.zeros((height, width), dtype=np.uint8)
+    h, w = key.shape
+    ink[:h, :w] = np.unpackbits(np.frombuffer(key.bits, np.uint8), count=h * w).reshape(h, w)
+    return ink
+
+
+def matches(a: Fingerprint, b: Fingerprint) -> bool:
+    """Whether two fingerprints are of the same region, up to scanning noise and a pixel of shift."""
+    if a.namespace != b.namespace or max(abs(a.shape[0] - b.shape[0]), abs(a.shape[1] - b.shape[1])) > 1:
+        return False
+    height, width = max(a.shape[0], b.shape[0]), max(a.shape[1], b.shape[1])
+    ink_a, ink_b = _ink(a, height, width), _ink(b, height, width)
+    kernel = np.ones((2 * SHIFT_PX + 1, 2 * SHIFT_PX + 1), np.uint8)
+    new_ink = (ink_a & (1 - cv2.dilate(ink_b, kernel))) | (ink_b & (1 - cv2.dilate(ink_a, kernel)))
+    windows = cv2.boxFilter(new_ink, cv2.CV_32F, (WINDOW, WINDOW), normalize=False, borderType=cv2.BORDER_CONSTANT)
+    return float(windows.max()) <= MAX_NEW_INK
+
+
+# Lines of a region as stored: (polygon relative to the ink, text, confidence)
+Lines = List[Tuple[List[List[float]], str, float]]
+
+
+class RegionCache:
+    """
+    OCR results of region crops in a SQLite database at `path`, at most
+    `max_entries` entries and `max_bytes` of fingerprints and text. Lookup
+    and storage errors are logged and treated as misses: the cache never
+    fails an extraction.
+    """
+
+    def __init__(self, path: Path, max_entries: int = 100_000, max_bytes: int = 256 * 1024 * 1024):
+        self.path = Path(path)
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self._db = sqlite3.connect(str(self.path), timeout=10, check_same_thread=False, isolation_level=None)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute("PRAGMA synchronous=NORMAL")
+        self._db.execute(
+            "CREATE TABLE IF NOT EXISTS regions (id INTEGER PRIMARY KEY, namespace TEXT NOT NULL, "
+            "height INTEGER NOT NULL, width INTEGER NOT NULL, bits BLOB NOT NULL, lines TEXT NOT NULL, "
+            "size INTEGER NOT NULL, used_at REAL NOT NULL)"
+        )
+        self._db.execute("CREATE INDEX IF NOT EXISTS regions_shape ON regions (namespace, height, width)")
+        self._db.execute("CREATE INDEX IF NOT EXISTS regions_used ON regions (used_at)")
+        # Entry count and size of the table, kept exact across processes by triggers
+        self._db.execute("BEGIN IMMEDIATE")
+        self._db.execute(
+            "CREATE TABLE IF NOT EXISTS totals (id INTEGER PRIMARY KEY CHECK (id = 0), "
+            "entries INTEGER NOT NULL, bytes INTEGER NOT NULL)"
+        )
+        self._db.execute(
+            "INSERT OR IGNORE INTO totals SELECT 0, COUNT(*), COALESCE(SUM(size), 0) FROM regions"
+        )
+        self._db.execute(
+            "CREATE TRIGGER IF NOT EXISTS regions_added AFTER INSERT ON regions BEGIN "
+            "UPDATE totals SET entries = entries + 1, bytes = bytes + new.size; END"
+        )
+        self._db.execute(
+            "CREATE TRIGGER IF NOT EXISTS regions_removed AFTER DELETE ON regions BEGIN "
+            "UPDATE totals SET entries = entries - 1, bytes = bytes - old.size; END"
+        )
+        self._db.execute("COMMIT")
+
+    def get(self, key: Fingerprint) -> Optional[Lines]:
+        """The lines stored for a matching region, relative to the ink, or None."""
+        height, width = key.shape
+        try:
+            with self._lock:
+                rows = self._db.execute(
+                    "SELECT id, height, width, bits, lines FROM regions WHERE namespace = ? "
+                    "AND height BETWEEN ? AND ? AND width BETWEEN ? AND ? ORDER BY used_at DESC LIMIT ?",
+                    (key.namespace, height - 1, height + 1, width - 1, width + 1, MAX_CANDIDATES),
+                ).fetchall()
+            # Compared outside the lock, so other engine threads keep using the cache
+            for row_id, row_height, row_width, bits, lines in rows:
+                if matches(key, key._replace(bits=bits, shape=(row_height, row_width))):
+                    with self._lock:
+                        self._db.execute("UPDATE regions SET used_at = ? WHERE id = ?", (time.time(), row_id))
+                    return json.loads(lines)
+        except sqlite3.Error as e:
+            logger.warning(f"Region cache lookup failed: {e}")
+        return None
+
+    def put(self, key: Fingerprint, lines: Lines):
+        payload = json.dumps(lines)
+        size = len(key.bits) + len(payload)
+        try:
+            with self._lock:
+                self._db.execute(
+                    "INSERT INTO regions (namespace, height, width, bits, lines, size, used_at) "
+                    "VALUES (?, ?, ?, ?, ?, ?, ?)",
+                    (key.namespace, *key.shape, key.bits, payload, size, time.time()),
+                )
+                entries, total = self._db.execute("SELECT entries, bytes FROM totals").fetchone()
+                if entries > self.max_entries or total > self.max_bytes:
+                    self._evict(entries, total)
+        except sqlite3.Error as e:
+            logger.warning(f"Region cache store failed: {e}")
+
+    def _evict(self, entries: int, total: int):
+        """Removes the least recently used entries until the cache is EVICT_SLACK under both bounds."""
+        excess_entries = max(0, entries - self.max_entries + int(self.max_entries * EVICT_SLACK))
+        excess_bytes = max(0, total - self.max_bytes + int(self.max_bytes * EVICT_SLACK))
+        victims, freed = [], 0
+        oldest = self._db.execute("SELECT id, size FROM regions ORDER BY used_at")
+        for row_id, size in oldest:
+            if len(victims) >= excess_entries and freed >= excess_bytes:
+                break
+            victims.append(row_id)
+            freed += size
+        oldest.close()
+        self._db.executemany("DELETE FROM regions WHERE id = ?", [(row_id,) for row_id in victims])
+
+    def stats(self):
+        with self._lock:
+            entries, size = self._db.execute("SELECT entries, bytes FROM totals").fetchone()
+        return {"entries": entries, "bytes": size}
+
+
+class CachedTextSystem:
+    """
+    A PaddleOCR text system (detection + recognition of a region crop)
+    that answers crops it has seen from `cache`. Everything but calling it
+    is passed through to the wrapped system. Counts its hits and misses.
+    """
+
+    def __init__(self, text_system, cache: RegionCache, namespace: str = "paddle"):
+        self.text_system = text_system
+        self.cache = cache
+        self.namespace = namespace
+        self.hits = 0
+        self.misses = 0
+
+    def __getattr__(self, name: str) -> Any:
+        return getattr(self.text_system, name)
+
+    def lookup(self, crop: np.ndarray):
+        """
+        (fingerprint, (boxes, rec_res) or None): the crop's cached line
+        boxes (in crop coordinates) and (text, confidence) results.
+        """
+        key = fingerprint(crop, self.namespace)
+        if key is None:
+            return None, None
+        lines = self.cache.get(key)
+        if lines is None:
+            self.misses += 1
+            return key, None
+        self.hits += 1
+        x, y = key.origin
+        boxes = [np.array(polygon, dtype=np.float32) + np.float32([x, y]) for polygon, _, _ in lines]
+        return key, (boxes, [(text, score) for _, text, score in lines])
+
+    def remember(self, key: Optional[Fingerprint], boxes, rec_res):
+        """
+        Stores the lines the text system read in the crop `key` was taken
+        of, except those it would drop for their low confidence, if they
+        are few enough for page furniture.
+        """
+        if key is None or boxes is None:
+            return
+        x, y = key.origin
+        lines = [
+            ((np.asarray(box, dtype=np.float32) - np.float32([x, y])).tolist(), text, float(score))
+            for box, (text, score) in zip(boxes, rec_res) if score >= self.text_system.drop_score
+        ]
+        if len(lines) <= MAX_CACHED_LINES:
+            self.cache.put(key, lines)
+
+    def __call__(self, img: np.ndarray, cls: bool = True):
+        key, cached = self.lookup(img)
+        if cached is not None:
+            return cached[0], cached[1], {'det': 0.0, 'rec': 0.0, 'cls': 0.0, 'all': 0.0}
+        boxes, rec_res, time_dict = self.text_system(img, cls)
+        self.remember(key, boxes, rec_res)
+        return boxes, rec_res, time_dict
+
+
+_caches = {}
+_caches_lock = threading.Lock()
+
+
+def get_region_cache(path: Path, max_entries: int, max_bytes: int) -> RegionCache:
+    """
+    The cache of `path` shared by everything in this process. The first
+    caller's bounds apply.
+    """
+    with _caches_lock:
+        cache = _caches.get(str(path))
+        if cache is None:
+            cache = _caches[str(path)] = RegionCache(path, max_entries, max_bytes)
+        return cache
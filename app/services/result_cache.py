@@ -0,0 +1,216 @@
+import hashlib
+import json
+import logging
+import os
+import threading
+import time
+import uuid
+from collections import OrderedDict
+from pathlib import Path
+from typing import Any, Dict, List, Optional
+
+logger = logging.getLogger(__name__)
+
+# Bump when a change to the extraction pipeline changes its output, so stale
+# results stored on disk by an older version are never served.
+CACHE_VERSION = 3
+
+
+class ResultCache:
+    """
+    Content-addressed cache of extraction results.
+
+    Keys are a hash of the image bytes plus every option that affects the
+    result. Entries live in an in-memory LRU tier (bounded by entry count)
+    and, optionally, in an on-disk tier (bounded by total bytes) that
+    survives restarts. Both tiers expire entries after `ttl_s` seconds.
+    """
+
+    def __init__(self, max_entries: int = 256, ttl_s: int = 86400,
+                 disk_dir: Optional[Path] = None, disk_max_bytes: int = 512 * 1024 * 1024):
+        self.max_entries = max_entries
+        self.ttl_s = ttl_s
+        self.disk_dir = disk_dir
+        self.disk_max_bytes = disk_max_bytes
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        # key -> (stored_at, serialized result)
+        self._memory: "OrderedDict[str, tuple]" = OrderedDict()
+        # key -> (stored_at, size in bytes), oldest first
+        self._disk_index: "OrderedDict[str, tuple]" = OrderedDict()
+        self._disk_bytes = 0
+        if self.disk_dir is not None:
+            self.disk_dir.mkdir(parents=True, exist_ok=True)
+            self._load_disk_index()
+
+    @property
+    def enabled(self) -> bool:
+        return self.max_entries > 0 or self.disk_dir is not None
+
+    @staticmethod
+    def make_key(image_bytes, **options) -> str:
+        """Hashes the image content together with the extraction options."""
+        digest = hashlib.blake2b(digest_size=20)
+        digest.update(image_bytes)
+        digest.update(json.dumps({"v": CACHE_VERSION, **options}, sort_keys=True).encode())
+        return digest.hexdigest()
+
+    def get(self, key: str) -> Optional[Dict[str, Any]]:
+        """Returns a private copy of the cached result, or None on a miss."""
+        now = time.time()
+        with self._lock:
+            payload = self._get_memory(key, now)
+        if payload is None:
+            payload = self._get_disk(key, now)
+        with self._lock:
+            if payload is None:
+                self.misses += 1
+                return None
+            self._put_memory(key, payload, now)
+            self.hits += 1
+        return json.loads(payload)
+
+    def put(self, key: str, result: Dict[str, Any]):
+        payload = json.dumps(result)
+        now = time.time()
+        with self._lock:
+            self._put_memory(key, payload, now)
+        self._put_disk(key, payload, now)
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_ratio": round(self.hits / lookups, 4) if lookups else 0.0,
+                "memory_entries": len(self._memory),
+                "disk_entries": len(self._disk_index),
+                "disk_bytes": self._disk_bytes,
+            }
+
+    def _expired(self, stored_at: float, now: float) -> bool:
+        return self.ttl_s > 0 and now - stored_at > self.ttl_s
+
+    def _get_memory(self, key: str, now: float) -> Optional[str]:
+        entry = self._memory.get(key)
+        if entry is None:
+            return None
+        if self._expired(entry[0], now):
+            del self._memory[key]
+            return None
+        self._memory.move_to_end(key)
+        return entry[1]
+
+    def _put_memory(self, key: str, payload: str, now: float):
+        if self.max_entries <= 0:
+            return
+        self._memory[key] = (now, payload)
+        self._memory.move_to_end(key)
+        while len(self._memory) > self.max_entries:
+            self._memory.popitem(last=False)
+
+    def _disk_path(self, key: str) -> Path:
+        return self.disk_dir / key[:2] / f"{key}.json"
+
+    def _load_disk_index(self):
+        entries = []
+        for path in self.disk_dir.glob("*/*.json"):
+            try:
+                stat = path.stat()
+            except OSError:
+                continue
+            entries.append((stat.st_mtime, path.stem, stat.st_size))
+        for stored_at, key, size in sorted(entries):
+            self._disk_index[key] = (stored_at, size)
+            self._disk_bytes += size
+        self._unlink_disk(self._evict_disk(time.time()))
+
+    # The disk tier's files are read and written outside the lock, which
+    # only guards the index
+
+    def _get_disk(self, key: str, now: float) -> Optional[str]:
+        if self.disk_dir is None:
+            return None
+        with self._lock:
+            entry = self._disk_index.get(key)
+        if entry is None:
+            # Possibly written by another API instance sharing the directory
+            try:
+                stat = self._disk_path(key).stat()
+            except OSError:
+                return None
+            entry = (stat.st_mtime, stat.st_size)
+            with self._lock:
+                if key not in self._disk_index:
+                    self._index_disk(key, *entry)
+        if self._expired(entry[0], now):
+            self._remove_disk(key)
+            return None
+        try:
+            return self._disk_path(key).read_text()
+        except OSError:
+            self._remove_disk(key)
+            return None
+
+    def _put_disk(self, key: str, payload: str, now: float):
+        if self.disk_dir is None:
+            return
+        path = self._disk_path(key)
+        data = payload.encode()
+        try:
+            path.parent.mkdir(parents=True, exist_ok=True)
+            tmp_path = path.with_suffix(f".{os.getpid()}.{uuid.uuid4().hex}.tmp")
+            tmp_path.write_bytes(data)
+            tmp_path.replace(path)
+        except OSError as e:
+            logger.warning(f"Could not write cache entry {key}: {e}")
+            return
+        with self._lock:
+            self._unindex_disk(key)
+            self._index_disk(key, now, len(data))
+            evicted = self._evict_disk(now)
+        self._unlink_disk(evicted)
+
+    def _index_disk(self, key: str, stored_at: float, size: int):
+        """Adds an entry to the disk index, in its place among the others by age."""
+        self._disk_index[key] = (stored_at, size)
+        self._disk_bytes += size
+        # Only entries found on disk (written by another instance) can be
+        # older than the newest indexed one
+        newer = [other for other, (other_at, _) in self._disk_index.items() if other_at > stored_at]
+        for other in newer:
+            self._disk_index.move_to_end(other)
+
+    def _unindex_disk(self, key: str):
+        entry = self._disk_index.pop(key, None)
+        if entry is not None:
+            self._disk_bytes -= entry[1]
+
+    def _remove_disk(self, key: str):
+        with self._lock:
+            self._unindex_disk(key)
+        self._unlink_disk([key])
+
+    def _unlink_disk(self, keys: List[str]):
+        for key in keys:
+            try:
+                self._disk_path(key).unlink()
+            except OSError:
+                pass
+
+    def _evict_disk(self, now: float) -> List[str]:
+        """
+        Drops the entries over the budget from the index, oldest first:
+        expired ones, then whatever is needed to fit. Returns their keys,
+        for _unlink_disk once the lock is released.
+        """
+        evicted = []
+        while self._disk_index:
+            key, (stored_at, _) = next(iter(self._disk_index.items()))
+            if not self._expired(stored_at, now) and self._disk_bytes <= self.disk_max_bytes:
+                break
+            self._unindex_disk(key)
+            evicted.append(key)
+        return evicted
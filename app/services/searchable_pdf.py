@@ -0,0 +1,215 @@
+"""
+Searchable PDF export: every page is the original page image with the OCR
+text laid over it as an invisible text layer, so the archive keeps the scan
+and the text can be searched, selected and copied.
+
+reportlab holds a whole document in memory until it is saved, so this
+writer streams instead: each page (image, text, page object) is written to
+the file as soon as it is added and then dropped; only the byte offsets of
+the objects are kept for the cross-reference table written at close().
+JPEG uploads are embedded as they are (PDF stores DCT data natively); other
+images, or all of them with `recompress`, are encoded as JPEG.
+
+The text layer uses the standard Helvetica font (nothing embedded), so it
+covers Latin text; characters outside WinAnsi are written as "?".
+"""
+import logging
+import zlib
+from pathlib import Path
+from typing import Any, Dict, List, Optional, Tuple
+
+import cv2
+from PIL import Image
+from reportlab.pdfbase.pdfmetrics import stringWidth
+
+from app.services.image_ingest import BufferReader, decode_image
+
+logger = logging.getLogger(__name__)
+
+# Resolution the page size is derived from: an A4 scan at 300 dpi fills an A4 page
+PAGE_DPI = 300
+FONT_NAME = "Helvetica"
+# Glyph height of Helvetica as a fraction of the font size (ascender to descender)
+FONT_HEIGHT = 0.93
+EXIF_ORIENTATION = 0x0112
+
+# Object numbers fixed up front; pages start after them
+CATALOG_ID, PAGES_ID, FONT_ID, FIRST_PAGE_ID = 1, 2, 3, 4
+
+
+def _pdf_string(text: str) -> bytes:
+    """`text` as a PDF literal string in WinAnsi encoding."""
+    data = text.encode("cp1252", errors="replace")
+    data = data.replace(b"\\", b"\\\\").replace(b"(", b"\\(").replace(b")", b"\\)")
+    return b"(" + data.replace(b"\r", b"\\r").replace(b"\n", b" ") + b")"
+
+
+def embeddable_jpeg(image_bytes, width: int, height: int) -> Optional[Tuple[bytes, str]]:
+    """
+    (JPEG data, PDF colour space) if the upload can be embedded without
+    decoding it: a baseline grey or RGB JPEG stored upright at the size the
+    page was extracted at. None otherwise.
+    """
+    try:
+        with Image.open(BufferReader(image_bytes)) as img:
+            if img.format != "JPEG" or img.size != (width, height):
+                return None
+            # The extraction saw the EXIF-rotated image; the raw JPEG is not rotated
+            if img.getexif().get(EXIF_ORIENTATION, 1) != 1:
+                return None
+            color_space = {"L": "/DeviceGray", "RGB": "/DeviceRGB"}.get(img.mode)
+    except Exception:
+        return None
+    return (image_bytes, color_space) if color_space else None
+
+
+def line_boxes(block: Dict[str, Any]) -> List[Tuple[str, List[float]]]:
+    """
+    (text, bbox) of every line of a block. Lines without a box of their own
+    share the block's box in equal horizontal bands, in order.
+    """
+    lines = [line for line in block.get("lines") or [] if line.get("text", "").strip()]
+    if not lines:
+        text = block.get("text", "")
+        return [(text, block["bbox"])] if text.strip() else []
+    x1, y1, x2, y2 = block["bbox"]
+    band = (y2 - y1) / len(lines)
+    boxes = []
+    for index, line in enumerate(lines):
+        bbox = line.get("bbox") or [0, 0, 0, 0]
+        if bbox[2] <= bbox[0] or bbox[3] <= bbox[1]:
+            bbox = [x1, y1 + index * band, x2, y1 + (index + 1) * band]
+        boxes.append((line["text"], bbox))
+    return boxes
+
+
+class SearchablePDFWriter:
+    """
+    Writes a searchable PDF to `output_path` one page at a time:
+
+        with SearchablePDFWriter(path) as writer:
+            for image_bytes, page in pages:
+                writer.add_page(image_bytes, page)
+    """
+
+    def __init__(self, output_path: Path, image_quality: int = 85, recompress: bool = False,
+                 dpi: int = PAGE_DPI):
+        self.output_path = output_path
+        self.image_quality = image_quality
+        self.recompress = recompress
+        self.dpi = dpi
+        self._file = None
+        self._offsets: Dict[int, int] = {}
+        self._pages: List[int] = []
+        self._next_id = FIRST_PAGE_ID
+
+    def __enter__(self):
+        self.open()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        if exc_type is None:
+            self.close()
+        else:
+            self._file.close()
+            self.output_path.unlink(missing_ok=True)
+
+    @property
+    def page_count(self) -> int:
+        return len(self._pages)
+
+    def open(self):
+        self._file = open(self.output_path, "wb")
+        # The binary comment marks the file as binary for transfer tools
+        self._file.write(b"%PDF-1.4\n%\xe2\xe3\xcf\xd3\n")
+        self._write_object(FONT_ID, (
+            f"<< /Type /Font /Subtype /Type1 /BaseFont /{FONT_NAME} /Encoding /WinAnsiEncoding >>"
+        ).encode())
+
+    def add_page(self, image_bytes: bytes, page: Dict[str, Any]):
+        """
+        Adds `page` (ExtractResponse data: meta.image and blocks) drawn over
+        `image_bytes`, the upload it was extracted from.
+        """
+        width, height = page["meta"]["image"]["width"], page["meta"]["image"]["height"]
+        image, color_space = self._page_image(image_bytes, width, height)
+        scale = 72 / self.dpi
+        page_w, page_h = width * scale, height * scale
+
+        image_id, content_id, page_id = self._reserve(3)
+        self._write_object(image_id, (
+            f"<< /Type /XObject /Subtype /Image /Width {width} /Height {height} "
+            f"/ColorSpace {color_space} /BitsPerComponent 8 /Filter /DCTDecode"
+        ).encode(), image)
+        del image
+
+        content = [f"q {page_w:.2f} 0 0 {page_h:.2f} 0 0 cm /Im0 Do Q".encode()]
+        # Render mode 3: the text is there to search and select, but not painted
+        content.append(b"BT 3 Tr")
+        for block in page.get("blocks", []):
+            for text, (x1, y1, x2, y2) in line_boxes(block):
+                content.append(self._text_line(text, x1 * scale, page_h - y2 * scale,
+                                               (x2 - x1) * scale, (y2 - y1) * scale))
+        content.append(b"ET")
+        self._write_object(content_id, b"<< /Filter /FlateDecode", zlib.compress(b"\n".join(content)))
+
+        self._write_object(page_id, (
+            f"<< /Type /Page /Parent {PAGES_ID} 0 R /MediaBox [0 0 {page_w:.2f} {page_h:.2f}] "
+            f"/Resources << /Font << /F1 {FONT_ID} 0 R >> /XObject << /Im0 {image_id} 0 R >> >> "
+            f"/Contents {content_id} 0 R >>"
+        ).encode())
+        self._pages.append(page_id)
+
+    def close(self):
+        """Writes the page tree, catalog and cross-reference table."""
+        kids = " ".join(f"{page_id} 0 R" for page_id in self._pages)
+        self._write_object(PAGES_ID, f"<< /Type /Pages /Kids [{kids}] /Count {len(self._pages)} >>".encode())
+        self._write_object(CATALOG_ID, f"<< /Type /Catalog /Pages {PAGES_ID} 0 R >>".encode())
+        size = self._next_id
+        xref_offset = self._file.tell()
+        xref = [f"xref\n0 {size}\n", "0000000000 65535 f \n"]
+        for object_id in range(1, size):
+            xref.append(f"{self._offsets[object_id]:010d} 00000 n \n")
+        xref.append(f"trailer\n<< /Size {size} /Root {CATALOG_ID} 0 R >>\nstartxref\n{xref_offset}\n%%EOF\n")
+        self._file.write("".join(xref).encode())
+        self._file.close()
+
+    def _page_image(self, image_bytes: bytes, width: int, height: int) -> Tuple[bytes, str]:
+        if not self.recompress:
+            jpeg = embeddable_jpeg(image_bytes, width, height)
+            if jpeg is not None:
+                return jpeg
+        img = decode_image(image_bytes)
+        if img.shape[1] != width or img.shape[0] != height:
+            img = cv2.resize(img, (width, height), interpolation=cv2.INTER_AREA)
+        ok, encoded = cv2.imencode(".jpg", img, [cv2.IMWRITE_JPEG_QUALITY, self.image_quality])
+        if not ok:
+            raise ValueError("Could not encode the page image")
+        return encoded.tobytes(), "/DeviceRGB"
+
+    def _text_line(self, text: str, x: float, y: float, width: float, height: float) -> bytes:
+        text = " ".join(text.split())
+        font_size = height / FONT_HEIGHT
+        if not text or font_size <= 0 or width <= 0:
+            return b""
+        natural_width = stringWidth(text, FONT_NAME, font_size)
+        # Stretch the line horizontally so a selection covers the printed words
+        stretch = 100 * width / natural_width
+        return (f"/F1 {font_size:.2f} Tf {stretch:.1f} Tz 1 0 0 1 {x:.2f} {y + 0.2 * font_size:.2f} Tm ".encode()
+                + _pdf_string(text) + b" Tj")
+
+    def _reserve(self, count: int) -> List[int]:
+        ids = list(range(self._next_id, self._next_id + count))
+        self._next_id += count
+        return ids
+
+    def _write_object(self, object_id: int, header: bytes, stream: Optional[bytes] = None):
+        self._offsets[object_id] = self._file.tell()
+        self._file.write(f"{object_id} 0 obj\n".encode())
+        if stream is None:
+            self._file.write(header)
+        else:
+            self._file.write(header + f" /Length {len(stream)} >>\nstream\n".encode())
+            self._file.write(stream)
+            self._file.write(b"\nendstream")
+        self._file.write(b"\nendobj\n")
@@ -0,0 +1,206 @@
+"""
+How extraction results go over the wire.
+
+A result can be cut down before it is encoded: `fields` projects it onto
+the listed dotted paths (`blocks.text,figures` keeps the text of each block
+and the whole figures list; a path into a list applies to every item), and
+`include_lines=False` drops the per-line boxes of every block, which are
+most of a dense page. Without either, the response is the full
+ExtractResponse.
+
+Bodies are JSON, encoded with orjson when it is installed, or MessagePack
+when the client's Accept header asks for it and msgpack is installed.
+Large bodies are compressed with brotli (when installed) or gzip, whichever
+the client's Accept-Encoding allows. Streamed events are shaped the same
+way but always sent as NDJSON or Server-Sent Events, uncompressed.
+"""
+import gzip
+import importlib
+import json
+from typing import Any, Dict, Optional
+
+from fastapi import Response
+
+JSON_MEDIA_TYPE = "application/json"
+MSGPACK_MEDIA_TYPE = "application/msgpack"
+MSGPACK_MEDIA_TYPES = (MSGPACK_MEDIA_TYPE, "application/x-msgpack", "application/vnd.msgpack")
+# Top-level keys of an ExtractResponse `fields` can select from
+PROJECTABLE_KEYS = ("meta", "blocks", "figures", "exports")
+# Where the data of a page's streaming events sits in its ExtractResponse
+EVENT_KEYS = {"block": "blocks", "figure": "figures"}
+GZIP_LEVEL = 5
+BROTLI_QUALITY = 4
+
+
+def _optional(module: str):
+    try:
+        return importlib.import_module(module)
+    except ImportError:
+        return None
+
+
+orjson = _optional("orjson")
+msgpack = _optional("msgpack")
+brotli = _optional("brotli")
+
+
+class InvalidFieldsError(ValueError):
+    """Raised for a `fields` projection that names no part of the response."""
+
+    def __init__(self, path: str):
+        super().__init__(path)
+        self.path = path
+
+    def __str__(self):
+        return f"Unknown field '{self.path}', fields must start with one of: {', '.join(PROJECTABLE_KEYS)}."
+
+
+def dumps(data: Any) -> bytes:
+    """Compact JSON of `data`: orjson when installed, the json module otherwise."""
+    if orjson is not None:
+        return orjson.dumps(data, option=orjson.OPT_SERIALIZE_NUMPY)
+    return json.dumps(data, separators=(",", ":"), ensure_ascii=False).encode()
+
+
+def parse_fields(fields: Optional[str]) -> Optional[Dict[str, Any]]:
+    """
+    The projection tree of a comma-separated list of dotted paths, e.g.
+    {"blocks": {"text": True}, "figures": True}, or None to keep everything.
+    """
+    if not fields or not fields.strip():
+        return None
+    tree: Dict[str, Any] = {}
+    for path in fields.split(","):
+        keys = [key.strip() for key in path.split(".")]
+        if not keys[0] or keys[0] not in PROJECTABLE_KEYS or not all(keys):
+            raise InvalidFieldsError(path.strip())
+        node = tree
+        for key in keys[:-1]:
+            child = node.get(key, {})
+            if child is True:
+                break
+            node = node.setdefault(key, child)
+        else:
+            node[keys[-1]] = True
+    return tree
+
+
+def project(data: Any, tree: Any) -> Any:
+    """The parts of `data` selected by the projection `tree` (see parse_fields)."""
+    if tree is True:
+        return data
+    if isinstance(data, list):
+        return [project(item, tree) for item in data]
+    if isinstance(data, dict):
+        return {key: project(data[key], subtree) for key, subtree in tree.items() if key in data}
+    return data
+
+
+def without_lines(response: Dict[str, Any]) -> Dict[str, Any]:
+    """A shallow copy of an ExtractResponse whose blocks carry no `lines`."""
+    if "blocks" not in response:
+        return response
+    return {**response, "blocks": [
+        {key: value for key, value in block.items() if key != "lines"} for block in response["blocks"]
+    ]}
+
+
+def shape_page(response: Dict[str, Any], tree: Optional[Dict[str, Any]], include_lines: bool) -> Dict[str, Any]:
+    """An ExtractResponse cut down to what the client asked for."""
+    if not include_lines:
+        response = without_lines(response)
+    if tree is None:
+        return response
+    shaped = project(response, tree)
+    # Failures (e.g. of the PDF export) are reported whatever was asked for
+    if "errors" in response:
+        shaped["errors"] = response["errors"]
+    return shaped
+
+
+def shape_event(event: Dict[str, Any], tree: Optional[Dict[str, Any]], include_lines: bool) -> Optional[Dict[str, Any]]:
+    """
+    A streaming event of a page, cut down as shape_page cuts the page; None
+    if nothing of it was asked for.
+    """
+    if tree is None and include_lines:
+        return event
+    if event["type"] == "meta":
+        return {**event, "data": shape_page(event["data"], tree, include_lines)}
+    key = EVENT_KEYS.get(event["type"])
+    if key is None:
+        return event
+    shaped = shape_page({key: [event["data"]]}, tree, include_lines)
+    return {**event, "data": shaped[key][0]} if key in shaped else None
+
+
+async def shape_events(events, tree: Optional[Dict[str, Any]], include_lines: bool):
+    """The events of a page stream, cut down by shape_event."""
+    async for event in events:
+        shaped = shape_event(event, tree, include_lines)
+        if shaped is not None:
+            yield shaped
+
+
+def negotiate_media_type(accept: Optional[str]) -> str:
+    """MessagePack if the Accept header lists it first and msgpack is installed, JSON otherwise."""
+    for part in (accept or "").split(","):
+        media_type = part.split(";")[0].strip().lower()
+        if media_type in MSGPACK_MEDIA_TYPES and msgpack is not None:
+            return MSGPACK_MEDIA_TYPE
+        if media_type in (JSON_MEDIA_TYPE, "application/*", "*/*"):
+            return JSON_MEDIA_TYPE
+    return JSON_MEDIA_TYPE
+
+
+def negotiate_encoding(accept_encoding: Optional[str]) -> Optional[str]:
+    """br or gzip, whichever the Accept-Encoding header allows (brotli first, if installed)."""
+    accepted = set()
+    for part in (accept_encoding or "").split(","):
+        coding, *params = [item.strip() for item in part.lower().split(";")]
+        q = 1.0
+        for param in params:
+            name, _, value = param.partition("=")
+            if name.strip() == "q":
+                try:
+                    q = float(value)
+                except ValueError:
+                    q = 0.0
+        if coding and q > 0:
+            accepted.add(coding)
+    if brotli is not None and ("br" in accepted or "*" in accepted):
+        return "br"
+    if "gzip" in accepted or "*" in accepted:
+        return "gzip"
+    return None
+
+
+def encode_body(data: Any, media_type: str) -> bytes:
+    if media_type == MSGPACK_MEDIA_TYPE:
+        return msgpack.packb(data, use_bin_type=True)
+    return dumps(data)
+
+
+def compress(body: bytes, coding: Optional[str]) -> bytes:
+    if coding == "br":
+        return brotli.compress(body, quality=BROTLI_QUALITY)
+    if coding == "gzip":
+        return gzip.compress(body, compresslevel=GZIP_LEVEL)
+    return body
+
+
+def render(data: Any, accept: Optional[str] = None, accept_encoding: Optional[str] = None,
+           compress_min_bytes: int = 0, status_code: int = 200) -> Response:
+    """
+    The response of `data` in the media type and content coding the client
+    accepts. Bodies smaller than `compress_min_bytes` (or all, if it is 0)
+    are sent uncompressed.
+    """
+    media_type = negotiate_media_type(accept)
+    body = encode_body(data, media_type)
+    headers = {"Vary": "Accept, Accept-Encoding"}
+    coding = negotiate_encoding(accept_encoding) if compress_min_bytes and len(body) >= compress_min_bytes else None
+    if coding:
+        body = compress(body, coding)
+        headers["Content-Encoding"] = coding
+    return Response(content=body, status_code=status_code, media_type=media_type, headers=headers)
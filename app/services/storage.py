@@ -0,0 +1,222 @@
+"""
+Layout and lifecycle of the stored outputs under OUTPUT_DIR.
+
+Request directories are sharded by the first characters of their id
+(`OUTPUT_DIR/3f/3fa85f64-.../`), so no directory grows to millions of
+entries; URLs keep the unsharded `/outputs/<request_id>/...` form (see
+ShardedStaticFiles). Directories written before sharding are still found
+at `OUTPUT_DIR/<request_id>/`.
+
+Uploaded inputs are stored once per content hash under `OUTPUT_DIR/_inputs/`
+and hardlinked into each request directory that uses them.
+
+sweep() evicts request directories older than the TTL, then the oldest
+ones until the total size fits the quota. Directories with output writes
+in flight (a live pending marker, see app.services.artifacts), or claimed
+by the `protect` callback (active jobs), are kept.
+Names starting with "_" (result cache, job markers, inputs) are not
+request directories and are never swept.
+"""
+import hashlib
+import logging
+import os
+import shutil
+import time
+import uuid
+from pathlib import Path
+from typing import Callable, Dict, List, Optional, Tuple
+
+from starlette.staticfiles import StaticFiles
+from starlette.types import Scope
+
+from app.services.artifacts import PENDING_PREFIX, marker_alive
+
+logger = logging.getLogger(__name__)
+
+SHARD_CHARS = 2
+INPUTS_DIR = "_inputs"
+# Unreferenced inputs younger than this are kept: a request may be about to link them
+INPUT_GRACE_S = 300
+
+
+def _is_request_id(name: str) -> bool:
+    try:
+        uuid.UUID(name)
+    except ValueError:
+        return False
+    return len(name) == 36
+
+
+class StorageManager:
+    def __init__(self, root: Path, ttl_s: float = 0, max_bytes: int = 0, dedupe_inputs: bool = True,
+                 protect: Optional[Callable[[str], bool]] = None):
+        self.root = root
+        self.ttl_s = ttl_s
+        self.max_bytes = max_bytes
+        self.dedupe_inputs = dedupe_inputs
+        self.protect = protect
+
+    def shard(self, request_id: str) -> str:
+        """The directory of `request_id` relative to the root."""
+        legacy = self.root / request_id
+        if legacy.is_dir():
+            return request_id
+        return f"{request_id[:SHARD_CHARS]}/{request_id}"
+
+    def request_dir(self, request_id: str) -> Path:
+        return self.root / self.shard(request_id)
+
+    def output_file(self, url: str) -> Optional[Path]:
+        """The file behind an `/outputs/<request_id>/<name>` URL, or None for other URLs."""
+        parts = url.strip("/").split("/")
+        if len(parts) != 3 or parts[0] != "outputs" or not _is_request_id(parts[1]):
+            return None
+        if parts[2] in ("", ".", ".."):
+            return None
+        return self.request_dir(parts[1]) / parts[2]
+
+    def store_input(self, path: Path, data):
+        """
+        Writes an uploaded input to `path`, as a hardlink to the single copy
+        of identical uploads when deduplication is on.
+        """
+        if not self.dedupe_inputs:
+            _write_atomic(path, data)
+            return
+        digest = hashlib.sha256(data).hexdigest()
+        blob = self.root / INPUTS_DIR / digest[:SHARD_CHARS] / digest
+        try:
+            # Refresh the mtime so the sweeper gives the blob its grace period
+            os.utime(blob)
+        except FileNotFoundError:
+            blob.parent.mkdir(parents=True, exist_ok=True)
+            _write_atomic(blob, data)
+        try:
+            os.link(blob, path)
+        except OSError:
+            # Blob swept meanwhile, or no hardlinks on this volume
+            _write_atomic(path, data)
+
+    def sweep(self, now: Optional[float] = None) -> Dict[str, int]:
+        """
+        Evicts expired request directories, then the oldest ones while over
+        the quota, and drops inputs no request links to anymore.
+        """
+        now = time.time() if now is None else now
+        entries = self._scan()
+        total = sum(size for _, _, size in entries)
+        removed = freed = 0
+
+        keep: List[Tuple[Path, float, int]] = []
+        for path, mtime, size in entries:
+            if self.ttl_s and now - mtime > self.ttl_s and self._evictable(path, now):
+                removed, freed, total = removed + 1, freed + size, total - size
+                _remove(path)
+            else:
+                keep.append((path, mtime, size))
+
+        if self.max_bytes and total > self.max_bytes:
+            for path, _, size in sorted(keep, key=lambda entry: entry[1]):
+                if total <= self.max_bytes:
+                    break
+                if self._evictable(path, now):
+                    removed, freed, total = removed + 1, freed + size, total - size
+                    _remove(path)
+
+        freed += self._sweep_inputs(now)
+        if removed:
+            logger.info(f"Storage sweep removed {removed} request directories ({freed} bytes)")
+        return {"removed": removed, "freed_bytes": freed, "total_bytes": total}
+
+    def _evictable(self, path: Path, now: float) -> bool:
+        if self.protect is not None and self.protect(path.name):
+            return False
+        try:
+            names = os.listdir(path)
+        except OSError:
+            return False
+        # Markers left behind by a writer that died do not keep a directory forever
+        return not any(name.startswith(PENDING_PREFIX) and marker_alive(path / name, now) for name in names)
+
+    def _scan(self) -> List[Tuple[Path, float, int]]:
+        """(path, mtime, size) of every request directory; shared inputs count once."""
+        entries, seen = [], set()
+        for top in _scandir(self.root):
+            if not top.is_dir(follow_symlinks=False) or top.name.startswith("_"):
+                continue
+            if _is_request_id(top.name):
+                dirs = [top]
+            else:
+                dirs = [d for d in _scandir(Path(top.path)) if d.is_dir(follow_symlinks=False)]
+            for d in dirs:
+                try:
+                    mtime = d.stat(follow_symlinks=False).st_mtime
+                except OSError:
+                    continue
+                entries.append((Path(d.path), mtime, _tree_size(Path(d.path), seen)))
+        return entries
+
+    def _sweep_inputs(self, now: float) -> int:
+        freed = 0
+        for shard in _scandir(self.root / INPUTS_DIR):
+            for blob in _scandir(Path(shard.path)):
+                try:
+                    st = blob.stat(follow_symlinks=False)
+                    if st.st_nlink == 1 and now - st.st_mtime > INPUT_GRACE_S:
+                        os.unlink(blob.path)
+                        freed += st.st_size
+                except OSError:
+                    continue
+        return freed
+
+
+def _scandir(path: Path) -> List[os.DirEntry]:
+    try:
+        with os.scandir(path) as it:
+            return list(it)
+    except OSError:
+        return []
+
+
+def _tree_size(path: Path, seen: set) -> int:
+    size = 0
+    for entry in _scandir(path):
+        try:
+            if entry.is_dir(follow_symlinks=False):
+                size += _tree_size(Path(entry.path), seen)
+                continue
+            st = entry.stat(follow_symlinks=False)
+        except OSError:
+            continue
+        if st.st_nlink > 1:
+            if (st.st_dev, st.st_ino) in seen:
+                continue
+            seen.add((st.st_dev, st.st_ino))
+        size += st.st_size
+    return size
+
+
+def _write_atomic(path: Path, data):
+    # A name of its own: identical uploads arriving together write the same blob
+    tmp_path = path.with_name(f".{path.name}.{os.getpid()}.{uuid.uuid4().hex}.tmp")
+    tmp_path.write_bytes(data)
+    tmp_path.replace(path)
+
+
+def _remove(path: Path):
+    shutil.rmtree(path, ignore_errors=True)
+
+
+class ShardedStaticFiles(StaticFiles):
+    """Serves `/outputs/<request_id>/...` from the request's sharded directory."""
+
+    def __init__(self, storage: StorageManager, **kwargs):
+        super().__init__(directory=str(storage.root), **kwargs)
+        self.storage = storage
+
+    def get_path(self, scope: Scope) -> str:
+        path = super().get_path(scope)
+        head, sep, rest = path.partition(os.sep)
+        if _is_request_id(head):
+            return os.path.join(*self.storage.shard(head).split("/"), rest) if sep else self.storage.shard(head)
+        return path
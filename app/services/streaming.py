@@ -0,0 +1,62 @@
+"""
+Incremental extraction events and their NDJSON / Server-Sent Events encoding.
+
+An extraction streams as a sequence of events, each a dict with a `type`
+and a `data` payload:
+
+- ``block``  - one entry of ExtractResponse.blocks, as soon as it is built
+- ``figure`` - one entry of ExtractResponse.figures
+- ``page``   - one finished page of a batch or job: `index`, `filename`,
+  `status`, `error` and its whole ExtractResponse as `result`
+- ``meta``   - the closing record of /extract and /extract/batch: meta (with
+  timings) and exports
+- ``job``    - the closing record of a job stream: the job state
+- ``error``  - the stream failed; `data.detail` says why
+"""
+import json
+from typing import Any, Dict, Iterable, List, Optional
+
+NDJSON_MEDIA_TYPE = "application/x-ndjson"
+SSE_MEDIA_TYPE = "text/event-stream"
+
+
+def negotiate_stream_format(accept: Optional[str]) -> Optional[str]:
+    """Returns the streaming media type requested by an Accept header, if any."""
+    if not accept:
+        return None
+    for part in accept.split(","):
+        media_type = part.split(";")[0].strip().lower()
+        if media_type in (NDJSON_MEDIA_TYPE, "application/jsonl"):
+            return NDJSON_MEDIA_TYPE
+        if media_type == SSE_MEDIA_TYPE:
+            return SSE_MEDIA_TYPE
+    return None
+
+
+def encode_event(media_type: str, event: Dict[str, Any]) -> bytes:
+    if media_type == SSE_MEDIA_TYPE:
+        return f"event: {event['type']}\ndata: {json.dumps(event['data'])}\n\n".encode()
+    return (json.dumps(event) + "\n").encode()
+
+
+def page_events(response: Dict[str, Any]) -> List[Dict[str, Any]]:
+    """Splits a complete ExtractResponse into the events that stream it."""
+    events = [{"type": "block", "data": block} for block in response["blocks"]]
+    events += [{"type": "figure", "data": figure} for figure in response["figures"]]
+    events.append({"type": "meta", "data": {"meta": response["meta"], "exports": response["exports"]}})
+    return events
+
+
+def collect_page(events: Iterable[Dict[str, Any]]) -> Dict[str, Any]:
+    """Assembles the events of one page back into an ExtractResponse."""
+    blocks, figures, closing = [], [], None
+    for event in events:
+        if event["type"] == "block":
+            blocks.append(event["data"])
+        elif event["type"] == "figure":
+            figures.append(event["data"])
+        elif event["type"] == "meta":
+            closing = event["data"]
+    if closing is None:
+        raise ValueError("Extraction stream ended without a meta record")
+    return {"meta": closing["meta"], "blocks": blocks, "figures": figures, "exports": closing["exports"]}
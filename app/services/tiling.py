@@ -0,0 +1,349 @@
+"""
+Tiled inference for pages too large to run through the engines in one
+call: flatbed scans at 600 dpi, two-page spreads.
+
+The page is cut into overlapping tiles of at most `tile_size` pixels a
+side; each tile runs through the engines on its own (in parallel on the
+engine pool when served through the API), so the memory an engine needs
+depends on the tile size, not on the page. The regions of all tiles are
+then mapped to page coordinates and merged:
+
+- regions that are the same region seen from two tiles (mostly
+  overlapping) are merged into one, as in non-maximum suppression;
+- regions cut by a tile border, whose rest is in the neighbouring tile,
+  are joined into the region spanning the border;
+- within a merged region, duplicate lines from the overlap are
+  suppressed, complete lines winning over lines cut by a border, and
+  lines cut by a left/right border are joined with their other half.
+"""
+import asyncio
+import difflib
+import math
+from typing import Any, Dict, List, Optional, Sequence, Tuple
+
+import numpy as np
+
+from app.services.image_ingest import plan_scale
+
+# (x, y, width, height) of a tile in page coordinates
+Tile = Tuple[int, int, int, int]
+
+# A region closer than this many pixels to an inner tile border is cut by it;
+# a line, closer than this many of its heights (a glyph may be partly visible)
+EDGE_PX = 16
+EDGE_LINE_HEIGHTS = 1.0
+# Boxes from two tiles overlapping by more than this fraction of the
+# smaller one are the same box
+NMS_OVERLAP = 0.5
+# Fragments of a region cut by a border share at least this fraction of
+# their extent along the border
+ALIGN_OVERLAP = 0.5
+# Characters two halves of a cut line must share to be joined on them
+MIN_JOIN_OVERLAP = 3
+
+# Regions of these types are merged with each other (a truncated
+# paragraph may be labelled as a title); other types only with their own
+TEXT_TYPES = {"text", "title", "list", "header", "footer", "reference"}
+
+
+def plan_inference(img: np.ndarray, max_side: int = 0, target_text_px: int = 0,
+                   tile_size: int = 0) -> Tuple[float, bool]:
+    """
+    (scale, tiled): the factor to resize the page by before inference and
+    whether to run it in tiles. A page still larger than `tile_size` after
+    text-driven downscaling is tiled instead of being shrunk to `max_side`,
+    which would make its text too small to read. Tiling is off when
+    `tile_size` is 0.
+    """
+    scale = plan_scale(img, 0, target_text_px)
+    long_side = max(img.shape[:2])
+    if tile_size and long_side * scale > tile_size:
+        return scale, True
+    if max_side:
+        scale = min(scale, max_side / long_side)
+    return scale, False
+
+
+def plan_tiles(width: int, height: int, tile_size: int, overlap: int) -> List[Tile]:
+    """
+    Tiles of at most `tile_size` pixels a side covering the page, row by
+    row. Neighbouring tiles overlap by at least `overlap` pixels (capped at
+    half a tile).
+    """
+    overlap = min(overlap, tile_size // 2)
+
+    def starts(length: int) -> List[int]:
+        if length <= tile_size:
+            return [0]
+        count = math.ceil((length - overlap) / (tile_size - overlap))
+        step = (length - tile_size) / (count - 1)
+        return [round(i * step) for i in range(count)]
+
+    return [
+        (x, y, min(tile_size, width - x), min(tile_size, height - y))
+        for y in starts(height) for x in starts(width)
+    ]
+
+
+def _cut_sides(boxes: np.ndarray, tile: Tile, width: int, height: int, margin=EDGE_PX) -> np.ndarray:
+    """
+    (N, 4) flags: is each page-coordinate box cut by its tile's left, top,
+    right, bottom border, i.e. within `margin` pixels of an inner border?
+    """
+    x, y, w, h = tile
+    inner = np.array([x > 0, y > 0, x + w < width, y + h < height])
+    near = np.stack([
+        boxes[:, 0] <= x + margin, boxes[:, 1] <= y + margin,
+        boxes[:, 2] >= x + w - margin, boxes[:, 3] >= y + h - margin,
+    ], axis=1)
+    return near & inner
+
+
+def _pairs_to_merge(boxes: np.ndarray, tiles: np.ndarray, kinds: np.ndarray, cut: np.ndarray) -> np.ndarray:
+    """
+    (i, j) index pairs of boxes from different tiles that are one box:
+    duplicates (mostly overlapping), or fragments cut by a border that
+    overlap and line up along it.
+    """
+    x1, y1, x2, y2 = (boxes[:, k] for k in range(4))
+    overlap_w = np.minimum(x2[:, None], x2[None, :]) - np.maximum(x1[:, None], x1[None, :])
+    overlap_h = np.minimum(y2[:, None], y2[None, :]) - np.maximum(y1[:, None], y1[None, :])
+    w, h = np.maximum(x2 - x1, 1), np.maximum(y2 - y1, 1)
+    intersects = (overlap_w > 0) & (overlap_h > 0)
+    inter = np.clip(overlap_w, 0, None) * np.clip(overlap_h, 0, None)
+    duplicate = inter >= NMS_OVERLAP * np.minimum((w * h)[:, None], (w * h)[None, :])
+    # Cut at a top/bottom border: must line up horizontally, and the other way round
+    cut_y = cut[:, 1] | cut[:, 3]
+    cut_x = cut[:, 0] | cut[:, 2]
+    aligned_x = overlap_w >= ALIGN_OVERLAP * np.minimum(w[:, None], w[None, :])
+    aligned_y = overlap_h >= ALIGN_OVERLAP * np.minimum(h[:, None], h[None, :])
+    fragments = (((cut_y[:, None] | cut_y[None, :]) & aligned_x)
+                 | ((cut_x[:, None] | cut_x[None, :]) & aligned_y))
+    merge = intersects & (duplicate | fragments)
+    merge &= (tiles[:, None] != tiles[None, :]) & (kinds[:, None] == kinds[None, :])
+    return np.argwhere(np.triu(merge, 1))
+
+
+def _clusters(count: int, pairs: np.ndarray) -> List[List[int]]:
+    """Connected components of `pairs` over `count` items, in order of their first item."""
+    parent = list(range(count))
+
+    def find(i: int) -> int:
+        while parent[i] != i:
+            parent[i] = parent[parent[i]]
+            i = parent[i]
+        return i
+
+    for i, j in pairs:
+        parent[find(int(j))] = find(int(i))
+    groups: Dict[int, List[int]] = {}
+    for i in range(count):
+        groups.setdefault(find(i), []).append(i)
+    return list(groups.values())
+
+
+def _join_text(left: str, right: str) -> str:
+    """Joins the halves of a line cut by a border, dropping the text both tiles read."""
+    tail, head = left[-len(right):], right[:len(left)]
+    match = difflib.SequenceMatcher(None, tail, head, autojunk=False).find_longest_match(
+        0, len(tail), 0, len(head)
+    )
+    if match.size < MIN_JOIN_OVERLAP:
+        return f"{left} {right}"
+    return left[:len(left) - len(tail) + match.a] + right[match.b:]
+
+
+def _rect(x1: float, y1: float, x2: float, y2: float) -> List[List[float]]:
+    return [[x1, y1], [x2, y1], [x2, y2], [x1, y2]]
+
+
+def _merge_lines(lines: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+    """
+    The lines of a merged region: duplicates suppressed, halves of lines
+    cut by a left/right border joined, in reading order (rows top to
+    bottom, left to right within a row). Lines carry their page box, tile
+    and cut sides in '_box', '_tile' and '_cut'.
+    """
+    if len(lines) < 2:
+        return lines
+    boxes = np.array([line["_box"] for line in lines], dtype=np.float64)
+    cut = np.array([line["_cut"] for line in lines])
+    tiles = np.array([line["_tile"] for line in lines])
+    confidence = np.array([float(line.get("confidence", 0.0)) for line in lines])
+    w = np.maximum(boxes[:, 2] - boxes[:, 0], 1)
+    h = np.maximum(boxes[:, 3] - boxes[:, 1], 1)
+    overlap_w = np.minimum(boxes[:, None, 2], boxes[None, :, 2]) - np.maximum(boxes[:, None, 0], boxes[None, :, 0])
+    overlap_h = np.minimum(boxes[:, None, 3], boxes[None, :, 3]) - np.maximum(boxes[:, None, 1], boxes[None, :, 1])
+    inter = np.clip(overlap_w, 0, None) * np.clip(overlap_h, 0, None)
+    same_row = (overlap_w > 0) & (overlap_h >= ALIGN_OVERLAP * np.minimum(h[:, None], h[None, :]))
+    # The two halves of a line cut by a vertical border overlap, but are not duplicates
+    halves = same_row & ((cut[:, None, 2] & cut[None, :, 0] & (boxes[:, None, 0] < boxes[None, :, 0]))
+                         | (cut[:, None, 0] & cut[None, :, 2] & (boxes[:, None, 0] > boxes[None, :, 0])))
+    other_tile = tiles[:, None] != tiles[None, :]
+    duplicate = (inter >= NMS_OVERLAP * np.minimum((w * h)[:, None], (w * h)[None, :])) & ~halves & other_tile
+
+    # Complete lines first, then the longest (most text), then the most confident
+    kept: List[int] = []
+    for i in np.lexsort((-confidence, -w, cut.any(axis=1))):
+        if not duplicate[i, kept].any():
+            kept.append(int(i))
+
+    merged: List[Dict[str, Any]] = []
+    joined = set()
+    for i in sorted(kept, key=lambda k: boxes[k, 0]):
+        if i in joined:
+            continue
+        line, box, last = dict(lines[i]), boxes[i].copy(), i
+        # Follow the line to the right across as many borders as it crosses
+        while True:
+            right = [j for j in kept if j not in joined and halves[last, j] and boxes[j, 0] > boxes[last, 0]
+                     and other_tile[last, j]]
+            if not right:
+                break
+            j = min(right, key=lambda k: boxes[k, 0])
+            line["text"] = _join_text(line["text"], lines[j]["text"])
+            line["confidence"] = min(float(line.get("confidence", 0.0)), float(confidence[j]))
+            box = np.array([box[0], min(box[1], boxes[j, 1]), boxes[j, 2], max(box[3], boxes[j, 3])])
+            line["text_region"] = _rect(*box.tolist())
+            joined.add(j)
+            last = j
+        joined.add(i)
+        line["_box"] = box.tolist()
+        merged.append(line)
+
+    # Rows top to bottom: a line starts a new row when its centre is half a
+    # line height below the first line of the current row
+    row_gap = 0.5 * float(np.median([line["_box"][3] - line["_box"][1] for line in merged]))
+    merged.sort(key=lambda line: line["_box"][1] + line["_box"][3])
+    rows: List[List[Dict[str, Any]]] = []
+    row_center = None
+    for line in merged:
+        center = (line["_box"][1] + line["_box"][3]) / 2
+        if row_center is None or center - row_center > row_gap:
+            rows.append([])
+            row_center = center
+        rows[-1].append(line)
+    return [line for row in rows for line in sorted(row, key=lambda line: line["_box"][0])]
+
+
+def merge_tiles(tile_results: Sequence[Tuple[Tile, List[Dict[str, Any]]]], width: int,
+                height: int) -> List[Dict[str, Any]]:
+    """
+    Merges the regions each tile's engine run returned (in tile
+    coordinates) into the regions of the whole page, in page coordinates,
+    in the engines' own format ('type', 'bbox', 'score', 'res' lines with
+    'text_region' polygons). Region crops ('img') are not carried over.
+    """
+    regions: List[Dict[str, Any]] = []
+    tile_ids, cuts = [], []
+    for tile_id, (tile, tile_regions) in enumerate(tile_results):
+        x, y = tile[0], tile[1]
+        for region in tile_regions:
+            x1, y1, x2, y2 = (int(v) for v in region["bbox"])
+            page_region = {key: value for key, value in region.items() if key != "img"}
+            page_region["bbox"] = [x1 + x, y1 + y, x2 + x, y2 + y]
+            res = region.get("res")
+            if isinstance(res, list):
+                lines = []
+                for line in res:
+                    line = dict(line)
+                    if line.get("text_region") is not None:
+                        polygon = np.asarray(line["text_region"], dtype=np.float64) + (x, y)
+                        line["text_region"] = polygon.tolist()
+                        line["_box"] = [*polygon.min(axis=0), *polygon.max(axis=0)]
+                        line["_tile"] = tile_id
+                    lines.append(line)
+                page_region["res"] = lines
+            regions.append(page_region)
+            tile_ids.append(tile_id)
+        if tile_regions:
+            boxes = np.array([r["bbox"] for r in regions[-len(tile_regions):]], dtype=np.float64)
+            cuts.append(_cut_sides(boxes, tile, width, height))
+    if not regions:
+        return []
+
+    boxes = np.array([region["bbox"] for region in regions], dtype=np.float64)
+    cut = np.concatenate(cuts)
+    kinds = np.array([
+        "text" if str(region.get("type", "text")).lower() in TEXT_TYPES else str(region.get("type")).lower()
+        for region in regions
+    ])
+    clusters = _clusters(len(regions), _pairs_to_merge(boxes, np.array(tile_ids), kinds, cut))
+
+    merged = []
+    for members in clusters:
+        areas = (boxes[members, 2] - boxes[members, 0]) * (boxes[members, 3] - boxes[members, 1])
+        complete = ~cut[members].any(axis=1)
+        # The largest complete region speaks for the merged one
+        lead = members[int(np.lexsort((-areas, ~complete))[0])]
+        region = dict(regions[lead])
+        region["bbox"] = [int(boxes[members, 0].min()), int(boxes[members, 1].min()),
+                          int(boxes[members, 2].max()), int(boxes[members, 3].max())]
+        if "score" in region:
+            region["score"] = max(float(regions[m].get("score", 0.0)) for m in members)
+        if len(members) > 1 and isinstance(region.get("res"), list):
+            lines = []
+            for m in members:
+                for line in regions[m].get("res") or []:
+                    if "_box" in line:
+                        box = np.array([line["_box"]])
+                        margin = max(EDGE_PX, EDGE_LINE_HEIGHTS * (box[0, 3] - box[0, 1]))
+                        line["_cut"] = _cut_sides(box, tile_results[line["_tile"]][0], width, height, margin)[0].tolist()
+                        lines.append(line)
+                    elif m == lead:
+                        # Without a polygon a line cannot be matched across tiles
+                        lines.append(line)
+            boxed = [line for line in lines if "_box" in line]
+            region["res"] = _merge_lines(boxed) + [line for line in lines if "_box" not in line]
+        merged.append(region)
+
+    for region in merged:
+        if isinstance(region.get("res"), list):
+            region["res"] = [{k: v for k, v in line.items() if not k.startswith("_")} for line in region["res"]]
+    return merged
+
+
+def add_engine_times(total: Optional[Dict[str, float]], times: Optional[Dict[str, float]]):
+    """Sums the engines' stage times (and counters) over tiles; None if any tile had none."""
+    if total is None or times is None:
+        return None
+    return {key: total.get(key, 0.0) + times.get(key, 0.0) for key in {**total, **times}}
+
+
+async def run_tiles(pool, engine_img: np.ndarray, tiles: Sequence[Tile], ocr_engine: str, layout_engine: str,
+                    profile_path: Optional[str] = None):
+    """
+    Runs every tile through `pool` (ExtractionService.extract_tile), at
+    most one per worker at a time so only that many tile copies exist.
+    Returns the merged regions, the summed engine times and the queue
+    statistics (depth at admission of the first tile, longest wait).
+    """
+    semaphore = asyncio.Semaphore(pool.workers)
+    height, width = engine_img.shape[:2]
+
+    async def run(index: int, tile: Tile):
+        x, y, w, h = tile
+        async with semaphore:
+            # One contiguous copy per tile, handed to workers as a flat buffer
+            # (through shared memory in process mode)
+            pixels = await asyncio.to_thread(
+                lambda: memoryview(np.ascontiguousarray(engine_img[y:y + h, x:x + w])).cast("B")
+            )
+            return await pool.run(
+                "extract_tile", wait_for_slot=True, profile_path=profile_path if index == 0 else None,
+                pixels=pixels, shape=(h, w, engine_img.shape[2]), ocr_engine=ocr_engine,
+                layout_engine=layout_engine,
+            )
+
+    outcomes = await asyncio.gather(*(run(index, tile) for index, tile in enumerate(tiles)))
+    engine_times: Optional[Dict[str, float]] = {"layout": 0.0, "det": 0.0, "rec": 0.0}
+    for (_, times), _ in outcomes:
+        engine_times = add_engine_times(engine_times, times)
+    stats = {
+        "queue_depth": outcomes[0][1]["queue_depth"],
+        "queue_wait": max(queue["queue_wait"] for _, queue in outcomes),
+    }
+    regions = await asyncio.to_thread(
+        merge_tiles, [(tile, result[0]) for tile, (result, _) in zip(tiles, outcomes)], width, height
+    )
+    return regions, engine_times, stats
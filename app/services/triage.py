@@ -0,0 +1,114 @@
+"""
+Page triage: a quick look at a page before inference, to skip the engines
+on pages that have nothing for them to read.
+
+The page is shrunk to a thumbnail (THUMB_SIDE on its long side) and its
+margins are ignored. Paper is the brightness most of the page is at least
+as dark as; ink is anything INK_CONTRAST grey levels darker than that,
+which leaves out show-through and stains. The ink's connected components
+are then told apart by shape: a word or a few letters at body-text size is
+short and not much wider than a line's worth, anything taller is an
+illustration (or a heading set very large).
+
+- blank: less than BLANK_INK of the page is ink and there is no text
+- figure: there is no text, but ink covering at least FIGURE_MIN_AREA of
+  the page; it is returned as a single figure region around all the ink
+- text: everything else, which goes through layout and OCR as usual
+
+A page is only called blank or a figure when it holds fewer than
+MIN_TEXT_COMPONENTS word-like components, so a caption or a single line of
+text is enough to send it to the engines.
+"""
+from typing import Any, Dict, List, NamedTuple
+
+import cv2
+import numpy as np
+
+# Long side of the thumbnail triage looks at
+THUMB_SIDE = 1024
+# Fraction of each side that is page margin (scanner borders, gutter shadow)
+MARGIN = 0.03
+# Ink is at least this many grey levels darker than the paper
+INK_CONTRAST = 48
+# Components smaller than this (thumbnail pixels) are dust
+MIN_COMPONENT_PX = 4
+# Word-like components are this fraction of the page high...
+TEXT_MIN_HEIGHT = 0.003
+TEXT_MAX_HEIGHT = 0.04
+# ...and this many times as wide as they are high
+TEXT_MAX_ASPECT = 30
+# Word-like components less than this many thumbnail pixels from an illustration are part of it
+FIGURE_GAP_PX = 7
+# Pages with fewer word-like components have no text
+MIN_TEXT_COMPONENTS = 3
+# Pages with less ink than this fraction are blank
+BLANK_INK = 0.002
+# Figures cover at least this fraction of the page
+FIGURE_MIN_AREA = 0.05
+
+DECISIONS = ("blank", "figure", "text")
+
+
+class PageTriage(NamedTuple):
+    # One of DECISIONS
+    decision: str
+    # Fraction of the page (margins excluded) that is ink
+    ink_ratio: float
+    # Number of word-like ink components
+    text_components: int
+    # Regions standing in for the engines' on blank and figure pages, in page coordinates
+    regions: List[Dict[str, Any]]
+
+    def meta(self) -> Dict[str, Any]:
+        return {"decision": self.decision, "ink_ratio": round(self.ink_ratio, 4),
+                "text_components": self.text_components}
+
+
+def triage_page(img: np.ndarray) -> PageTriage:
+    """Decides whether the page (BGR) is blank, a figure only or has text on it."""
+    height, width = img.shape[:2]
+    scale = min(1.0, THUMB_SIDE / max(height, width))
+    thumb = img if scale == 1.0 else cv2.resize(
+        img, (max(1, round(width * scale)), max(1, round(height * scale))), interpolation=cv2.INTER_AREA
+    )
+    gray = cv2.cvtColor(thumb, cv2.COLOR_BGR2GRAY) if thumb.ndim == 3 else thumb
+    thumb_h, thumb_w = gray.shape
+    top, left = int(thumb_h * MARGIN), int(thumb_w * MARGIN)
+    # The median drops dust and the grain of photographs, not letters
+    gray = cv2.medianBlur(np.ascontiguousarray(gray[top:thumb_h - top, left:thumb_w - left]), 3)
+
+    paper = np.percentile(gray, 95)
+    ink = (gray < paper - INK_CONTRAST).astype(np.uint8)
+    _, labels, stats, centroids = cv2.connectedComponentsWithStats(ink, connectivity=8)
+    kept = np.nonzero(stats[:, cv2.CC_STAT_AREA] >= MIN_COMPONENT_PX)[0]
+    kept = kept[kept > 0]
+    stats, centroids = stats[kept], centroids[kept].astype(int)
+    w, h = stats[:, cv2.CC_STAT_WIDTH], stats[:, cv2.CC_STAT_HEIGHT]
+    text_like = ((h >= TEXT_MIN_HEIGHT * gray.shape[0]) & (h <= TEXT_MAX_HEIGHT * gray.shape[0])
+                 & (w <= TEXT_MAX_ASPECT * h))
+    if text_like.any() and not text_like.all():
+        # Specks in the gaps of an illustration are part of it, not text. The
+        # closing fills gaps of a few pixels only, so a table's grid or a
+        # frame around the page does not swallow the words inside it.
+        figure_ink = np.isin(labels, kept[~text_like]).astype(np.uint8)
+        figure_ink = cv2.morphologyEx(figure_ink, cv2.MORPH_CLOSE, np.ones((FIGURE_GAP_PX, FIGURE_GAP_PX), np.uint8))
+        text_like &= figure_ink[centroids[:, 1], centroids[:, 0]] == 0
+    text_components = int(text_like.sum())
+    ink_ratio = float(stats[:, cv2.CC_STAT_AREA].sum()) / max(1, gray.size)
+
+    decision, regions = "text", []
+    if text_components < MIN_TEXT_COMPONENTS:
+        if ink_ratio < BLANK_INK:
+            decision = "blank"
+        elif len(stats):
+            x1, y1 = stats[:, cv2.CC_STAT_LEFT].min(), stats[:, cv2.CC_STAT_TOP].min()
+            x2, y2 = (stats[:, cv2.CC_STAT_LEFT] + w).max(), (stats[:, cv2.CC_STAT_TOP] + h).max()
+            if (x2 - x1) * (y2 - y1) >= FIGURE_MIN_AREA * gray.size:
+                decision = "figure"
+                # Back to page coordinates, rounded outwards
+                bbox = [
+                    max(0, int((x1 + left) / scale)), max(0, int((y1 + top) / scale)),
+                    min(width, int(np.ceil((x2 + left) / scale))), min(height, int(np.ceil((y2 + top) / scale))),
+                ]
+                regions = [{'type': 'figure', 'bbox': bbox, 'res': []}]
+    return PageTriage(decision, ink_ratio, text_components, regions)
@@ -0,0 +1,118 @@
+"""
+Bounded reading of uploads.
+
+BodySizeLimitMiddleware rejects a request with 413 as soon as its body is
+known to be too large: from Content-Length before anything is read, or
+while a chunked body streams in. Bodies under the limit are parsed by
+Starlette, which spools each file part to a temporary file (in memory up
+to 1 MB, on disk beyond).
+
+read_upload() then copies a spooled file, chunk by chunk, into a single
+buffer and hands out a read-only memoryview of it. That one buffer is what
+header validation, the result cache key, the stored input copy and the
+decode all read from; none of them copies it again.
+"""
+import io
+import json
+from typing import BinaryIO, Dict
+
+from starlette.exceptions import HTTPException
+
+# Bytes read from the spooled upload per call
+UPLOAD_CHUNK_SIZE = 1024 * 1024
+
+
+class UploadTooLargeError(ValueError):
+    """Raised when an upload exceeds the configured size limit."""
+
+    def __init__(self, max_bytes: int):
+        super().__init__(max_bytes)
+        self.max_bytes = max_bytes
+
+    def __str__(self):
+        return f"Upload exceeds the limit of {format_size(self.max_bytes)}."
+
+
+def read_upload(fileobj: BinaryIO, max_bytes: int, chunk_size: int = UPLOAD_CHUNK_SIZE) -> memoryview:
+    """
+    Reads a seekable upload into one buffer of exactly its size and returns
+    a read-only view of it. Raises UploadTooLargeError before reading
+    anything if the upload is over `max_bytes` (0 = no limit).
+    """
+    size = fileobj.seek(0, io.SEEK_END)
+    if max_bytes and size > max_bytes:
+        raise UploadTooLargeError(max_bytes)
+    fileobj.seek(0)
+    buffer = bytearray(size)
+    view = memoryview(buffer)
+    # SpooledTemporaryFile only has readinto from Python 3.11
+    readinto = getattr(fileobj, "readinto", None)
+    length = 0
+    while length < size:
+        if readinto is not None:
+            read = readinto(view[length:length + chunk_size])
+        else:
+            chunk = fileobj.read(min(chunk_size, size - length))
+            read = len(chunk)
+            view[length:length + read] = chunk
+        if not read:
+            break
+        length += read
+    return view[:length].toreadonly()
+
+
+class BodySizeLimitMiddleware:
+    """
+    ASGI middleware capping the request body of the paths in `limits`
+    (path -> bytes). Over the limit, the request is answered with 413 and
+    the rest of the body is never read. A body that streams past the limit
+    fails the form parsing with an HTTPException, which FastAPI passes on
+    instead of turning it into a 400.
+    """
+
+    def __init__(self, app, limits: Dict[str, int]):
+        self.app = app
+        self.limits = limits
+
+    async def __call__(self, scope, receive, send):
+        limit = self.limits.get(scope.get("path")) if scope["type"] == "http" else None
+        if not limit:
+            await self.app(scope, receive, send)
+            return
+
+        declared = dict(scope["headers"]).get(b"content-length")
+        if declared is not None and declared.isdigit() and int(declared) > limit:
+            await self._reject(send, limit)
+            return
+
+        received = 0
+
+        async def limited_receive():
+            nonlocal received
+            message = await receive()
+            if message["type"] == "http.request":
+                received += len(message.get("body", b""))
+                if received > limit:
+                    raise HTTPException(status_code=413, detail=_too_large(limit))
+            return message
+
+        await self.app(scope, limited_receive, send)
+
+    @staticmethod
+    async def _reject(send, limit: int):
+        body = json.dumps({"detail": _too_large(limit)}).encode()
+        await send({
+            "type": "http.response.start",
+            "status": 413,
+            "headers": [(b"content-type", b"application/json"), (b"content-length", str(len(body)).encode()),
+                        (b"connection", b"close")],
+        })
+        await send({"type": "http.response.body", "body": body})
+
+
+def format_size(size: int) -> str:
+    return f"{size / (1024 * 1024):.0f} MB" if size >= 1024 * 1024 else f"{size} bytes"
+
+
+def _too_large(limit: int) -> str:
+    return f"Request body exceeds the limit of {format_size(limit)}."
@@ -0,0 +1,387 @@
+"""
+Work queue that spreads engine calls over a fleet of worker nodes.
+
+API nodes (ENGINE_MODE=remote, see RemoteEnginePool) put each engine call
+in a SQLite database on the volume every node mounts; worker nodes take the
+calls out with QueueConsumer and run them on their own engine pool. There
+is no broker: the database file is the queue, so the nodes must share it
+on one host's filesystem (a Docker volume, a local disk), not over NFS,
+where SQLite's locking is unreliable.
+
+A worker node takes a task on a lease of `lease_s` seconds, which it
+renews with a heartbeat while the task runs. A task whose lease ran out
+(its worker node died or hung) is handed to the next worker node that asks
+for work, up to `max_attempts` times; after that it is abandoned. Results
+and errors stay in the queue until the API node that submitted the task
+takes them, or for RESULT_TTL_S if it never does. Files the engines write
+(figure crops, previews, profiles) go to the shared volume directly, under
+the paths the API node gave, which /outputs serves from every node.
+
+Tasks only go to worker nodes with the same engine options (see
+options_key), so results never depend on which node ran them. Arguments,
+results and errors are pickled: the queue must only be writable by the
+service itself.
+"""
+import asyncio
+import hashlib
+import json
+import logging
+import os
+import pickle
+import socket
+import sqlite3
+import threading
+import time
+import uuid
+from pathlib import Path
+from typing import Any, Dict, List, NamedTuple, Optional
+
+from app.services.engine_pool import EngineCrashedError
+
+logger = logging.getLogger(__name__)
+
+# How often idle worker nodes ask for work, and API nodes for results
+POLL_S = 0.05
+# Finished tasks no API node took are dropped after this long
+RESULT_TTL_S = 3600
+FINISHED_STATUSES = ("done", "failed", "abandoned")
+# Tasks a worker node may take: queued, or out of lease with attempts left
+CLAIMABLE = ("options = ? AND (status = 'queued' OR "
+             "(status = 'running' AND lease_expires < ? AND attempts < ?))")
+
+
+class QueuedTask(NamedTuple):
+    id: int
+    method: str
+    kwargs: Dict[str, Any]
+    # Whether `method` is a generator whose items are the result
+    collect: bool
+    profile_path: Optional[str]
+    attempts: int
+
+
+class FinishedTask(NamedTuple):
+    id: int
+    # One of FINISHED_STATUSES
+    status: str
+    # The result ("done"), the exception raised ("failed"), or None
+    value: Any
+    # Seconds between submission and the last attempt's start, and of the run
+    queue_wait_s: float
+    run_s: float
+
+
+def options_key(options: Dict[str, Any]) -> str:
+    """A short fingerprint of the engine options that change results."""
+    return hashlib.sha256(json.dumps(options, sort_keys=True, default=str).encode()).hexdigest()[:16]
+
+
+def _dumps(value: Any) -> bytes:
+    return pickle.dumps(value, protocol=pickle.HIGHEST_PROTOCOL)
+
+
+def _dump_error(error: BaseException) -> bytes:
+    # Exceptions whose constructor does not take their args back do not unpickle
+    try:
+        data = _dumps(error)
+        pickle.loads(data)
+        return data
+    except Exception:
+        return _dumps(RuntimeError(f"{type(error).__name__}: {error}"))
+
+
+class WorkQueue:
+    """
+    Engine calls in a SQLite database at `path`, leased to worker nodes for
+    `lease_s` seconds at a time and tried at most `max_attempts` times.
+    Safe to share between threads.
+    """
+
+    def __init__(self, path: Path, lease_s: float = 30, max_attempts: int = 3):
+        self.path = Path(path)
+        self.lease_s = lease_s
+        self.max_attempts = max(1, max_attempts)
+        self._lock = threading.Lock()
+        self._reaped_at = 0.0
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self._db = sqlite3.connect(str(self.path), timeout=30, check_same_thread=False, isolation_level=None)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute("PRAGMA synchronous=NORMAL")
+        self._db.execute(
+            # AUTOINCREMENT: a taken task's id is never handed out again
+            "CREATE TABLE IF NOT EXISTS tasks (id INTEGER PRIMARY KEY AUTOINCREMENT, options TEXT NOT NULL, "
+            "method TEXT NOT NULL, payload BLOB NOT NULL, status TEXT NOT NULL DEFAULT 'queued', "
+            "attempts INTEGER NOT NULL DEFAULT 0, worker_id TEXT, lease_expires REAL, "
+            "created_at REAL NOT NULL, started_at REAL, finished_at REAL, run_s REAL, result BLOB)"
+        )
+        self._db.execute("CREATE INDEX IF NOT EXISTS tasks_claim ON tasks (options, status, id)")
+        self._db.execute("CREATE INDEX IF NOT EXISTS tasks_worker ON tasks (worker_id, status)")
+        self._db.execute(
+            "CREATE TABLE IF NOT EXISTS workers (id TEXT PRIMARY KEY, options TEXT NOT NULL, "
+            "slots INTEGER NOT NULL, heartbeat_at REAL NOT NULL, report TEXT)"
+        )
+
+    def _transaction(self, work):
+        """Runs `work()` in a write transaction, taken before anything is read."""
+        with self._lock:
+            self._db.execute("BEGIN IMMEDIATE")
+            try:
+                result = work()
+            except BaseException:
+                self._db.execute("ROLLBACK")
+                raise
+            self._db.execute("COMMIT")
+            return result
+
+    def _reap(self):
+        """
+        Every third of a lease: abandons tasks out of leases and attempts,
+        and drops results nobody took and worker nodes that stopped.
+        """
+        now = time.time()
+        if now - self._reaped_at < self.lease_s / 3:
+            return
+        self._reaped_at = now
+
+        def work():
+            abandoned = self._db.execute(
+                "UPDATE tasks SET status = 'abandoned', finished_at = ? "
+                "WHERE status = 'running' AND lease_expires < ? AND attempts >= ?",
+                (now, now, self.max_attempts),
+            ).rowcount
+            self._db.execute(
+                f"DELETE FROM tasks WHERE status IN {FINISHED_STATUSES} AND finished_at < ?", (now - RESULT_TTL_S,)
+            )
+            self._db.execute("DELETE FROM workers WHERE heartbeat_at < ?", (now - self.lease_s,))
+            return abandoned
+
+        abandoned = self._transaction(work)
+        if abandoned:
+            logger.warning(f"Abandoned {abandoned} tasks after {self.max_attempts} attempts")
+
+    def put(self, options: str, method: str, kwargs: Dict[str, Any], collect: bool = False,
+            profile_path: Optional[str] = None) -> int:
+        """Queues a call of `method` for worker nodes with `options`. Returns the task id."""
+        # Uploads arrive as read-only views, which do not pickle
+        kwargs = {key: bytes(value) if isinstance(value, memoryview) else value for key, value in kwargs.items()}
+        payload = _dumps({"kwargs": kwargs, "collect": collect, "profile_path": profile_path})
+        with self._lock:
+            return self._db.execute(
+                "INSERT INTO tasks (options, method, payload, created_at) VALUES (?, ?, ?, ?)",
+                (options, method, payload, time.time()),
+            ).lastrowid
+
+    def claim(self, worker_id: str, options: str) -> Optional[QueuedTask]:
+        """
+        Leases the oldest task for `options` that is queued, or whose lease
+        ran out with attempts left, to `worker_id`. None if there is none.
+        """
+        self._reap()
+        # Idle worker nodes ask often: look before taking the write lock
+        now = time.time()
+        claimable = (options, now, self.max_attempts)
+        with self._lock:
+            if self._db.execute(f"SELECT 1 FROM tasks WHERE {CLAIMABLE} LIMIT 1", claimable).fetchone() is None:
+                return None
+
+        def work():
+            row = self._db.execute(f"SELECT id FROM tasks WHERE {CLAIMABLE} ORDER BY id LIMIT 1", claimable).fetchone()
+            if row is None:
+                return None
+            return self._db.execute(
+                "UPDATE tasks SET status = 'running', worker_id = ?, lease_expires = ?, "
+                "attempts = attempts + 1, started_at = ? WHERE id = ? RETURNING id, method, payload, attempts",
+                (worker_id, now + self.lease_s, now, row[0]),
+            ).fetchone()
+
+        row = self._transaction(work)
+        if row is None:
+            return None
+        task_id, method, payload, attempts = row
+        if attempts > 1:
+            logger.warning(f"Task {task_id} retried by {worker_id} (attempt {attempts})")
+        data = pickle.loads(payload)
+        return QueuedTask(task_id, method, data["kwargs"], data["collect"], data["profile_path"], attempts)
+
+    def heartbeat(self, worker_id: str, options: str, slots: int, report: Any = None):
+        """Renews the leases of `worker_id`'s tasks and records it as a live worker node."""
+        def work():
+            now = time.time()
+            self._db.execute(
+                "UPDATE tasks SET lease_expires = ? WHERE worker_id = ? AND status = 'running'",
+                (now + self.lease_s, worker_id),
+            )
+            self._db.execute(
+                "INSERT INTO workers (id, options, slots, heartbeat_at, report) VALUES (?, ?, ?, ?, ?) "
+                "ON CONFLICT (id) DO UPDATE SET options = excluded.options, slots = excluded.slots, "
+                "heartbeat_at = excluded.heartbeat_at, report = excluded.report",
+                (worker_id, options, slots, now, json.dumps(report)),
+            )
+
+        self._transaction(work)
+
+    def _finish(self, task_id: int, worker_id: str, status: str, result: Optional[bytes],
+                run_s: Optional[float] = None) -> bool:
+        # Only the current lease holder may finish a task: a worker node that
+        # lost its lease and comes back late must not overwrite the retry
+        with self._lock:
+            return self._db.execute(
+                "UPDATE tasks SET status = ?, result = ?, run_s = ?, finished_at = ?, lease_expires = NULL "
+                "WHERE id = ? AND worker_id = ? AND status = 'running'",
+                (status, result, run_s, time.time(), task_id, worker_id),
+            ).rowcount == 1
+
+    def complete(self, task_id: int, worker_id: str, result: Any, run_s: float) -> bool:
+        """Stores the result of a task. False if `worker_id` no longer holds its lease."""
+        return self._finish(task_id, worker_id, "done", _dumps(result), run_s)
+
+    def fail(self, task_id: int, worker_id: str, error: BaseException) -> bool:
+        """Stores the exception a task raised, to be raised on the API node."""
+        return self._finish(task_id, worker_id, "failed", _dump_error(error))
+
+    def retry(self, task_id: int, worker_id: str) -> bool:
+        """Gives a task whose engine crashed to the next worker node, or abandons it without attempts left."""
+        with self._lock:
+            return self._db.execute(
+                "UPDATE tasks SET status = CASE WHEN attempts < ? THEN 'queued' ELSE 'abandoned' END, "
+                "finished_at = CASE WHEN attempts < ? THEN NULL ELSE ? END, worker_id = NULL, lease_expires = NULL "
+                "WHERE id = ? AND worker_id = ? AND status = 'running'",
+                (self.max_attempts, self.max_attempts, time.time(), task_id, worker_id),
+            ).rowcount == 1
+
+    def leave(self, worker_id: str):
+        """
+        Hands the unfinished tasks of a worker node that is shutting down
+        back to the queue, without spending an attempt, and forgets the node.
+        """
+        def work():
+            self._db.execute(
+                "UPDATE tasks SET status = 'queued', attempts = attempts - 1, worker_id = NULL, "
+                "lease_expires = NULL WHERE worker_id = ? AND status = 'running'",
+                (worker_id,),
+            )
+            self._db.execute("DELETE FROM workers WHERE id = ?", (worker_id,))
+
+        self._transaction(work)
+
+    def take(self, task_ids: List[int]) -> List[FinishedTask]:
+        """Removes and returns those of `task_ids` that are finished."""
+        if not task_ids:
+            return []
+        self._reap()
+        placeholders = ",".join("?" * len(task_ids))
+        with self._lock:
+            rows = self._db.execute(
+                f"SELECT id, status, result, created_at, started_at, run_s FROM tasks "
+                f"WHERE id IN ({placeholders}) AND status IN {FINISHED_STATUSES}",
+                task_ids,
+            ).fetchall()
+            if rows:
+                self._db.execute(f"DELETE FROM tasks WHERE id IN ({','.join('?' * len(rows))})", [row[0] for row in rows])
+        finished = []
+        for task_id, status, result, created_at, started_at, run_s in rows:
+            value = pickle.loads(result) if result is not None else None
+            queue_wait_s = max(0.0, (started_at or created_at) - created_at)
+            finished.append(FinishedTask(task_id, status, value, queue_wait_s, run_s or 0.0))
+        return finished
+
+    def discard(self, task_ids: List[int]):
+        """Drops tasks whose results nobody will take; queued ones never run."""
+        if not task_ids:
+            return
+        with self._lock:
+            self._db.execute(f"DELETE FROM tasks WHERE id IN ({','.join('?' * len(task_ids))})", task_ids)
+
+    def fleet(self, options: str) -> List[Dict[str, Any]]:
+        """The live worker nodes with `options`: their id, engine workers (slots) and warm-up report."""
+        with self._lock:
+            rows = self._db.execute(
+                "SELECT id, slots, report FROM workers WHERE options = ? AND heartbeat_at >= ? ORDER BY id",
+                (options, time.time() - self.lease_s),
+            ).fetchall()
+        return [{"node": node, "slots": slots, "workers": json.loads(report or "null")} for node, slots, report in rows]
+
+    def stats(self) -> Dict[str, int]:
+        """Number of tasks in each status."""
+        with self._lock:
+            rows = self._db.execute("SELECT status, COUNT(*) FROM tasks GROUP BY status").fetchall()
+        return dict(rows)
+
+
+class QueueConsumer:
+    """
+    Makes this node a worker node: `slots` loops take tasks for `options`
+    from `queue` and run them on `pool`, this node's engine pool, while a
+    heartbeat keeps their leases. Work starts with start(); stop() hands
+    tasks still running back to the queue for other worker nodes.
+    """
+
+    def __init__(self, queue: WorkQueue, pool, options: str, slots: Optional[int] = None,
+                 report: Any = None):
+        self.queue = queue
+        self.pool = pool
+        self.options = options
+        self.slots = max(1, slots or pool.workers)
+        # Reported to API nodes with every heartbeat (this node's warm-up)
+        self.report = report
+        self.worker_id = f"{socket.gethostname()}-{os.getpid()}-{uuid.uuid4().hex[:6]}"
+        self._tasks: List[asyncio.Task] = []
+
+    async def start(self):
+        await asyncio.to_thread(self.queue.heartbeat, self.worker_id, self.options, self.slots, self.report)
+        logger.info(f"Worker node {self.worker_id} taking work with {self.slots} slots")
+        self._tasks = [asyncio.create_task(self._consume()) for _ in range(self.slots)]
+        self._tasks.append(asyncio.create_task(self._heartbeat()))
+
+    async def stop(self):
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        if self._tasks:
+            await asyncio.to_thread(self.queue.leave, self.worker_id)
+        self._tasks = []
+
+    async def _heartbeat(self):
+        while True:
+            await asyncio.sleep(self.queue.lease_s / 3)
+            try:
+                await asyncio.to_thread(self.queue.heartbeat, self.worker_id, self.options, self.slots, self.report)
+            except sqlite3.Error as e:
+                logger.warning(f"Work queue heartbeat failed: {e}")
+
+    async def _consume(self):
+        while True:
+            try:
+                task = await asyncio.to_thread(self.queue.claim, self.worker_id, self.options)
+            except sqlite3.Error as e:
+                logger.warning(f"Taking work from the queue failed: {e}")
+                task = None
+            if task is None:
+                await asyncio.sleep(POLL_S)
+                continue
+            try:
+                await self._run(task)
+            except Exception as e:
+                # The lease runs out and another worker node runs the task again
+                logger.warning(f"Task {task.id} failed to finish: {e}")
+
+    async def _run(self, task: QueuedTask):
+        t_start = time.monotonic()
+        try:
+            if task.collect:
+                result = [item async for item in self.pool.stream(
+                    task.method, wait_for_slot=True, profile_path=task.profile_path, **task.kwargs
+                )]
+            else:
+                result, _ = await self.pool.run(
+                    task.method, wait_for_slot=True, profile_path=task.profile_path, **task.kwargs
+                )
+            finish = lambda: self.queue.complete(task.id, self.worker_id, result, time.monotonic() - t_start)
+        except EngineCrashedError:
+            logger.warning(f"Engine crashed on task {task.id}, handing it back to the queue")
+            finish = lambda: self.queue.retry(task.id, self.worker_id)
+        except Exception as e:
+            logger.warning(f"Task {task.id} ({task.method}) failed: {e}")
+            finish = lambda error=e: self.queue.fail(task.id, self.worker_id, error)
+        if not await asyncio.to_thread(finish):
+            logger.warning(f"Task {task.id} was handed to another worker node, dropping its outcome")
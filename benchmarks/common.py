@@ -0,0 +1,145 @@
+"""
+Helpers shared by the benchmarks: latency summaries, memory measurement and
+the JSON result files runs are compared with (see benchmarks.compare).
+"""
+import json
+import os
+import platform
+import resource
+import subprocess
+import threading
+from datetime import datetime, timezone
+from pathlib import Path
+from typing import Any, Dict, List, Optional, Sequence
+
+import numpy as np
+
+RESULTS_DIR = Path(__file__).parent / "results"
+# Environment variables recorded with every result (engine, image and cache settings)
+SETTINGS_PREFIXES = ("ENGINE_", "REC_", "IMAGE_", "RESULT_CACHE_", "ARTIFACT_", "INFERENCE_")
+
+
+def latency_summary(seconds: Sequence[float]) -> Dict[str, Any]:
+    """Count, mean and p50/p95/p99/max of `seconds`, in milliseconds."""
+    if not len(seconds):
+        return {"count": 0}
+    ms = np.asarray(seconds, dtype=np.float64) * 1000
+    p50, p95, p99 = np.percentile(ms, [50, 95, 99])
+    return {
+        "count": int(ms.size),
+        "mean_ms": round(float(ms.mean()), 2),
+        "p50_ms": round(float(p50), 2),
+        "p95_ms": round(float(p95), 2),
+        "p99_ms": round(float(p99), 2),
+        "max_ms": round(float(ms.max()), 2),
+    }
+
+
+def peak_rss_mb() -> float:
+    """Peak resident memory of this process (Linux reports ru_maxrss in KB)."""
+    return round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, 1)
+
+
+def _children(pid: int) -> List[int]:
+    children = []
+    for task in Path(f"/proc/{pid}/task").glob("*"):
+        try:
+            children.extend(int(child) for child in (task / "children").read_text().split())
+        except OSError:
+            continue
+    return children
+
+
+def tree_rss_mb(pid: int) -> float:
+    """Resident memory of `pid` and all its descendants (e.g. engine worker processes)."""
+    total_kb, pending = 0, [pid]
+    while pending:
+        current = pending.pop()
+        try:
+            for line in Path(f"/proc/{current}/status").read_text().splitlines():
+                if line.startswith("VmRSS:"):
+                    total_kb += int(line.split()[1])
+                    break
+        except OSError:
+            continue
+        pending.extend(_children(current))
+    return round(total_kb / 1024, 1)
+
+
+class RSSSampler:
+    """Samples the resident memory of a process tree on a thread and keeps the peak."""
+
+    def __init__(self, pid: int, interval_s: float = 0.1):
+        self.pid = pid
+        self.interval_s = interval_s
+        self.peak_mb = 0.0
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name="rss-sampler", daemon=True)
+
+    def __enter__(self):
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        self._stop.set()
+        self._thread.join()
+
+    def _run(self):
+        while not self._stop.is_set():
+            self.peak_mb = max(self.peak_mb, tree_rss_mb(self.pid))
+            self._stop.wait(self.interval_s)
+
+
+def _git(*args: str) -> Optional[str]:
+    try:
+        out = subprocess.run(["git", *args], cwd=Path(__file__).parent, capture_output=True, text=True, timeout=10)
+    except (OSError, subprocess.SubprocessError):
+        return None
+    return out.stdout.strip() if out.returncode == 0 else None
+
+
+def environment() -> Dict[str, Any]:
+    """What a result was measured on: commit, interpreter and machine."""
+    cpu_model = None
+    try:
+        for line in Path("/proc/cpuinfo").read_text().splitlines():
+            if line.startswith("model name"):
+                cpu_model = line.split(":", 1)[1].strip()
+                break
+    except OSError:
+        pass
+    status = _git("status", "--porcelain", "--untracked-files=no")
+    return {
+        "commit": _git("rev-parse", "HEAD"),
+        "dirty": bool(status) if status is not None else None,
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "cpu_count": os.cpu_count(),
+        "cpu_model": cpu_model,
+        # Server settings that change the numbers
+        "env": {key: value for key, value in os.environ.items() if key.startswith(SETTINGS_PREFIXES)},
+    }
+
+
+def save_results(name: str, config: Dict[str, Any], results: Dict[str, Any],
+                 output: Optional[Path] = None) -> Path:
+    """
+    Writes a run to `output`, by default
+    benchmarks/results/<name>-<commit>-<timestamp>.json, and returns the path.
+    """
+    env = environment()
+    now = datetime.now(timezone.utc)
+    if output is None:
+        commit = (env["commit"] or "nogit")[:8]
+        output = RESULTS_DIR / f"{name}-{commit}-{now:%Y%m%dT%H%M%S}.json"
+    output.parent.mkdir(parents=True, exist_ok=True)
+    record = {
+        "benchmark": name,
+        "created_at": now.isoformat(timespec="seconds"),
+        "environment": env,
+        "config": config,
+        "results": results,
+    }
+    output.write_text(json.dumps(record, indent=2, sort_keys=True) + "\n")
+    return output
+
@@ -0,0 +1,51 @@
+"""
+Compares two benchmark result files, e.g. the same benchmark on two commits:
+
+    python -m benchmarks.compare benchmarks/results/load-1a2b3c4d-*.json benchmarks/results/load-5e6f7a8b-*.json
+
+Prints every numeric result present in both, with the relative change.
+"""
+import argparse
+import json
+from pathlib import Path
+from typing import Any, Dict
+
+
+def flatten(results: Any, prefix: str = "") -> Dict[str, float]:
+    """Numeric leaves of nested results, keyed by their dotted path."""
+    if isinstance(results, dict):
+        values = {}
+        for key, value in results.items():
+            values.update(flatten(value, f"{prefix}.{key}" if prefix else str(key)))
+        return values
+    if isinstance(results, (int, float)) and not isinstance(results, bool):
+        return {prefix: float(results)}
+    return {}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("before", type=Path)
+    parser.add_argument("after", type=Path)
+    parser.add_argument("--filter", default="", help="Only metrics whose path contains this text")
+    args = parser.parse_args()
+
+    before, after = (json.loads(path.read_text()) for path in (args.before, args.after))
+    if before["benchmark"] != after["benchmark"]:
+        parser.error(f"Different benchmarks: {before['benchmark']} and {after['benchmark']}")
+    for label, record in (("before", before), ("after", after)):
+        env = record["environment"]
+        print(f"{label:<7} {(env['commit'] or 'unknown')[:8]}{' (dirty)' if env['dirty'] else ''} "
+              f"{record['created_at']} on {env['cpu_count']} x {env['cpu_model']}")
+
+    old, new = flatten(before["results"]), flatten(after["results"])
+    names = [name for name in old if name in new and args.filter in name]
+    width = max((len(name) for name in names), default=10)
+    print(f"{'metric':<{width}} {'before':>12} {'after':>12} {'change':>9}")
+    for name in names:
+        change = f"{(new[name] - old[name]) / old[name] * 100:+8.1f}%" if old[name] else "        -"
+        print(f"{name:<{width}} {old[name]:12.2f} {new[name]:12.2f} {change}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,206 @@
+"""
+Synthetic corpus of book-like pages for the benchmarks, rendered offline
+with PIL: a title, body text in one or more columns, a full-width figure
+with a caption between two column sections, and a page number. Every page
+comes with its ground truth (blocks in reading order with their text).
+
+    python -m benchmarks.corpus --out corpus/ --pages 4
+
+writes the page images and a manifest.json describing them. Pages are
+deterministic for a given (size, columns, seed).
+"""
+import argparse
+import io
+import json
+import random
+from pathlib import Path
+from typing import Any, Dict, Iterator, List, Sequence, Tuple
+
+from PIL import Image, ImageDraw, ImageFont
+
+# Page sizes in pixels: (width, height)
+SIZES = {
+    "a5-150": (874, 1240),
+    "letter-200": (1700, 2200),
+    "a4-300": (2480, 3508),
+}
+COLUMNS = (1, 2, 3)
+IMAGE_FORMATS = {"png": "PNG", "jpeg": "JPEG"}
+
+WORDS = (
+    "the of and to in a is that for it as was with be by on not he this are or his from at which but have "
+    "an they you were her she there been one all we their has would when if so no will more out up into do "
+    "any your what some can time about only other new these two may first then over such like very after "
+    "chapter river morning letter window garden harbour lantern village winter journey silence promise"
+).split()
+
+
+def _sentence(rng: random.Random) -> str:
+    words = [rng.choice(WORDS) for _ in range(rng.randint(6, 16))]
+    return " ".join(words).capitalize() + rng.choice(".....;?!")
+
+
+def _paragraph(rng: random.Random) -> str:
+    return " ".join(_sentence(rng) for _ in range(rng.randint(2, 6)))
+
+
+def _wrap(text: str, font: ImageFont.FreeTypeFont, width: float) -> List[str]:
+    lines, current = [], ""
+    for word in text.split():
+        candidate = f"{current} {word}" if current else word
+        if current and font.getlength(candidate) > width:
+            lines.append(current)
+            current = word
+        else:
+            current = candidate
+    if current:
+        lines.append(current)
+    return lines
+
+
+class _Typesetter:
+    def __init__(self, draw: ImageDraw.ImageDraw, font: ImageFont.FreeTypeFont, rng: random.Random):
+        self.draw = draw
+        self.font = font
+        self.rng = rng
+        self.line_height = round(font.size * 1.45)
+        self.blocks: List[Dict[str, Any]] = []
+
+    def text_block(self, x: int, y: int, lines: Sequence[str]) -> int:
+        """Draws `lines` from (x, y); returns the y below them."""
+        width = 0
+        for index, line in enumerate(lines):
+            self.draw.text((x, y + index * self.line_height), line, font=self.font, fill=(20, 20, 20))
+            width = max(width, self.font.getlength(line))
+        bottom = y + len(lines) * self.line_height
+        self.blocks.append({"type": "text", "bbox": [x, y, x + round(width), bottom], "text": "\n".join(lines)})
+        return bottom
+
+    def columns(self, left: int, right: int, top: int, bottom: int, count: int, gutter: int):
+        """Fills `count` columns between top and bottom with paragraphs, column after column."""
+        width = (right - left - gutter * (count - 1)) / count
+        paragraph_gap = self.line_height // 2
+        for column in range(count):
+            x = round(left + column * (width + gutter))
+            y = top
+            while y + self.line_height <= bottom:
+                lines = _wrap(_paragraph(self.rng), self.font, width)
+                fits = (bottom - y) // self.line_height
+                y = self.text_block(x, y, lines[:fits]) + paragraph_gap
+
+
+def render_page(size: str = "letter-200", columns: int = 1, seed: int = 0,
+                figure: bool = True) -> Tuple[Image.Image, Dict[str, Any]]:
+    """A page image and its ground truth: blocks in reading order and the page text."""
+    width, height = SIZES[size]
+    rng = random.Random(f"{size}-{columns}-{seed}")
+    scale = width / SIZES["letter-200"][0]
+    margin, gutter = round(150 * scale), round(60 * scale)
+    body = ImageFont.load_default(size=max(8, round(26 * scale)))
+    title_font = ImageFont.load_default(size=max(12, round(56 * scale)))
+
+    page = Image.new("RGB", (width, height), (250, 248, 242))
+    draw = ImageDraw.Draw(page)
+    setter = _Typesetter(draw, body, rng)
+
+    title = f"Chapter {seed + 1}: The {rng.choice(WORDS)} {rng.choice(WORDS)}".title()
+    draw.text((margin, margin), title, font=title_font, fill=(0, 0, 0))
+    title_bottom = margin + round(title_font.size * 1.3)
+    setter.blocks.append({"type": "title", "bbox": [margin, margin, margin + round(title_font.getlength(title)),
+                                                     title_bottom], "text": title})
+
+    content_top = title_bottom + round(40 * scale)
+    content_bottom = height - margin - round(60 * scale)
+    if figure:
+        figure_top = content_top + (content_bottom - content_top) * 2 // 5
+        figure_bottom = figure_top + (content_bottom - content_top) // 4
+        setter.columns(margin, width - margin, content_top, figure_top - setter.line_height, columns, gutter)
+        # A bar chart as the figure: flat colours, like a printed illustration
+        draw.rectangle([margin, figure_top, width - margin, figure_bottom], fill=(235, 235, 235))
+        bars = 8
+        bar_width = (width - 2 * margin) / (bars * 1.5)
+        for index in range(bars):
+            x = margin + bar_width * (0.5 + index * 1.5)
+            bar_top = figure_bottom - (figure_bottom - figure_top) * rng.uniform(0.2, 0.9)
+            draw.rectangle([x, bar_top, x + bar_width, figure_bottom], fill=(60, 90 + 15 * index, 180))
+        setter.blocks.append({"type": "figure", "bbox": [margin, figure_top, width - margin, figure_bottom],
+                              "text": ""})
+        caption = f"Figure {seed + 1}. {_sentence(rng)}"
+        caption_top = figure_bottom + setter.line_height // 2
+        caption_bottom = setter.text_block(margin, caption_top, _wrap(caption, body, width - 2 * margin))
+        setter.columns(margin, width - margin, caption_bottom + setter.line_height, content_bottom, columns, gutter)
+    else:
+        setter.columns(margin, width - margin, content_top, content_bottom, columns, gutter)
+
+    number = str(seed + 1)
+    number_x = round((width - body.getlength(number)) / 2)
+    setter.text_block(number_x, height - margin, [number])
+
+    truth = {
+        "size": size,
+        "columns": columns,
+        "seed": seed,
+        "width": width,
+        "height": height,
+        "blocks": setter.blocks,
+        "text": "\n".join(block["text"] for block in setter.blocks if block["text"]),
+    }
+    return page, truth
+
+
+def encode(page: Image.Image, image_format: str = "png") -> bytes:
+    data = io.BytesIO()
+    page.save(data, format=IMAGE_FORMATS[image_format], quality=90)
+    return data.getvalue()
+
+
+def iter_pages(sizes: Sequence[str] = tuple(SIZES), columns: Sequence[int] = COLUMNS, pages: int = 1,
+               image_format: str = "png") -> Iterator[Tuple[str, bytes, Dict[str, Any]]]:
+    """(file name, encoded image, ground truth) for every size x column layout x page."""
+    extension = "jpg" if image_format == "jpeg" else image_format
+    for size in sizes:
+        for column_count in columns:
+            for seed in range(pages):
+                page, truth = render_page(size, column_count, seed)
+                yield f"{size}-{column_count}col-{seed:03d}.{extension}", encode(page, image_format), truth
+
+
+def load_corpus(directory: Path) -> List[Tuple[str, bytes, Dict[str, Any]]]:
+    """The pages of a corpus written by `python -m benchmarks.corpus`."""
+    manifest = json.loads((directory / "manifest.json").read_text())
+    return [(entry["file"], (directory / entry["file"]).read_bytes(), entry) for entry in manifest]
+
+
+def add_corpus_arguments(parser: argparse.ArgumentParser):
+    """Options that pick the pages a benchmark runs on."""
+    parser.add_argument("--corpus", type=Path, help="Directory written by benchmarks.corpus "
+                                                    "(default: render pages in memory)")
+    parser.add_argument("--sizes", nargs="+", default=list(SIZES), choices=list(SIZES))
+    parser.add_argument("--columns", nargs="+", type=int, default=list(COLUMNS), choices=COLUMNS)
+    parser.add_argument("--pages", type=int, default=1, help="Pages per size and column layout")
+    parser.add_argument("--format", dest="image_format", default="png", choices=list(IMAGE_FORMATS))
+
+
+def corpus_from_args(args) -> List[Tuple[str, bytes, Dict[str, Any]]]:
+    if args.corpus:
+        return load_corpus(args.corpus)
+    return list(iter_pages(args.sizes, args.columns, args.pages, args.image_format))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--out", type=Path, required=True)
+    add_corpus_arguments(parser)
+    args = parser.parse_args()
+
+    args.out.mkdir(parents=True, exist_ok=True)
+    manifest = []
+    for name, data, truth in iter_pages(args.sizes, args.columns, args.pages, args.image_format):
+        (args.out / name).write_bytes(data)
+        manifest.append({"file": name, **truth})
+    (args.out / "manifest.json").write_text(json.dumps(manifest, indent=1) + "\n")
+    print(f"{len(manifest)} pages written to {args.out}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,188 @@
+"""
+HTTP load driver for POST /extract: keeps `--concurrency` requests in
+flight over the synthetic corpus and reports latency percentiles, pages
+per second, rejections (503) and the server's peak resident memory.
+
+    python -m benchmarks.load --spawn --concurrency 4 --requests 200
+
+--spawn starts a local uvicorn (settings from the environment, or --env
+KEY=VALUE) and measures its whole process tree, engine workers included.
+Against a server started elsewhere, pass --url, and --server-pid to get its
+memory. Everything runs offline; the server must already have its models.
+"""
+import argparse
+import asyncio
+import os
+import signal
+import subprocess
+import sys
+import tempfile
+import time
+from collections import defaultdict
+from pathlib import Path
+from typing import Any, Dict, List, Optional
+
+import httpx
+
+from benchmarks.common import RSSSampler, latency_summary, peak_rss_mb, save_results
+from benchmarks.corpus import add_corpus_arguments, corpus_from_args
+
+STARTUP_TIMEOUT_S = 300
+
+
+def spawn_server(port: int, env: Dict[str, str]) -> subprocess.Popen:
+    """
+    A local API server (logs discarded) on `port`, outputs in a temporary
+    directory. The result cache is off unless `env` turns it on: the corpus
+    repeats, and cache hits would be measured instead of extraction.
+    """
+    server_env = {
+        "OUTPUT_DIR": tempfile.mkdtemp(prefix="benchmark-outputs-"),
+        **os.environ,
+        "RESULT_CACHE_SIZE": "0",
+        "RESULT_CACHE_DISK_MB": "0",
+        **env,
+    }
+    return subprocess.Popen(
+        [sys.executable, "-m", "uvicorn", "app.main:app", "--host", "127.0.0.1", "--port", str(port)],
+        env=server_env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL,
+    )
+
+
+async def wait_until_ready(client: httpx.AsyncClient, server: Optional[subprocess.Popen]):
+    deadline = time.monotonic() + STARTUP_TIMEOUT_S
+    while time.monotonic() < deadline:
+        if server is not None and server.poll() is not None:
+            raise RuntimeError(f"Server exited with code {server.returncode} during startup")
+        try:
+            if (await client.get("/health")).status_code == 200:
+                return
+        except httpx.TransportError:
+            pass
+        await asyncio.sleep(0.5)
+    raise RuntimeError(f"Server not ready after {STARTUP_TIMEOUT_S} s")
+
+
+async def run_load(client: httpx.AsyncClient, pages, form: Dict[str, str], concurrency: int,
+                   requests: int, duration_s: float) -> Dict[str, Any]:
+    """Sends /extract requests from `concurrency` workers until `requests` or `duration_s` is reached."""
+    latencies: List[float] = []
+    stage_ms: Dict[str, List[float]] = defaultdict(list)
+    statuses: Dict[str, int] = defaultdict(int)
+    cache_hits = 0
+    next_index = 0
+    deadline = time.monotonic() + duration_s if duration_s else None
+
+    def take() -> Optional[int]:
+        nonlocal next_index
+        if (requests and next_index >= requests) or (deadline and time.monotonic() >= deadline):
+            return None
+        next_index += 1
+        return next_index - 1
+
+    async def worker():
+        nonlocal cache_hits
+        while (index := take()) is not None:
+            name, image_bytes, _ = pages[index % len(pages)]
+            content_type = "image/jpeg" if name.endswith(".jpg") else "image/png"
+            t_start = time.perf_counter()
+            try:
+                response = await client.post("/extract", data=form, files={"file": (name, image_bytes, content_type)})
+            except httpx.TransportError as e:
+                statuses[type(e).__name__] += 1
+                continue
+            elapsed = time.perf_counter() - t_start
+            statuses[str(response.status_code)] += 1
+            if response.status_code == 200:
+                latencies.append(elapsed)
+                meta = response.json()["meta"]
+                cache_hits += bool(meta.get("cache", {}).get("hit"))
+                for stage, ms in meta["timings_ms"].items():
+                    stage_ms[stage].append(ms / 1000)
+
+    t_start = time.perf_counter()
+    await asyncio.gather(*(worker() for _ in range(concurrency)))
+    wall_s = time.perf_counter() - t_start
+    return {
+        "requests": next_index,
+        "statuses": dict(statuses),
+        # Answered from the server's result cache, not extracted
+        "cache_hits": cache_hits,
+        "wall_s": round(wall_s, 2),
+        "pages_per_s": round(len(latencies) / wall_s, 3) if wall_s else 0.0,
+        "latency": latency_summary(latencies),
+        "server_stages": {stage: latency_summary(seconds) for stage, seconds in stage_ms.items()},
+    }
+
+
+async def drive(args, pages) -> Dict[str, Any]:
+    form = dict(item.split("=", 1) for item in args.form)
+    server = spawn_server(args.port, dict(item.split("=", 1) for item in args.env)) if args.spawn else None
+    url = f"http://127.0.0.1:{args.port}" if args.spawn else args.url
+    pid = server.pid if server is not None else args.server_pid
+    limits = httpx.Limits(max_connections=args.concurrency, max_keepalive_connections=args.concurrency)
+    try:
+        async with httpx.AsyncClient(base_url=url, timeout=args.timeout, limits=limits) as client:
+            await wait_until_ready(client, server)
+            if args.warmup:
+                await run_load(client, pages, form, min(args.concurrency, args.warmup), args.warmup, 0)
+            if pid:
+                with RSSSampler(pid) as sampler:
+                    results = await run_load(client, pages, form, args.concurrency, args.requests, args.duration)
+                results["server_peak_rss_mb"] = sampler.peak_mb
+            else:
+                results = await run_load(client, pages, form, args.concurrency, args.requests, args.duration)
+                results["server_peak_rss_mb"] = None
+    finally:
+        if server is not None:
+            server.send_signal(signal.SIGINT)
+            try:
+                server.wait(timeout=30)
+            except subprocess.TimeoutExpired:
+                server.kill()
+    results["client_peak_rss_mb"] = peak_rss_mb()
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    add_corpus_arguments(parser)
+    parser.add_argument("--url", default="http://127.0.0.1:8000")
+    parser.add_argument("--spawn", action="store_true", help="Start a local server for the run")
+    parser.add_argument("--port", type=int, default=8765, help="Port of the --spawn server")
+    parser.add_argument("--env", action="append", default=[], metavar="KEY=VALUE",
+                        help="Environment of the --spawn server, e.g. ENGINE_WORKERS=2")
+    parser.add_argument("--server-pid", type=int, help="Measure the memory of this server process tree")
+    parser.add_argument("--concurrency", type=int, default=4)
+    parser.add_argument("--requests", type=int, default=100, help="Requests to send (0 = until --duration)")
+    parser.add_argument("--duration", type=float, default=0, help="Stop after this many seconds (0 = no limit)")
+    parser.add_argument("--warmup", type=int, default=4, help="Requests sent before measuring")
+    parser.add_argument("--timeout", type=float, default=300)
+    parser.add_argument("--form", action="append", default=["store_outputs=false"], metavar="FIELD=VALUE",
+                        help="Form field of every request, added to store_outputs=false")
+    parser.add_argument("--output", type=Path, help="Result file (default: benchmarks/results/...)")
+    args = parser.parse_args()
+    if not args.requests and not args.duration:
+        parser.error("--requests 0 needs a --duration")
+
+    pages = corpus_from_args(args)
+    results = asyncio.run(drive(args, pages))
+
+    latency = results["latency"]
+    print(f"{results['requests']} requests at concurrency {args.concurrency} in {results['wall_s']} s: "
+          f"{results['statuses']}, {results['cache_hits']} cache hits")
+    if latency["count"]:
+        print(f"latency p50 {latency['p50_ms']:.0f} ms, p95 {latency['p95_ms']:.0f} ms, "
+              f"p99 {latency['p99_ms']:.0f} ms; {results['pages_per_s']:.2f} pages/s")
+    if results["server_peak_rss_mb"] is not None:
+        print(f"server peak RSS {results['server_peak_rss_mb']:.0f} MB")
+    config = {
+        "url": "spawn" if args.spawn else args.url, "env": args.env, "form": args.form,
+        "concurrency": args.concurrency, "requests": args.requests, "duration_s": args.duration,
+        "warmup": args.warmup, "pages": [name for name, _, _ in pages],
+    }
+    print(f"saved {save_results('load', config, results, args.output)}")
+
+
+if __name__ == "__main__":
+    main()
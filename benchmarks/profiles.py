@@ -0,0 +1,122 @@
+"""
+Accuracy against speed of the inference profiles (see
+app.services.inference_profiles): character error rate and pages per
+second of each profile on the same ground-truth corpus.
+
+    python -m benchmarks.profiles --pages 2
+    python -m benchmarks.profiles --corpus corpus/ --profiles balanced fast
+
+The character error rate (CER) is the edit distance between the page text
+and its ground truth over the length of the ground truth, both with
+whitespace collapsed, so it counts reading-order mistakes as well as
+misread characters. Each profile is loaded and warmed up in turn, then
+reads every page `--repeat` times on one worker; the other engine settings
+come from the environment, as in benchmarks.stages. The `fast` profile's
+models are downloaded on first use if they are not in ~/.paddleocr yet.
+"""
+import argparse
+import gc
+import time
+from collections import defaultdict
+from pathlib import Path
+from typing import Any, Dict
+
+import numpy as np
+
+from benchmarks.common import latency_summary, peak_rss_mb, save_results
+from benchmarks.corpus import add_corpus_arguments, corpus_from_args
+from benchmarks.stages import service_options
+from app.services.extraction import ExtractionService
+from app.services.inference_profiles import INFERENCE_PROFILES
+
+
+def normalize(text: str) -> str:
+    return " ".join(text.split())
+
+
+def edit_distance(a: str, b: str) -> int:
+    """Levenshtein distance between `a` and `b`, one NumPy pass per character of `a`."""
+    if len(a) < len(b):
+        a, b = b, a
+    if not b:
+        return len(a)
+    b_codes = np.frombuffer(b.encode("utf-32-le"), dtype=np.uint32)
+    columns = np.arange(len(b) + 1)
+    row = columns.copy()
+    for index, char in enumerate(a, 1):
+        substitute = row[:-1] + (b_codes != ord(char))
+        best = np.empty_like(row)
+        best[0] = index
+        best[1:] = np.minimum(row[1:] + 1, substitute)
+        # Insertions chain along the row: row[j] = min over k <= j of best[k] + (j - k)
+        row = np.minimum.accumulate(best - columns) + columns
+    return int(row[-1])
+
+
+def page_text(response: Dict[str, Any]) -> str:
+    return "\n".join(block["text"] for block in response["blocks"] if block["text"])
+
+
+def bench_profile(profile: str, pages, repeat: int) -> Dict[str, Any]:
+    """Load time, CER (overall and per page layout), pages/sec and latency of one profile."""
+    options = service_options(profile)
+    t_load = time.perf_counter()
+    service = ExtractionService(**options)
+    warmup = service.warmup()
+    load_s = time.perf_counter() - t_load
+
+    seconds, errors, lengths = [], defaultdict(int), defaultdict(int)
+    t_start = time.perf_counter()
+    for _ in range(repeat):
+        for _, image_bytes, truth in pages:
+            t_page = time.perf_counter()
+            response = service.run_extraction(
+                image_bytes=image_bytes, request_id="benchmark", output_dir=None, store_outputs=False,
+                return_annotated=False,
+            )
+            seconds.append(time.perf_counter() - t_page)
+            group = f"{truth['size']}/{truth['columns']}col"
+            expected = normalize(truth["text"])
+            errors[group] += edit_distance(normalize(page_text(response)), expected)
+            lengths[group] += len(expected)
+    wall_s = time.perf_counter() - t_start
+
+    return {
+        "startup": {"load_and_warmup_ms": round(load_s * 1000, 1), **warmup},
+        "cpu_threads": options["cpu_threads"],
+        "cer": round(sum(errors.values()) / max(1, sum(lengths.values())), 4),
+        "cer_by_layout": {group: round(errors[group] / max(1, lengths[group]), 4) for group in errors},
+        "pages_per_s": round(len(seconds) / wall_s, 3),
+        "latency": latency_summary(seconds),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    add_corpus_arguments(parser)
+    parser.add_argument("--profiles", nargs="+", default=list(INFERENCE_PROFILES), choices=list(INFERENCE_PROFILES))
+    parser.add_argument("--repeat", type=int, default=1, help="Passes over the corpus per profile")
+    parser.add_argument("--output", type=Path, help="Result file (default: benchmarks/results/...)")
+    args = parser.parse_args()
+
+    pages = corpus_from_args(args)
+    results: Dict[str, Any] = {}
+    for profile in args.profiles:
+        results[profile] = bench_profile(profile, pages, args.repeat)
+        # One profile's models at a time
+        gc.collect()
+    results["peak_rss_mb"] = peak_rss_mb()
+
+    print(f"{len(pages)} pages x {args.repeat}")
+    print(f"{'profile':<10} {'CER':>7} {'pages/s':>9} {'p50 ms':>9} {'p95 ms':>9} {'startup ms':>11}")
+    for profile in args.profiles:
+        result = results[profile]
+        print(f"{profile:<10} {result['cer']:7.2%} {result['pages_per_s']:9.2f} {result['latency']['p50_ms']:9.1f} "
+              f"{result['latency']['p95_ms']:9.1f} {result['startup']['load_and_warmup_ms']:11.0f}")
+    config = {"pages": [name for name, _, _ in pages], "repeat": args.repeat,
+              "service": {profile: service_options(profile) for profile in args.profiles}}
+    print(f"saved {save_results('profiles', config, results, args.output)}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,129 @@
+"""
+Micro-benchmarks of the extraction service, in process and without HTTP:
+the stages of ExtractionService.run_extraction (meta.timings_ms) per page
+size and column layout, and PDFService.create_pdf on the extracted blocks.
+
+    python -m benchmarks.stages --pages 3 --repeat 2
+
+The PaddleOCR models must already be in ~/.paddleocr (any earlier run of
+the service downloads them); nothing is fetched while benchmarking. Engine
+settings come from the same options the API takes from its environment,
+e.g. IMAGE_MAX_SIDE=2000 python -m benchmarks.stages.
+"""
+import argparse
+import os
+import tempfile
+import time
+from collections import defaultdict
+from pathlib import Path
+from typing import Any, Dict, List, Optional
+
+from benchmarks.common import latency_summary, peak_rss_mb, save_results
+from benchmarks.corpus import add_corpus_arguments, corpus_from_args
+from app.services.extraction import ExtractionService
+from app.services.inference_profiles import profile_threads
+from app.services.pdf_service import PDFService
+
+
+def service_options(inference_profile: Optional[str] = None) -> Dict[str, Any]:
+    """
+    The engine options the API would use under the current environment (see
+    app/main.py), with one worker and `inference_profile` if given.
+    """
+    threads = os.getenv("ENGINE_THREADS")
+    inference_profile = inference_profile or os.getenv("INFERENCE_PROFILE", "accurate").lower()
+    return {
+        "inference_profile": inference_profile,
+        "cpu_threads": int(threads) if threads else profile_threads(inference_profile, 1),
+        "max_side": int(os.getenv("IMAGE_MAX_SIDE", "0")),
+        "target_text_px": int(os.getenv("IMAGE_TARGET_TEXT_PX", "0")),
+        "pipeline": os.getenv("ENGINE_PIPELINE", "false").lower() == "true",
+        "rec_batch_size": int(os.getenv("REC_BATCH_SIZE", "32")),
+    }
+
+
+def bench_extraction(service: ExtractionService, pages, repeat: int, ocr_engine: str,
+                     layout_engine: str) -> Dict[str, Any]:
+    """Stage timings of every page, grouped by size and column layout."""
+    stage_ms: Dict[str, Dict[str, List[float]]] = defaultdict(lambda: defaultdict(list))
+    responses = []
+    for _ in range(repeat):
+        for name, image_bytes, truth in pages:
+            t_start = time.perf_counter()
+            response = service.run_extraction(
+                image_bytes=image_bytes, request_id="benchmark", output_dir=None, store_outputs=False,
+                return_annotated=False, ocr_engine=ocr_engine, layout_engine=layout_engine,
+            )
+            wall_s = time.perf_counter() - t_start
+            group = stage_ms[f"{truth['size']}/{truth['columns']}col"]
+            group["total"].append(wall_s)
+            for stage, ms in response["meta"]["timings_ms"].items():
+                group[stage].append(ms / 1000)
+            responses.append(response)
+    results = {
+        group: {stage: latency_summary(seconds) for stage, seconds in stages.items()}
+        for group, stages in stage_ms.items()
+    }
+    return results, responses[:len(pages)]
+
+
+def bench_pdf(responses, repeat: int) -> Dict[str, Any]:
+    """PDFService.create_pdf on the blocks of all pages, one PDF page each."""
+    blocks = []
+    for index, response in enumerate(responses):
+        if index:
+            blocks.append({"type": "page_break"})
+        blocks.extend(response["blocks"])
+    service = PDFService()
+    seconds = []
+    with tempfile.TemporaryDirectory() as tmp:
+        output = Path(tmp) / "benchmark.pdf"
+        for _ in range(repeat):
+            t_start = time.perf_counter()
+            service.create_pdf(blocks, output)
+            seconds.append(time.perf_counter() - t_start)
+        size_kb = output.stat().st_size / 1024
+    return {"pages": len(responses), "size_kb": round(size_kb, 1), **latency_summary(seconds)}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    add_corpus_arguments(parser)
+    parser.add_argument("--repeat", type=int, default=3, help="Passes over the corpus")
+    parser.add_argument("--ocr-engine", default="paddle")
+    parser.add_argument("--layout-engine", default="paddle")
+    parser.add_argument("--output", type=Path, help="Result file (default: benchmarks/results/...)")
+    args = parser.parse_args()
+
+    pages = corpus_from_args(args)
+    options = service_options()
+    t_load = time.perf_counter()
+    service = ExtractionService(**options)
+    warmup = service.warmup()
+    load_s = time.perf_counter() - t_load
+
+    extraction, responses = bench_extraction(service, pages, args.repeat, args.ocr_engine, args.layout_engine)
+    pdf = bench_pdf(responses, args.repeat)
+    results = {
+        "startup": {"load_and_warmup_ms": round(load_s * 1000, 1), **warmup},
+        "extraction": extraction,
+        "create_pdf": pdf,
+        "peak_rss_mb": peak_rss_mb(),
+    }
+
+    print(f"{len(pages)} pages x {args.repeat}, startup {results['startup']['load_and_warmup_ms']:.0f} ms")
+    print(f"{'pages':<16} {'stage':<12} {'p50 ms':>9} {'p95 ms':>9} {'p99 ms':>9}")
+    for group, stages in extraction.items():
+        for stage, summary in stages.items():
+            if summary["count"] and summary["max_ms"] > 0:
+                print(f"{group:<16} {stage:<12} {summary['p50_ms']:9.1f} {summary['p95_ms']:9.1f} "
+                      f"{summary['p99_ms']:9.1f}")
+    print(f"create_pdf ({pdf['pages']} pages): p50 {pdf['p50_ms']:.1f} ms, {pdf['size_kb']:.0f} KB")
+    print(f"peak RSS {results['peak_rss_mb']:.0f} MB")
+    config = {"pages": [name for name, _, _ in pages], "repeat": args.repeat, "ocr_engine": args.ocr_engine,
+              "layout_engine": args.layout_engine, "service": options}
+    print(f"saved {save_results('stages', config, results, args.output)}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,81 @@
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+import cv2
+import numpy as np
+import pytest
+from app.services import artifacts
+from app.services.artifacts import MARKER_LEASE_S, ArtifactWriter, artifact_status, pending_marker_name
+
+@pytest.fixture
+def writer():
+    writer = ArtifactWriter(workers=2, image_format="webp", quality=80)
+    yield writer
+    writer.shutdown()
+
+def test_writes_run_in_background_and_report_status(writer, tmp_path):
+    release = threading.Event()
+    img = np.full((20, 30, 3), 255, dtype=np.uint8)
+
+    def task(w):
+        release.wait(5)
+        w.write_image(tmp_path / f"crop{w.extension}", img)
+
+    writer.submit(tmp_path, task)
+    assert artifact_status(tmp_path) == {"status": "pending", "error": None}
+    assert not (tmp_path / "crop.webp").exists()
+
+    release.set()
+    writer.flush()
+    assert artifact_status(tmp_path) == {"status": "ready", "error": None}
+    assert cv2.imread(str(tmp_path / "crop.webp")).shape == (20, 30, 3)
+    # Only the finished file is left behind
+    assert sorted(p.name for p in tmp_path.iterdir()) == ["crop.webp"]
+
+def test_failed_writes_are_reported(writer, tmp_path):
+    def task(w):
+        raise OSError("disk full")
+
+    writer.submit(tmp_path, task)
+    writer.flush()
+    assert artifact_status(tmp_path) == {"status": "failed", "error": "disk full"}
+
+def test_markers_not_refreshed_within_the_lease_count_as_interrupted(tmp_path):
+    # Writers in other containers are judged by their marker's age, not their pid
+    marker = tmp_path / ".pending.worker-2-1"
+    marker.touch()
+    assert artifact_status(tmp_path)["status"] == "pending"
+    stale = time.time() - MARKER_LEASE_S - 1
+    os.utime(marker, (stale, stale))
+    assert artifact_status(tmp_path) == {"status": "failed", "error": "Writing outputs was interrupted"}
+    assert artifact_status(tmp_path / "missing") is None
+
+def test_writer_refreshes_its_markers_while_writing(tmp_path, monkeypatch):
+    monkeypatch.setattr(artifacts, "MARKER_REFRESH_S", 0.05)
+    writer = ArtifactWriter(workers=1)
+    release = threading.Event()
+    writer.submit(tmp_path, lambda w: release.wait(5))
+    [marker] = tmp_path.iterdir()
+    assert marker.name == pending_marker_name()
+    stale = time.time() - MARKER_LEASE_S - 1
+    os.utime(marker, (stale, stale))
+    time.sleep(0.2)
+    assert artifact_status(tmp_path)["status"] == "pending"
+    release.set()
+    writer.flush()
+    writer.shutdown()
+    assert artifact_status(tmp_path)["status"] == "ready"
+
+def test_unknown_format_is_rejected():
+    with pytest.raises(ValueError):
+        ArtifactWriter(image_format="gif")
+
+def test_concurrent_writes_of_one_artifact_publish_a_whole_file(writer, tmp_path):
+    path = tmp_path / "crop.webp"
+    with ThreadPoolExecutor(8) as pool:
+        for attempt in range(20):
+            payloads = [f"{attempt}-{index}".encode() * 100000 for index in range(8)]
+            list(pool.map(lambda data: writer.write_bytes(path, data), payloads))
+            assert path.read_bytes() in payloads
+    assert [p.name for p in tmp_path.iterdir()] == ["crop.webp"]
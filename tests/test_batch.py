@@ -0,0 +1,39 @@
+import zipfile
+from io import BytesIO
+import pytest
+from app.services.batch import BatchTooLargeError, is_zip_upload, read_zip_pages
+
+def _zip(entries):
+    bio = BytesIO()
+    with zipfile.ZipFile(bio, "w") as archive:
+        for name, data in entries:
+            archive.writestr(name, data)
+    bio.seek(0)
+    return bio
+
+def test_is_zip_upload():
+    assert is_zip_upload("application/zip", "pages")
+    assert is_zip_upload("application/octet-stream", "Chapter1.ZIP")
+    assert not is_zip_upload("image/png", "page.png")
+    assert not is_zip_upload(None, None)
+
+def test_read_zip_pages_orders_naturally_and_skips_non_images():
+    archive = _zip([
+        ("book/page10.png", b"10"),
+        ("book/page2.png", b"2"),
+        ("book/page1.jpg", b"1"),
+        ("book/notes.txt", b"skip"),
+        ("__MACOSX/book/._page1.jpg", b"skip"),
+        ("book/.hidden.png", b"skip"),
+    ])
+
+    pages = read_zip_pages(archive, max_pages=10, max_bytes=1024)
+
+    assert pages == [("page1.jpg", b"1"), ("page2.png", b"2"), ("page10.png", b"10")]
+
+def test_read_zip_pages_enforces_limits():
+    entries = [(f"p{i}.png", b"x" * 100) for i in range(3)]
+    with pytest.raises(BatchTooLargeError):
+        read_zip_pages(_zip(entries), max_pages=2, max_bytes=10_000)
+    with pytest.raises(BatchTooLargeError):
+        read_zip_pages(_zip(entries), max_pages=10, max_bytes=250)
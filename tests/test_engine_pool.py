@@ -0,0 +1,307 @@
+import asyncio
+import os
+import pstats
+import threading
+from multiprocessing import shared_memory
+import numpy as np
+import pytest
+from app.services import engine_worker
+from app.services.engine_pool import (
+    EngineCrashedError, EnginePool, ProcessEnginePool, QueueFullError, ThreadEnginePool
+)
+
+class FakeService:
+    def __init__(self, gate=None):
+        self.gate = gate
+        self.thread = threading.current_thread().name
+
+    def run_extraction(self, **kwargs):
+        if self.gate is not None:
+            self.gate.wait(timeout=5)
+        return {"thread": self.thread, "kwargs": kwargs}
+
+    def warmup(self):
+        return {"thread": self.thread}
+
+    def iter_pages(self, count, fail=False):
+        for index in range(count):
+            yield {"index": index, "thread": threading.current_thread().name}
+        if fail:
+            raise RuntimeError("inference failed")
+
+class FakeProcessService:
+    def run_extraction(self, image_bytes, request_id):
+        # image_bytes arrives as a view into shared memory
+        return {
+            "pid": os.getpid(),
+            "request_id": request_id,
+            "is_memoryview": isinstance(image_bytes, memoryview),
+            "image": bytes(image_bytes),
+        }
+
+    def iter_chunks(self, image_bytes):
+        for index in range(0, len(image_bytes), 2):
+            yield bytes(image_bytes[index:index + 2])
+
+    def crash(self):
+        os._exit(1)
+
+    def warmup(self):
+        return {"pid": os.getpid()}
+
+def test_run_returns_result_and_queue_stats():
+    pool = ThreadEnginePool(workers=1, queue_size=0, service_factory=FakeService)
+
+    async def go():
+        return await pool.run("run_extraction", request_id="r1")
+
+    try:
+        result, stats = asyncio.run(go())
+    finally:
+        pool.shutdown()
+
+    assert result["kwargs"] == {"request_id": "r1"}
+    # Service is created on the engine thread, never on the event loop
+    assert result["thread"].startswith("engine")
+    assert stats["queue_depth"] == 0
+    assert stats["queue_wait"] >= 0
+    assert pool.in_flight == 0
+
+def test_queue_full_rejects_immediately():
+    gate = threading.Event()
+    pool = ThreadEnginePool(workers=1, queue_size=1, service_factory=lambda: FakeService(gate))
+
+    async def go():
+        first = asyncio.create_task(pool.run("run_extraction"))
+        second = asyncio.create_task(pool.run("run_extraction"))
+        await asyncio.sleep(0.05)
+        with pytest.raises(QueueFullError) as excinfo:
+            await pool.run("run_extraction")
+        assert excinfo.value.retry_after >= 1
+        gate.set()
+        return await asyncio.gather(first, second)
+
+    try:
+        results = asyncio.run(go())
+    finally:
+        pool.shutdown()
+
+    assert [stats["queue_depth"] for _, stats in results] == [0, 1]
+    assert pool.in_flight == 0
+
+def test_wait_for_slot_queues_instead_of_rejecting():
+    gate = threading.Event()
+    pool = ThreadEnginePool(workers=1, queue_size=0, service_factory=lambda: FakeService(gate))
+
+    async def go():
+        first = asyncio.create_task(pool.run("run_extraction"))
+        await asyncio.sleep(0.05)
+        second = asyncio.create_task(pool.run("run_extraction", wait_for_slot=True))
+        await asyncio.sleep(0.1)
+        assert not second.done()
+        gate.set()
+        return await asyncio.gather(first, second)
+
+    try:
+        results = asyncio.run(go())
+    finally:
+        pool.shutdown()
+
+    assert results[1][1]["queue_wait"] >= 50
+    assert pool.in_flight == 0
+
+def test_waiting_callers_are_woken_in_turn_and_a_cancelled_one_passes_its_turn_on():
+    gate = threading.Event()
+    pool = ThreadEnginePool(workers=1, queue_size=0, service_factory=lambda: FakeService(gate))
+
+    async def go():
+        first = asyncio.create_task(pool.run("run_extraction", request_id="first"))
+        await asyncio.sleep(0.05)
+        waiting = [
+            asyncio.create_task(pool.run("run_extraction", wait_for_slot=True, request_id=name))
+            for name in ("second", "gone", "third")
+        ]
+        await asyncio.sleep(0.05)
+        assert len(pool._waiters) == 3
+        waiting[1].cancel()
+        gate.set()
+        done = await asyncio.gather(first, waiting[0], waiting[2])
+        assert waiting[1].cancelled()
+        return done
+
+    try:
+        results = asyncio.run(go())
+    finally:
+        pool.shutdown()
+
+    assert [result["kwargs"]["request_id"] for result, _ in results] == ["first", "second", "third"]
+    assert pool.in_flight == 0 and not pool._waiters
+
+def test_worker_errors_release_slot():
+    class Boom:
+        def run_extraction(self, **kwargs):
+            raise RuntimeError("inference failed")
+
+    pool = ThreadEnginePool(workers=1, queue_size=0, service_factory=Boom)
+
+    async def go():
+        for _ in range(2):
+            with pytest.raises(RuntimeError):
+                await pool.run("run_extraction")
+
+    try:
+        asyncio.run(go())
+    finally:
+        pool.shutdown()
+
+    assert pool.in_flight == 0
+
+def test_process_pool_passes_bytes_through_shared_memory():
+    pool = ProcessEnginePool(workers=1, queue_size=0,
+                             service_factory="test_engine_pool:FakeProcessService",
+                             service_kwargs={})
+
+    async def go():
+        return await pool.run("run_extraction", image_bytes=b"\x89PNG-bytes", request_id="r1")
+
+    try:
+        result, stats = asyncio.run(go())
+    finally:
+        pool.shutdown()
+
+    assert result["pid"] != os.getpid()
+    assert result["is_memoryview"]
+    assert result["image"] == b"\x89PNG-bytes"
+    assert result["request_id"] == "r1"
+    assert stats["queue_depth"] == 0
+
+def test_process_pool_restarts_crashed_workers():
+    pool = ProcessEnginePool(workers=1, queue_size=0,
+                             service_factory="test_engine_pool:FakeProcessService",
+                             service_kwargs={})
+
+    async def go():
+        with pytest.raises(EngineCrashedError):
+            await pool.run("crash")
+        return await pool.run("run_extraction", image_bytes=b"again", request_id="r2")
+
+    try:
+        result, _ = asyncio.run(go())
+    finally:
+        pool.shutdown()
+
+    assert result["image"] == b"again"
+    assert pool.in_flight == 0
+
+def test_stream_yields_items_then_releases_slot():
+    pool = ThreadEnginePool(workers=1, queue_size=0, service_factory=FakeService)
+    stats = {}
+
+    async def go():
+        return [item async for item in pool.stream("iter_pages", stats=stats, count=3)]
+
+    try:
+        items = asyncio.run(go())
+    finally:
+        pool.shutdown()
+
+    assert [item["index"] for item in items] == [0, 1, 2]
+    assert items[0]["thread"].startswith("engine")
+    assert stats["queue_depth"] == 0
+    assert pool.in_flight == 0
+
+def test_stream_raises_after_items_produced_before_a_failure():
+    pool = ThreadEnginePool(workers=1, queue_size=0, service_factory=FakeService)
+    items = []
+
+    async def go():
+        async for item in pool.stream("iter_pages", count=2, fail=True):
+            items.append(item)
+
+    try:
+        with pytest.raises(RuntimeError):
+            asyncio.run(go())
+    finally:
+        pool.shutdown()
+
+    assert len(items) == 2
+    assert pool.in_flight == 0
+
+def test_process_pool_streams_collected_items():
+    pool = ProcessEnginePool(workers=1, queue_size=0,
+                             service_factory="test_engine_pool:FakeProcessService",
+                             service_kwargs={})
+
+    async def go():
+        return [item async for item in pool.stream("iter_chunks", image_bytes=b"abcde")]
+
+    try:
+        items = asyncio.run(go())
+    finally:
+        pool.shutdown()
+
+    assert items == [b"ab", b"cd", b"e"]
+    assert pool.in_flight == 0
+
+def test_profile_path_dumps_cprofile_stats(tmp_path):
+    pool = ThreadEnginePool(workers=1, queue_size=0, service_factory=FakeService)
+    run_profile, stream_profile = tmp_path / "run.prof", tmp_path / "stream.prof"
+
+    async def go():
+        await pool.run("run_extraction", profile_path=str(run_profile))
+        return [item async for item in pool.stream("iter_pages", profile_path=str(stream_profile), count=2)]
+
+    try:
+        asyncio.run(go())
+    finally:
+        pool.shutdown()
+
+    assert "run_extraction" in str(pstats.Stats(str(run_profile)).stats)
+    assert "iter_pages" in str(pstats.Stats(str(stream_profile)).stats)
+
+def test_thread_pool_warms_every_worker():
+    pool = ThreadEnginePool(workers=3, queue_size=0, service_factory=FakeService)
+
+    try:
+        reports = asyncio.run(pool.warmup())
+    finally:
+        pool.shutdown()
+
+    assert len({r["thread"] for r in reports}) == 3
+
+def test_process_pool_warms_every_worker():
+    pool = ProcessEnginePool(workers=2, queue_size=0,
+                             service_factory="test_engine_pool:FakeProcessService",
+                             service_kwargs={})
+
+    try:
+        reports = asyncio.run(pool.warmup())
+    finally:
+        pool.shutdown()
+
+    assert len(reports) == 2
+    assert all(r["pid"] != os.getpid() for r in reports)
+
+def test_pools_must_implement_every_way_of_running_calls():
+    class HalfPool(EnginePool):
+        def _submit(self, method, kwargs, profile_path=None):
+            pass
+
+    with pytest.raises(TypeError, match="_submit_stream, shutdown, warmup"):
+        HalfPool(workers=2)
+
+class ArrayService:
+    def run_extraction(self, image_bytes):
+        pixels = np.frombuffer(image_bytes, np.uint8)
+        raise ValueError(f"Invalid image file ({pixels.size} bytes).")
+
+def test_worker_call_raises_the_services_error_while_its_arrays_hold_the_segment(monkeypatch):
+    monkeypatch.setattr(engine_worker, "_service", ArrayService())
+    monkeypatch.setattr(engine_worker, "_attach_shared_memory", lambda name: shared_memory.SharedMemory(name=name))
+    shm = shared_memory.SharedMemory(create=True, size=16)
+    try:
+        with pytest.raises(ValueError, match=r"Invalid image file \(8 bytes\)"):
+            engine_worker.worker_call("run_extraction", {}, {"image_bytes": (shm.name, 8)})
+    finally:
+        shm.close()
+        shm.unlink()
@@ -0,0 +1,82 @@
+import numpy as np
+import pytest
+from types import SimpleNamespace
+from unittest.mock import patch
+from app.services.engines import (
+    EngineUnavailableError, PaddleReader, UnknownEngineError, check_available, group_lines,
+    read_page, read_regions, resolve_engines,
+)
+
+def line(text, x1, y1, x2, y2):
+    return {'text': text, 'confidence': 0.9, 'text_region': [[x1, y1], [x2, y1], [x2, y2], [x1, y2]]}
+
+class FakeReader:
+    def __init__(self, lines):
+        self.lines = lines
+        self.calls = []
+
+    def read(self, img):
+        self.calls.append(img.shape)
+        return [dict(l) for l in self.lines], {'det': 0.1, 'rec': 0.2}
+
+def test_resolve_engines_defaults_and_aliases():
+    assert resolve_engines(None, None) == ("paddle", "paddle")
+    assert resolve_engines("Tesseract", "none") == ("tesseract", "none")
+    assert resolve_engines("paddle", "detectron2") == ("paddle", "paddle")
+
+@pytest.mark.parametrize("ocr_engine, layout_engine", [("easyocr", "paddle"), ("paddle", "yolo")])
+def test_resolve_engines_rejects_unknown(ocr_engine, layout_engine):
+    with pytest.raises(UnknownEngineError):
+        resolve_engines(ocr_engine, layout_engine)
+
+def test_check_available_reports_missing_optional_engines():
+    check_available("paddle")
+    with patch("app.services.engines.importlib.util.find_spec", return_value=None):
+        with pytest.raises(EngineUnavailableError) as e:
+            check_available("doctr")
+    assert str(e.value) == "OCR engine 'doctr' is not installed on this server."
+
+def test_group_lines_splits_paragraphs_on_wide_gaps():
+    lines = [
+        line("second", 10, 32, 200, 52),
+        line("first", 10, 10, 180, 30),
+        line("new paragraph", 12, 90, 190, 110),
+    ]
+    regions = group_lines(lines, 300, 120)
+    assert [[l['text'] for l in r['res']] for r in regions] == [["first", "second"], ["new paragraph"]]
+    assert regions[0]['bbox'] == [10, 10, 200, 52]
+    assert all(r['type'] == 'text' for r in regions)
+    assert group_lines([], 300, 120) == []
+
+def test_read_page_skips_layout():
+    reader = FakeReader([line("only", 5, 5, 50, 20)])
+    regions, times = read_page(np.zeros((100, 80, 3), dtype=np.uint8), reader)
+    assert reader.calls == [(100, 80, 3)]
+    assert times == {'layout': 0.0, 'det': 0.1, 'rec': 0.2}
+    assert regions[0]['res'][0]['text'] == "only"
+
+def test_read_regions_reads_each_layout_region_in_page_coordinates():
+    engine = SimpleNamespace(layout_predictor=lambda img: ([
+        {'bbox': [10, 20, 110, 70], 'label': 'text'},
+        {'bbox': [0, 100, 50, 150], 'label': 'table'},
+    ], 0.5))
+    reader = FakeReader([line("hello", 1, 2, 30, 12)])
+
+    regions, times = read_regions(engine, np.zeros((200, 200, 3), dtype=np.uint8), reader)
+
+    assert reader.calls == [(50, 100, 3)]
+    assert times == {'layout': 0.5, 'det': 0.1, 'rec': 0.2}
+    assert regions[0]['res'][0]['text_region'][0] == [11, 22]
+    assert regions[1]['res'] == ''
+
+def test_paddle_reader_runs_detection_and_recognition_only():
+    boxes = np.array([[[0, 0], [40, 0], [40, 10], [0, 10]]], dtype=np.float32)
+    text_system = SimpleNamespace(
+        text_detector=lambda img: (boxes, 0.25),
+        text_recognizer=lambda crops: ([("Hello", 0.95)] * len(crops), 0.5),
+        use_angle_cls=False,
+        drop_score=0.5,
+    )
+    lines, times = PaddleReader(text_system).read(np.zeros((50, 50, 3), dtype=np.uint8))
+    assert [l['text'] for l in lines] == ["Hello"]
+    assert times == {'det': 0.25, 'rec': 0.5}
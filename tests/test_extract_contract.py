@@ -129,3 +129,12 @@ def test_annotated_image_url_is_served():
     assert r2.status_code == 200
     assert r2.headers["content-type"].startswith("image/")
     assert len(r2.content) > 0
+
+def test_extract_rejects_unknown_engine():
+    files = {"file": ("page.png", _tiny_png_bytes(), "image/png")}
+    data = {"store_outputs": "false", "ocr_engine": "paddle", "layout_engine": "made-up"}
+
+    r = httpx.post(f"{BASE_URL}/extract", files=files, data=data, timeout=20)
+
+    assert r.status_code == 400
+    assert "layout_engine" in r.json()["detail"]
@@ -1,8 +1,11 @@
+import copy
 import pytest
 import numpy as np
 import cv2
 from unittest.mock import MagicMock, patch
 from pathlib import Path
+from app.services.engines import EngineUnavailableError
+from paddleocr.paddleocr import StructureSystem
 from app.services.extraction import ExtractionService
 
 # Mock data for PPStructure result
@@ -43,6 +46,13 @@ def test_initialization(service, mock_ppstructure):
     # Verify PPStructure was initialized with correct params
     pass # valid if fixture runs
 
+def test_warmup_runs_engine_once(service, mock_ppstructure):
+    report = service.warmup()
+    assert report["warmup_ms"] >= 0
+    assert report["load_ms"] >= 0
+    assert service.warmup() == report
+    assert mock_ppstructure.call_count == 1
+
 def test_run_extraction_happy_path(service, tmp_path):
     # Create a dummy image bytes
     img = np.zeros((200, 200, 3), dtype=np.uint8)
@@ -79,8 +89,9 @@ def test_run_extraction_happy_path(service, tmp_path):
     assert figures[0]["type"] == "figure" if "type" in figures[0] else True # Schema check
     assert figures[0]["id"] == "f1"
     
-    # Verify Exports
+    # Verify Exports (written in the background)
     assert response["exports"]["annotated_image_path"] is not None
+    service.artifacts.flush()
     assert (output_dir / "annotated.png").exists()
     
     # Verify Figure Saved
@@ -119,3 +130,155 @@ def test_invalid_image(service):
             store_outputs=False,
             return_annotated=False
         )
+
+def test_downscaled_results_map_back_to_original(mock_ppstructure, tmp_path):
+    # Engine sees the page at half size; everything is reported at full size
+    mock_ppstructure.return_value = copy.deepcopy(MOCK_PADDLE_RESULT)
+    service = ExtractionService(max_side=100)
+    img = np.zeros((200, 200, 3), dtype=np.uint8)
+    img[120:300, 20:200] = 255
+    _, img_encoded = cv2.imencode('.png', img)
+
+    response = service.run_extraction(
+        image_bytes=img_encoded.tobytes(),
+        request_id="req-scaled",
+        output_dir=tmp_path,
+        store_outputs=True,
+        return_annotated=False
+    )
+
+    engine_img = mock_ppstructure.call_args[0][0]
+    assert engine_img.shape == (100, 100, 3)
+    assert response["meta"]["image"] == {
+        "width": 200, "height": 200, "processed_width": 100, "processed_height": 100
+    }
+    assert response["blocks"][0]["bbox"] == [20, 20, 200, 100]
+    assert response["figures"][0]["bbox"] == [20, 120, 200, 200]
+    # The figure is cropped from the full-resolution original
+    service.artifacts.flush()
+    crop = cv2.imread(str(tmp_path / "f1_figure.png"))
+    assert crop.shape == (80, 180, 3)
+    assert crop.min() == 255
+
+def test_stage_times_come_from_structure_systems_own_call():
+    with patch('app.services.extraction.PPStructure') as MockClass:
+        MockClass.return_value = MagicMock(spec=StructureSystem)
+        assert ExtractionService()._structure_call is StructureSystem.__call__
+        # Anything that is not a StructureSystem is called as it is
+        MockClass.return_value = MagicMock()
+        assert ExtractionService()._structure_call is None
+
+def test_engine_stage_times_split_layout_and_ocr(service):
+    # With the real PPStructure, the base StructureSystem call reports its own stage times
+    service._structure_call = lambda engine, img: (
+        copy.deepcopy(MOCK_PADDLE_RESULT), {"layout": 0.5, "det": 0.25, "rec": 0.125}
+    )
+    _, img_encoded = cv2.imencode('.png', np.zeros((200, 200, 3), dtype=np.uint8))
+
+    response = service.run_extraction(
+        image_bytes=img_encoded.tobytes(),
+        request_id="req-times",
+        output_dir=None,
+        store_outputs=False,
+        return_annotated=False
+    )
+
+    timings = response["meta"]["timings_ms"]
+    assert timings["layout"] == 500
+    assert timings["ocr"] == 375
+
+def test_pipeline_mode_recognizes_through_shared_batcher(mock_ppstructure):
+    with patch('app.services.extraction.get_recognition_batcher') as get_batcher, \
+         patch('app.services.extraction.run_pipeline') as run_pipeline:
+        run_pipeline.return_value = (copy.deepcopy(MOCK_PADDLE_RESULT), {"layout": 0.1, "det": 0.2, "rec": 0.3})
+        service = ExtractionService(pipeline=True, rec_batch_size=16, rec_batch_wait_ms=2)
+        get_batcher.assert_called_once_with(mock_ppstructure.text_system.text_recognizer, 16, 2)
+        _, img_encoded = cv2.imencode('.png', np.zeros((200, 200, 3), dtype=np.uint8))
+
+        response = service.run_extraction(
+            image_bytes=img_encoded.tobytes(),
+            request_id="req-pipeline",
+            output_dir=None,
+            store_outputs=False,
+            return_annotated=False
+        )
+
+    assert run_pipeline.call_args[0][2] == get_batcher.return_value.recognize
+    mock_ppstructure.assert_not_called()
+    assert response["meta"]["timings_ms"]["ocr"] == 500
+    assert len(response["blocks"]) == 2
+
+def test_layout_engine_none_reads_plain_text(service, mock_ppstructure):
+    reader = MagicMock()
+    reader.read.return_value = (
+        [{'text': 'Plain prose', 'confidence': 0.9, 'text_region': [[10, 10], [90, 10], [90, 30], [10, 30]]}],
+        {'det': 0.1, 'rec': 0.2},
+    )
+    service._readers["paddle"] = reader
+    _, img_encoded = cv2.imencode('.png', np.zeros((200, 200, 3), dtype=np.uint8))
+
+    response = service.run_extraction(
+        image_bytes=img_encoded.tobytes(),
+        request_id="req-plain",
+        output_dir=None,
+        store_outputs=False,
+        return_annotated=False,
+        layout_engine="none",
+    )
+
+    mock_ppstructure.assert_not_called()
+    assert response["meta"]["engines"] == {"ocr": "paddle", "layout": "none"}
+    assert response["meta"]["timings_ms"]["layout"] == 0
+    assert [b["text"] for b in response["blocks"]] == ["Plain prose"]
+    assert response["blocks"][0]["bbox"] == [10, 10, 90, 30]
+
+def test_unavailable_ocr_engine_is_reported(service):
+    _, img_encoded = cv2.imencode('.png', np.zeros((20, 20, 3), dtype=np.uint8))
+    with patch("app.services.engines.importlib.util.find_spec", return_value=None):
+        with pytest.raises(EngineUnavailableError):
+            service.run_extraction(img_encoded.tobytes(), "req-doctr", None, False, False, ocr_engine="doctr")
+
+def test_lines_carry_page_boxes_in_reading_order(mock_ppstructure, tmp_path):
+    # Two columns seen at half size; the right column's region comes first from the engine
+    def line(text, x1, y1, x2, y2):
+        return {'text': text, 'confidence': 0.9, 'text_region': [[x1, y1], [x2, y1], [x2, y2], [x1, y2]]}
+    mock_ppstructure.return_value = [
+        {'type': 'text', 'bbox': [55, 10, 95, 40], 'res': [line('right', 56, 12, 90, 20)], 'img': None},
+        {'type': 'text', 'bbox': [5, 20, 45, 90], 'res': [line('left 1', 6, 22, 40, 30),
+                                                         line('left 2', 6, 32, 44, 40)], 'img': None},
+    ]
+    service = ExtractionService(max_side=100)
+    _, img_encoded = cv2.imencode('.png', np.zeros((200, 200, 3), dtype=np.uint8))
+
+    response = service.run_extraction(
+        image_bytes=img_encoded.tobytes(),
+        request_id="req-columns",
+        output_dir=tmp_path,
+        store_outputs=False,
+        return_annotated=False
+    )
+
+    assert [b["text"] for b in response["blocks"]] == ["left 1\nleft 2", "right"]
+    assert [line["bbox"] for line in response["blocks"][0]["lines"]] == [[12, 44, 80, 60], [12, 64, 88, 80]]
+    assert response["blocks"][1]["lines"][0]["bbox"] == [112, 24, 180, 40]
+
+def test_region_cache_counts_show_in_timings(mock_ppstructure, tmp_path):
+    service = ExtractionService(region_cache_path=str(tmp_path / "regions.sqlite3"), region_cache_mb=1)
+    assert service.engine.text_system is service.region_cache
+
+    def engines(img, ocr_engine, layout_engine):
+        service.region_cache.hits += 2
+        service.region_cache.misses += 1
+        return copy.deepcopy(MOCK_PADDLE_RESULT), {"layout": 0.01, "det": 0.02, "rec": 0.03}
+
+    service._call_engines = engines
+    _, img_encoded = cv2.imencode('.png', np.zeros((200, 200, 3), dtype=np.uint8))
+    response = service.run_extraction(
+        image_bytes=img_encoded.tobytes(),
+        request_id="req-region-cache",
+        output_dir=tmp_path,
+        store_outputs=False,
+        return_annotated=False
+    )
+    timings = response["meta"]["timings_ms"]
+    assert (timings["region_cache_hits"], timings["region_cache_misses"]) == (2, 1)
@@ -0,0 +1,78 @@
+import io
+import pickle
+import cv2
+import numpy as np
+import pytest
+from PIL import Image
+from app.services.image_ingest import (
+    ImageTooLargeError, InvalidImageError, decode_image, estimate_text_height, plan_scale,
+    probe_image, resize_image
+)
+
+def encode(img, fmt="PNG", **params):
+    buf = io.BytesIO()
+    img.save(buf, format=fmt, **params)
+    return buf.getvalue()
+
+def test_probe_reads_size_from_header():
+    assert probe_image(encode(Image.new("RGB", (30, 20)))) == (30, 20)
+
+def test_probe_rejects_non_images():
+    with pytest.raises(InvalidImageError):
+        probe_image(b"not an image")
+
+def test_pixel_limit_is_enforced_before_decoding():
+    data = encode(Image.new("RGB", (300, 200)))
+    assert probe_image(data, max_pixels=60_000) == (300, 200)
+    with pytest.raises(ImageTooLargeError) as excinfo:
+        decode_image(data, max_pixels=59_999)
+    assert excinfo.value.max_pixels == 59_999
+
+def test_decode_returns_bgr_array():
+    img = decode_image(encode(Image.new("RGB", (30, 20), (255, 0, 0))))
+    assert img.shape == (20, 30, 3)
+    assert img[0, 0].tolist() == [0, 0, 255]
+
+def test_decode_applies_exif_orientation():
+    photo = Image.new("RGB", (40, 20), "white")
+    exif = photo.getexif()
+    exif[0x0112] = 6  # Rotated 90 degrees clockwise
+    img = decode_image(encode(photo, "JPEG", exif=exif))
+    assert img.shape[:2] == (40, 20)
+
+def test_truncated_image_fails_decode():
+    data = encode(Image.new("RGB", (300, 200)), "JPEG")
+    with pytest.raises(InvalidImageError):
+        decode_image(data[:200])
+
+def test_errors_survive_pickling():
+    # Errors raised in process-mode workers travel back pickled
+    error = pickle.loads(pickle.dumps(ImageTooLargeError(10)))
+    assert str(error) == "Image exceeds the limit of 10 pixels."
+    assert isinstance(pickle.loads(pickle.dumps(InvalidImageError())), InvalidImageError)
+
+def text_page(font_scale):
+    page = np.full((4000, 3000, 3), 255, dtype=np.uint8)
+    for i in range(30):
+        cv2.putText(page, "The quick brown fox jumps over", (100, 150 + i * int(40 * font_scale)),
+                    cv2.FONT_HERSHEY_SIMPLEX, font_scale, (0, 0, 0), int(2 * font_scale))
+    return page
+
+def test_text_height_tracks_glyph_size():
+    small, large = estimate_text_height(text_page(1)), estimate_text_height(text_page(4))
+    assert 10 < small < 30
+    assert 3 < large / small < 5
+
+def test_blank_page_has_no_text_height():
+    assert estimate_text_height(np.full((1000, 800, 3), 255, dtype=np.uint8)) is None
+
+def test_plan_scale():
+    page = text_page(4)
+    assert plan_scale(page) == 1.0
+    assert plan_scale(page, max_side=2000) == 0.5
+    # Large text allows going further than the max side asks for
+    assert plan_scale(page, max_side=2000, target_text_px=32) < 0.5
+    # but never below the detector's input size, and never upscaling
+    assert plan_scale(page, target_text_px=1) == 960 / 4000
+    assert plan_scale(np.zeros((100, 80, 3), dtype=np.uint8), max_side=2000) == 1.0
+    assert resize_image(page, 0.5).shape == (2000, 1500, 3)
@@ -0,0 +1,32 @@
+import pytest
+from unittest.mock import patch
+from app.services.extraction import ExtractionService
+from app.services.inference_profiles import UnknownInferenceProfileError, profile_engine_kwargs, profile_threads
+
+def engine_kwargs(**options):
+    with patch('app.services.extraction.PPStructure') as MockClass:
+        ExtractionService(**options)
+    return MockClass.call_args.kwargs
+
+def test_accurate_profile_builds_the_engine_as_before():
+    kwargs = engine_kwargs()
+    assert "enable_mkldnn" not in kwargs and "det_model_dir" not in kwargs and "rec_batch_num" not in kwargs
+
+def test_faster_profiles_use_onednn_and_quantized_models():
+    balanced = engine_kwargs(inference_profile="balanced", cpu_threads=4)
+    assert balanced["enable_mkldnn"] and balanced["cpu_threads"] == 4 and "rec_model_dir" not in balanced
+    fast = engine_kwargs(inference_profile="fast", pipeline=True, rec_batch_size=48)
+    assert fast["enable_mkldnn"] and fast["rec_batch_num"] == 48
+    assert fast["rec_model_dir"].endswith("/english/en_PP-OCRv3_rec_slim_infer.tar")
+    assert fast["det_model_dir"].endswith("/english/en_PP-OCRv3_det_slim_infer.tar")
+
+def test_unknown_profile_is_rejected():
+    with pytest.raises(UnknownInferenceProfileError) as excinfo:
+        profile_engine_kwargs("turbo")
+    assert str(excinfo.value) == "Unknown inference profile 'turbo', expected one of: accurate, balanced, fast."
+
+def test_onednn_profiles_share_the_cores_between_workers():
+    with patch('app.services.inference_profiles.os.cpu_count', return_value=16):
+        assert profile_threads("accurate", 2) is None
+        assert profile_threads("balanced", 2) == 8
+        assert profile_threads("fast", 32) == 1
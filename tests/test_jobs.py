@@ -0,0 +1,187 @@
+import asyncio
+import json
+from app.services import jobs
+from app.services.jobs import JobManager
+
+PAGES = [("page1.png", b"one"), ("page2.png", b"two"), ("page3.png", b"three")]
+OPTIONS = {"store_outputs": False, "return_annotated": False, "ocr_engine": "paddle"}
+
+async def echo_page(job, page, image_bytes):
+    return {"meta": {"page": page["index"]}, "blocks": [{"text": image_bytes.decode()}]}
+
+async def wait_for_status(manager, job_id, statuses, timeout=5):
+    for _ in range(int(timeout / 0.01)):
+        job = await manager.get_job(job_id)
+        if job["status"] in statuses:
+            return job
+        await asyncio.sleep(0.01)
+    raise AssertionError(f"job stuck in {job['status']}")
+
+def test_job_runs_all_pages_and_persists_results(tmp_path):
+    async def go():
+        manager = JobManager(tmp_path, echo_page, concurrency=2)
+        await manager.start()
+        try:
+            job = await manager.create_job(PAGES, OPTIONS)
+            assert job["status"] == "queued"
+            return await wait_for_status(manager, job["job_id"], ("completed",))
+        finally:
+            await manager.stop()
+
+    job = asyncio.run(go())
+
+    assert job["progress"] == {"total": 3, "completed": 3, "failed": 0}
+    assert [p["result"]["blocks"][0]["text"] for p in job["pages"]] == ["one", "two", "three"]
+    job_dir = tmp_path / job["job_id"]
+    assert json.loads((job_dir / "job.json").read_text())["status"] == "completed"
+    assert len(list((job_dir / "inputs").iterdir())) == 3
+    assert not (tmp_path / "_jobs" / "active" / job["job_id"]).exists()
+
+def test_failed_pages_are_reported(tmp_path):
+    async def flaky_page(job, page, image_bytes):
+        if page["index"] == 1:
+            raise RuntimeError("inference failed")
+        return await echo_page(job, page, image_bytes)
+
+    async def go():
+        manager = JobManager(tmp_path, flaky_page, concurrency=1)
+        await manager.start()
+        try:
+            job = await manager.create_job(PAGES, OPTIONS)
+            return await wait_for_status(manager, job["job_id"], ("completed",))
+        finally:
+            await manager.stop()
+
+    job = asyncio.run(go())
+
+    assert job["progress"] == {"total": 3, "completed": 2, "failed": 1}
+    assert job["pages"][1]["status"] == "failed"
+    assert job["pages"][1]["error"] == "inference failed"
+    assert job["pages"][1]["result"] is None
+
+def test_cancel_skips_pending_pages(tmp_path):
+    gate = asyncio.Event()
+
+    async def slow_page(job, page, image_bytes):
+        await gate.wait()
+        return await echo_page(job, page, image_bytes)
+
+    async def go():
+        manager = JobManager(tmp_path, slow_page, concurrency=1)
+        await manager.start()
+        try:
+            job = await manager.create_job(PAGES, OPTIONS)
+            await asyncio.sleep(0.05)
+            cancelled = await manager.cancel_job(job["job_id"])
+            gate.set()
+            await asyncio.sleep(0.05)
+            return cancelled, await manager.get_job(job["job_id"])
+        finally:
+            await manager.stop()
+
+    cancelled, job = asyncio.run(go())
+
+    assert cancelled["status"] == "cancelled"
+    assert job["status"] == "cancelled"
+    # The page that was already running finishes, the rest never start
+    assert [p["status"] for p in job["pages"]] == ["completed", "cancelled", "cancelled"]
+
+def test_unfinished_jobs_resume_after_restart(tmp_path):
+    async def never_finishes(job, page, image_bytes):
+        await asyncio.Event().wait()
+
+    async def first_run():
+        manager = JobManager(tmp_path, never_finishes, concurrency=1)
+        await manager.start()
+        job = await manager.create_job(PAGES, OPTIONS)
+        await asyncio.sleep(0.05)
+        await manager.stop()
+        return job["job_id"]
+
+    async def second_run(job_id):
+        manager = JobManager(tmp_path, echo_page, concurrency=2)
+        await manager.start()
+        try:
+            return await wait_for_status(manager, job_id, ("completed",))
+        finally:
+            await manager.stop()
+
+    job_id = asyncio.run(first_run())
+    job = asyncio.run(second_run(job_id))
+
+    assert job["progress"]["completed"] == 3
+    assert job["pages"][0]["result"]["blocks"][0]["text"] == "one"
+
+def test_watch_streams_pages_then_final_state(tmp_path):
+    gate = asyncio.Event()
+
+    async def gated_page(job, page, image_bytes):
+        if page["index"] > 0:
+            await gate.wait()
+        return await echo_page(job, page, image_bytes)
+
+    async def go():
+        manager = JobManager(tmp_path, gated_page, concurrency=1)
+        await manager.start()
+        try:
+            job = await manager.create_job(PAGES, OPTIONS)
+            await asyncio.sleep(0.05)
+            events = []
+            async for event in manager.watch(job["job_id"]):
+                events.append(event)
+                gate.set()
+            return events
+        finally:
+            await manager.stop()
+
+    events = asyncio.run(go())
+
+    # The page finished before watching started comes first, then the rest live
+    assert [(e["type"], e["data"].get("index")) for e in events] == [
+        ("page", 0), ("page", 1), ("page", 2), ("job", None)
+    ]
+    assert events[1]["data"]["result"]["blocks"][0]["text"] == "two"
+    assert events[-1]["data"]["status"] == "completed"
+
+def test_finished_jobs_leave_memory_and_are_served_from_disk(tmp_path, monkeypatch):
+    monkeypatch.setattr(jobs, "FINISHED_JOBS_CACHED", 1)
+
+    async def go():
+        manager = JobManager(tmp_path, echo_page, concurrency=2)
+        await manager.start()
+        try:
+            first = await manager.create_job(PAGES, OPTIONS)
+            await wait_for_status(manager, first["job_id"], ("completed",))
+            second = await manager.create_job(PAGES[:1], OPTIONS)
+            await wait_for_status(manager, second["job_id"], ("completed",))
+            held = set(manager._jobs) | set(manager._finished)
+            return held, second["job_id"], await manager.get_job(first["job_id"])
+        finally:
+            await manager.stop()
+
+    held, second_id, first = asyncio.run(go())
+
+    assert held == {second_id}
+    assert first["status"] == "completed"
+    assert [p["result"]["blocks"][0]["text"] for p in first["pages"]] == ["one", "two", "three"]
+
+def test_watching_a_finished_job_reads_each_result_as_it_is_sent(tmp_path):
+    async def go():
+        manager = JobManager(tmp_path, echo_page, concurrency=2)
+        await manager.start()
+        try:
+            job = await manager.create_job(PAGES, OPTIONS)
+            await wait_for_status(manager, job["job_id"], ("completed",))
+            reads = []
+            page_result = manager._page_result
+            manager._page_result = lambda job_id, page: reads.append(page["index"]) or page_result(job_id, page)
+            seen = []
+            async for event in manager.watch(job["job_id"]):
+                seen.append((event["type"], list(reads)))
+                if event["type"] == "page":
+                    assert event["data"]["result"]["blocks"][0]["text"] == PAGES[event["data"]["index"]][1].decode()
+            return seen
+        finally:
+            await manager.stop()
+
+    assert asyncio.run(go()) == [("page", [0]), ("page", [0, 1]), ("page", [0, 1, 2]), ("job", [0, 1, 2])]
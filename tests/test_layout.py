@@ -0,0 +1,52 @@
+import random
+from app.services.layout import line_bboxes, reading_order
+
+def ordered(boxes, width=1000, seed=0):
+    names = list(boxes)
+    random.Random(seed).shuffle(names)
+    return [names[i] for i in reading_order([boxes[name] for name in names], width)]
+
+def test_single_column_reads_top_to_bottom():
+    boxes = {"a": [100, 50, 900, 100], "b": [100, 120, 900, 300], "c": [100, 320, 600, 400]}
+    assert ordered(boxes) == ["a", "b", "c"]
+
+def test_columns_are_read_one_after_the_other_between_full_width_regions():
+    boxes = {
+        "title": [100, 50, 900, 100],
+        "left 1": [100, 150, 480, 300], "right 1": [520, 150, 900, 250],
+        # Both columns break at the same height: still one pair of columns
+        "left 2": [100, 320, 480, 400], "right 2": [520, 320, 900, 500],
+        "left 3": [100, 420, 480, 480],
+        "figure": [100, 550, 900, 700],
+        "left 4": [100, 750, 480, 900], "right 4": [520, 750, 900, 850],
+        "page number": [480, 950, 520, 970],
+    }
+    expected = ["title", "left 1", "left 2", "left 3", "right 1", "right 2", "figure",
+                "left 4", "right 4", "page number"]
+    for seed in range(5):
+        assert ordered(boxes, seed=seed) == expected
+
+def test_three_columns():
+    boxes = {f"{column}{row}": [50 + column * 320, 100 + row * 100, 330 + column * 320, 180 + row * 100]
+             for column in range(3) for row in range(3)}
+    assert ordered(boxes) == [f"{column}{row}" for column in range(3) for row in range(3)]
+
+def test_narrow_region_under_columns_is_not_read_as_part_of_one():
+    boxes = {f"{column}{row}": [50 + column * 320, 100 + row * 100, 330 + column * 320, 180 + row * 100]
+             for column in range(3) for row in range(3)}
+    # Centered under the middle column, but below all three
+    boxes["page number"] = [480, 450, 520, 470]
+    expected = [f"{column}{row}" for column in range(3) for row in range(3)] + ["page number"]
+    for seed in range(5):
+        assert ordered(boxes, seed=seed) == expected
+
+def test_empty_page():
+    assert reading_order([], 1000) == []
+
+def test_line_bboxes_scale_clip_and_skip_missing_polygons():
+    lines = [
+        {"text": "a", "text_region": [[1.2, 2.7], [10, 2], [10, 9.5], [1, 9]]},
+        {"text": "no polygon"},
+        {"text": "b", "text_region": [[40, 40], [60, 40], [60, 60], [40, 60]]},
+    ]
+    assert line_bboxes(lines, 2, 2, width=100, height=100) == [[2, 4, 20, 19], [0, 0, 0, 0], [80, 80, 100, 100]]
@@ -0,0 +1,61 @@
+import asyncio
+import pytest
+from fastapi import HTTPException
+from prometheus_client import REGISTRY
+from app.services import metrics
+
+def sample(name, **labels):
+    return REGISTRY.get_sample_value(name, labels) or 0
+
+def test_observe_page_records_stages_and_queue_wait():
+    response = {"meta": {
+        "image": {"width": 2000, "height": 1000},
+        "timings_ms": {"preprocess": 20, "layout": 300, "queue_depth": 2, "queue_wait": 150},
+        "cache": {"hit": False, "source_request_id": None},
+    }}
+    before = {
+        "layout": sample("extraction_stage_seconds_sum", stage="layout", ocr_engine="doctr"),
+        "wait": sample("engine_queue_wait_seconds_sum", ocr_engine="doctr"),
+        "pages": sample("extraction_pages_total", ocr_engine="doctr", cache="miss"),
+    }
+
+    metrics.observe_page(response, "doctr")
+
+    assert sample("extraction_stage_seconds_sum", stage="layout", ocr_engine="doctr") == pytest.approx(before["layout"] + 0.3)
+    assert sample("engine_queue_wait_seconds_sum", ocr_engine="doctr") == pytest.approx(before["wait"] + 0.15)
+    assert sample("extraction_pages_total", ocr_engine="doctr", cache="miss") == before["pages"] + 1
+    # queue_depth is a count, not a stage
+    assert sample("extraction_stage_seconds_count", stage="queue_depth", ocr_engine="doctr") == 0
+
+def test_unknown_engines_share_one_label():
+    assert metrics.engine_label("paddle") == "paddle"
+    assert metrics.engine_label("anything-a-client-sends") == "other"
+
+def test_tracked_counts_status_codes():
+    @metrics.tracked("test_endpoint")
+    async def endpoint(ocr_engine="paddle", fail=None):
+        if fail:
+            raise fail
+        return "ok"
+
+    def count(status):
+        return sample("extraction_requests_total", endpoint="test_endpoint", ocr_engine="tesseract", status=status)
+
+    assert asyncio.run(endpoint(ocr_engine="tesseract")) == "ok"
+    with pytest.raises(HTTPException):
+        asyncio.run(endpoint(ocr_engine="tesseract", fail=HTTPException(status_code=400)))
+    with pytest.raises(RuntimeError):
+        asyncio.run(endpoint(ocr_engine="tesseract", fail=RuntimeError("boom")))
+
+    assert (count("200"), count("400"), count("500")) == (1, 1, 1)
+    assert sample("extraction_requests_in_progress", endpoint="test_endpoint") == 0
+
+def test_render_metrics_is_prometheus_text():
+    capacity = [9]
+    metrics.bind_engine_pool(lambda: 3, lambda: capacity[0])
+    body, content_type = metrics.render_metrics()
+    assert content_type.startswith("text/plain")
+    assert b"engine_in_flight 3.0" in body
+    assert b"engine_capacity 9.0" in body
+    capacity[0] = 12
+    assert b"engine_capacity 12.0" in metrics.render_metrics()[0]
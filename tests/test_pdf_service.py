@@ -1,6 +1,8 @@
+import re
 import unittest
 from pathlib import Path
-from app.services.pdf_service import PDFService
+from PIL import Image
+from app.services.pdf_service import PDFService, _styles
 import os
 
 class TestPDFService(unittest.TestCase):
@@ -26,5 +28,56 @@ class TestPDFService(unittest.TestCase):
             if output_path.exists():
                 os.remove(output_path)
 
+    def test_create_pdf_page_breaks(self):
+        service = PDFService()
+        blocks = [
+            {"type": "text", "text": "Page one"},
+            {"type": "page_break"},
+            {"type": "text", "text": "Page two"},
+        ]
+
+        output_path = Path("test_output.pdf")
+        try:
+            service.create_pdf(blocks, output_path)
+            self.assertEqual(output_path.read_bytes().count(b"/Type /Page\n"), 2)
+        finally:
+            if output_path.exists():
+                os.remove(output_path)
+
+    def test_create_document_embeds_downsampled_figures(self):
+        service = PDFService(figure_dpi=72)
+        figure_path = Path("test_figure.png")
+        Image.new("RGB", (3000, 2000), "red").save(figure_path)
+        output_path = Path("test_output.pdf")
+        try:
+            service.create_document([[
+                {"type": "text", "text": "Before & after <figure>"},
+                {"type": "figure", "text": "", "image_file": figure_path},
+            ]], output_path)
+            pdf = output_path.read_bytes()
+            self.assertIn(b"/Subtype /Image", pdf)
+            self.assertIn(b"/DCTDecode", pdf)
+            # Shrunk to the space it is drawn in at 72 dpi, not embedded at 3000 px
+            width = int(re.search(rb"/Width (\d+)", pdf).group(1))
+            self.assertLessEqual(width, 468)
+        finally:
+            for path in (figure_path, output_path):
+                if path.exists():
+                    os.remove(path)
+
+    def test_each_source_page_is_one_pdf_page(self):
+        service = PDFService()
+        long_page = [{"type": "text", "text": "A long line of text. " * 40} for _ in range(60)]
+        output_path = Path("test_output.pdf")
+        try:
+            service.create_document([long_page, [{"type": "figure", "text": "missing"}]], output_path)
+            self.assertEqual(output_path.read_bytes().count(b"/Type /Page\n"), 2)
+        finally:
+            if output_path.exists():
+                os.remove(output_path)
+
+    def test_styles_are_built_once(self):
+        self.assertIs(_styles(), _styles())
+
 if __name__ == "__main__":
     unittest.main()
@@ -0,0 +1,98 @@
+import threading
+import time
+import numpy as np
+from types import SimpleNamespace
+from app.services.pipeline import RecognitionBatcher, run_pipeline
+
+class FakeRecognizer:
+    def __init__(self, delay=0.0):
+        self.delay = delay
+        self.calls = []
+
+    def __call__(self, crops):
+        self.calls.append(len(crops))
+        time.sleep(self.delay)
+        # "Recognize" each crop as its width, so results can be traced back
+        return [(f"w{crop.shape[1]}", 0.9) for crop in crops], self.delay
+
+def crop(width):
+    return np.zeros((10, width, 3), dtype=np.uint8)
+
+def test_batcher_merges_concurrent_requests():
+    recognizer = FakeRecognizer()
+    batcher = RecognitionBatcher(recognizer, batch_size=64, max_wait_ms=200)
+    results = {}
+
+    def submit(name, widths):
+        results[name] = batcher.recognize([crop(w) for w in widths])[0]
+
+    threads = [threading.Thread(target=submit, args=(i, [10 * i + 1, 10 * i + 2])) for i in range(3)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+
+    assert recognizer.calls == [6]
+    for i in range(3):
+        assert [text for text, _ in results[i]] == [f"w{10 * i + 1}", f"w{10 * i + 2}"]
+
+def test_batcher_flushes_full_batches_without_waiting():
+    recognizer = FakeRecognizer()
+    batcher = RecognitionBatcher(recognizer, batch_size=2, max_wait_ms=5000)
+    t_start = time.perf_counter()
+    texts = batcher.recognize([crop(5), crop(6), crop(7)])[0]
+    assert time.perf_counter() - t_start < 1
+    assert [text for text, _ in texts] == ["w5", "w6", "w7"]
+
+def test_batcher_reports_recognizer_errors():
+    def broken(crops):
+        raise RuntimeError("predictor failed")
+
+    batcher = RecognitionBatcher(broken, max_wait_ms=0)
+    try:
+        batcher.recognize([crop(5)])
+    except RuntimeError as e:
+        assert str(e) == "predictor failed"
+    else:
+        raise AssertionError("expected the recognizer error")
+    assert batcher.recognize([]) == ([], 0.0)
+
+def box(x1, y1, x2, y2):
+    return np.array([[x1, y1], [x2, y1], [x2, y2], [x1, y2]], dtype=np.float32)
+
+def fake_engine(detections):
+    def text_detector(roi):
+        return detections.get(roi.shape[:2]), 0.01
+
+    return SimpleNamespace(
+        layout_predictor=lambda img: ([
+            {'bbox': [10, 20, 110, 70], 'label': 'text'},
+            {'bbox': [0, 100, 50, 150], 'label': 'table'},
+            {'bbox': [60, 100, 160, 180], 'label': 'figure'},
+        ], 0.1),
+        text_system=SimpleNamespace(text_detector=text_detector, use_angle_cls=False, drop_score=0.5),
+    )
+
+def test_pipeline_recognizes_all_lines_of_a_page_in_one_call():
+    engine = fake_engine({
+        (50, 100): np.stack([box(0, 25, 40, 35), box(0, 5, 30, 15)]),
+        (80, 100): np.stack([box(10, 10, 70, 20)]),
+    })
+    calls = []
+
+    def recognize(crops):
+        calls.append(len(crops))
+        return [(f"w{c.shape[1]}", 0.3 if c.shape[1] == 40 else 0.9) for c in crops], 0.2
+
+    regions, times = run_pipeline(engine, np.zeros((200, 200, 3), dtype=np.uint8), recognize)
+
+    assert calls == [3]
+    assert times == {'layout': 0.1, 'det': 0.02, 'rec': 0.2}
+    text, table, figure = regions
+    assert [r['type'] for r in regions] == ['text', 'table', 'figure']
+    # Lines in reading order, low-confidence lines dropped, boxes in page coordinates
+    assert [line['text'] for line in text['res']] == ['w30']
+    assert text['res'][0]['text_region'][0] == [10.0, 25.0]
+    assert table['res'] == ''
+    assert figure['res'][0]['text_region'][0] == [70.0, 110.0]
+    assert figure['img'].shape == (80, 100, 3)
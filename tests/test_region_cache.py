@@ -0,0 +1,104 @@
+import numpy as np
+import cv2
+from types import SimpleNamespace
+from app.services.pipeline import run_pipeline
+from app.services.region_cache import CachedTextSystem, RegionCache, fingerprint, matches
+
+def header(page_number, dx=0, dy=0, noise=0, seed=0):
+    img = np.full((60, 700, 3), 255, dtype=np.uint8)
+    cv2.putText(img, f"CHAPTER 3. THE WHALE          {page_number}", (20 + dx, 40 + dy),
+                cv2.FONT_HERSHEY_COMPLEX, 1.0, (0, 0, 0), 2, cv2.LINE_AA)
+    if noise:
+        img = np.clip(img + np.random.default_rng(seed).normal(0, noise, img.shape), 0, 255).astype(np.uint8)
+    return img
+
+def test_fingerprint_tolerates_noise_and_framing_but_not_a_new_page_number():
+    key = fingerprint(header(127), "paddle")
+    shifted = fingerprint(header(127, dx=7, dy=3, noise=12), "paddle")
+    assert shifted.origin == (key.origin[0] + 7, key.origin[1] + 3)
+    assert matches(key, shifted)
+    for page_number in (128, 137, 187, 227):
+        assert not matches(key, fingerprint(header(page_number), "paddle"))
+    assert not matches(key, fingerprint(header(127), "doctr"))
+    assert fingerprint(np.full((60, 700, 3), 250, dtype=np.uint8), "paddle") is None
+
+def test_cache_is_shared_through_its_file_and_evicts_least_recently_used(tmp_path):
+    first, second = RegionCache(tmp_path / "regions.sqlite3"), RegionCache(tmp_path / "regions.sqlite3", max_entries=2)
+    keys = [fingerprint(header(n), "paddle") for n in (1, 2, 3)]
+    first.put(keys[0], [([[0, 0], [10, 0], [10, 5], [0, 5]], "one", 0.9)])
+    assert second.get(keys[0]) == [[[[0, 0], [10, 0], [10, 5], [0, 5]], "one", 0.9]]
+    assert second.get(keys[1]) is None
+    second.put(keys[1], [])
+    second.put(keys[2], [])
+    assert second.stats()["entries"] == 2
+    assert first.get(keys[0]) is None and first.get(keys[2]) == []
+
+class FakeTextSystem:
+    drop_score = 0.5
+
+    def __init__(self):
+        self.calls = 0
+
+    def __call__(self, img, cls=True):
+        self.calls += 1
+        x, y, w, h = cv2.boundingRect(255 - img[:, :, 0])
+        return [np.array([[x, y], [x + w, y], [x + w, y + h], [x, y + h]], dtype=np.float32)], [("header", 0.9)], {}
+
+def test_text_system_answers_a_region_seen_before(tmp_path):
+    text_system = CachedTextSystem(FakeTextSystem(), RegionCache(tmp_path / "regions.sqlite3"))
+    boxes, rec_res, _ = text_system(header(127))
+    shifted_boxes, shifted_res, times = text_system(header(127, dx=5, noise=8))
+    assert text_system.text_system.calls == 1
+    assert (text_system.hits, text_system.misses) == (1, 1)
+    assert times["rec"] == 0.0 and shifted_res == rec_res == [("header", 0.9)]
+    assert np.allclose(shifted_boxes[0], boxes[0] + [5, 0], atol=1)
+    text_system(header(128))
+    assert text_system.text_system.calls == 2
+    assert text_system.drop_score == 0.5
+
+def test_pipeline_skips_detection_and_recognition_of_cached_regions(tmp_path):
+    detected = []
+
+    def text_detector(roi):
+        detected.append(roi.shape)
+        return np.array([[[0, 0], [30, 0], [30, 10], [0, 10]]], dtype=np.float32), 0.01
+
+    def page(page_number):
+        img = np.full((200, 800, 3), 255, dtype=np.uint8)
+        img[10:70, 50:750] = header(page_number)
+        return img
+
+    # The layout model frames the header a little differently on the next page
+    frames = iter([[50, 10, 750, 70], [48, 8, 752, 72], [48, 8, 752, 72]])
+    engine = SimpleNamespace(
+        layout_predictor=lambda img: ([{'bbox': next(frames), 'label': 'text'}], 0.1),
+        text_system=SimpleNamespace(text_detector=text_detector, use_angle_cls=False, drop_score=0.5),
+    )
+    cache = CachedTextSystem(engine.text_system, RegionCache(tmp_path / "regions.sqlite3"))
+    recognize = lambda crops: ([("header", 0.9)] * len(crops), 0.02)
+
+    run_pipeline(engine, page(127), recognize, cache)
+    regions, _ = run_pipeline(engine, page(127), recognize, cache)
+    assert len(detected) == 1
+    assert (cache.hits, cache.misses) == (1, 1)
+    assert regions[0]['res'] == [{'text': 'header', 'confidence': 0.9,
+                                  'text_region': [[50, 10], [80, 10], [80, 20], [50, 20]]}]
+    run_pipeline(engine, page(128), recognize, cache)
+    assert len(detected) == 2
+
+def test_only_page_furniture_is_stored_and_totals_follow_eviction(tmp_path):
+    class ParagraphSystem(FakeTextSystem):
+        def __call__(self, img, cls=True):
+            boxes, rec_res, times = super().__call__(img, cls)
+            return boxes * 3, rec_res * 3, times
+
+    cache = RegionCache(tmp_path / "regions.sqlite3", max_entries=200)
+    CachedTextSystem(ParagraphSystem(), cache)(header(5))
+    assert cache.stats()["entries"] == 0
+
+    for n in range(250):
+        cache.put(fingerprint(header(n), "paddle")._replace(bits=bytes([n % 256, n // 256])), [])
+    count, size = cache._db.execute("SELECT COUNT(*), SUM(size) FROM regions").fetchone()
+    assert cache.stats() == {"entries": count, "bytes": size}
+    assert 190 <= count <= 200
+    assert RegionCache(tmp_path / "regions.sqlite3").stats()["entries"] == count
@@ -0,0 +1,82 @@
+import os
+import time
+from app.services.result_cache import ResultCache
+
+RESULT = {
+    "meta": {"request_id": "req-1", "image": {"width": 10, "height": 10}, "timings_ms": {}},
+    "blocks": [{"id": "b1", "text": "Hello"}],
+    "figures": [],
+    "exports": {"annotated_image_path": None},
+}
+
+def test_key_depends_on_content_and_options():
+    key = ResultCache.make_key(b"image", ocr_engine="paddle", store_outputs=True)
+    assert key == ResultCache.make_key(b"image", store_outputs=True, ocr_engine="paddle")
+    assert key != ResultCache.make_key(b"other", ocr_engine="paddle", store_outputs=True)
+    assert key != ResultCache.make_key(b"image", ocr_engine="tesseract", store_outputs=True)
+
+def test_memory_hit_returns_private_copy():
+    cache = ResultCache(max_entries=4)
+    assert cache.get("k") is None
+    cache.put("k", RESULT)
+
+    first = cache.get("k")
+    first["blocks"].clear()
+    assert cache.get("k")["blocks"] == RESULT["blocks"]
+    assert cache.stats()["hits"] == 2
+    assert cache.stats()["misses"] == 1
+
+def test_memory_tier_is_lru():
+    cache = ResultCache(max_entries=2)
+    cache.put("a", RESULT)
+    cache.put("b", RESULT)
+    cache.get("a")
+    cache.put("c", RESULT)
+    assert cache.get("b") is None
+    assert cache.get("a") is not None
+    assert cache.get("c") is not None
+
+def test_entries_expire_after_ttl(tmp_path):
+    cache = ResultCache(max_entries=4, ttl_s=1, disk_dir=tmp_path)
+    cache.put("k", RESULT)
+    old = time.time() - 10
+    cache._memory["k"] = (old, cache._memory["k"][1])
+    cache._disk_index["k"] = (old, cache._disk_index["k"][1])
+    assert cache.get("k") is None
+    assert not list(tmp_path.glob("*/*.json"))
+
+def test_disk_tier_survives_restart(tmp_path):
+    ResultCache(max_entries=4, disk_dir=tmp_path).put("abcd", RESULT)
+
+    cache = ResultCache(max_entries=4, disk_dir=tmp_path)
+    assert cache.stats()["disk_entries"] == 1
+    assert cache.get("abcd") == RESULT
+
+def test_disk_tier_evicts_oldest_when_over_budget(tmp_path):
+    entry_size = len(__import__("json").dumps(RESULT))
+    cache = ResultCache(max_entries=0, disk_dir=tmp_path, disk_max_bytes=2 * entry_size)
+    for key in ("k1", "k2", "k3"):
+        cache.put(key, RESULT)
+
+    assert cache.get("k1") is None
+    assert cache.get("k2") is not None
+    assert cache.get("k3") is not None
+    assert cache.stats()["disk_bytes"] <= 2 * entry_size
+    assert len(os.listdir(tmp_path / "k1")) == 0
+
+def test_entries_of_another_instance_are_evicted_by_their_age(tmp_path):
+    entry_size = len(__import__("json").dumps(RESULT))
+    cache = ResultCache(max_entries=0, disk_dir=tmp_path, disk_max_bytes=2 * entry_size)
+    other = ResultCache(max_entries=0, disk_dir=tmp_path, disk_max_bytes=2 * entry_size)
+    other.put("k0", RESULT)
+    old = time.time() - 60
+    os.utime(tmp_path / "k0" / "k0.json", (old, old))
+    cache.put("k1", RESULT)
+
+    # Found on disk after k1 was stored, but older than it
+    assert cache.get("k0") == RESULT
+    cache.put("k2", RESULT)
+
+    assert list(cache._disk_index) == ["k1", "k2"]
+    assert not (tmp_path / "k0" / "k0.json").exists()
+    assert cache.get("k1") is not None
@@ -0,0 +1,65 @@
+import re
+import zlib
+import cv2
+import numpy as np
+import pytest
+from app.services.searchable_pdf import SearchablePDFWriter, embeddable_jpeg, line_boxes
+
+def page_data(width, height, blocks):
+    return {"meta": {"image": {"width": width, "height": height}}, "blocks": blocks}
+
+def encode(ext, width=400, height=300):
+    return cv2.imencode(ext, np.full((height, width, 3), 255, np.uint8))[1].tobytes()
+
+def content_streams(pdf):
+    return [zlib.decompress(m) for m in re.findall(rb"/FlateDecode /Length \d+ >>\nstream\n(.*?)\nendstream", pdf, re.S)]
+
+def test_jpeg_uploads_are_embedded_unchanged(tmp_path):
+    jpeg = encode(".jpg")
+    output = tmp_path / "out.pdf"
+    with SearchablePDFWriter(output) as writer:
+        writer.add_page(jpeg, page_data(400, 300, []))
+    pdf = output.read_bytes()
+    assert jpeg in pdf
+    assert b"/DCTDecode" in pdf
+    assert pdf.rstrip().endswith(b"%%EOF")
+
+def test_other_images_are_encoded_as_jpeg(tmp_path):
+    output = tmp_path / "out.pdf"
+    with SearchablePDFWriter(output) as writer:
+        writer.add_page(encode(".png"), page_data(400, 300, []))
+    assert b"/DCTDecode" in output.read_bytes()
+
+def test_rotated_or_resized_jpegs_are_not_passed_through():
+    jpeg = encode(".jpg")
+    assert embeddable_jpeg(jpeg, 400, 300) == (jpeg, "/DeviceRGB")
+    assert embeddable_jpeg(jpeg, 300, 400) is None
+    assert embeddable_jpeg(encode(".png"), 400, 300) is None
+
+def test_text_layer_is_invisible_and_placed_on_the_lines(tmp_path):
+    output = tmp_path / "out.pdf"
+    blocks = [{"type": "text", "bbox": [30, 30, 330, 90], "text": "Hello (world)\nSecond",
+               "lines": [{"text": "Hello (world)", "bbox": [30, 30, 330, 60]},
+                         {"text": "Second", "bbox": [0, 0, 0, 0]}]}]
+    with SearchablePDFWriter(output, dpi=72) as writer:
+        writer.add_page(encode(".jpg"), page_data(400, 300, blocks))
+        writer.add_page(encode(".jpg"), page_data(400, 300, []))
+    pdf = output.read_bytes()
+    assert pdf.count(b"/Type /Page ") == 2
+    content = content_streams(pdf)[0]
+    assert b"3 Tr" in content
+    assert b"(Hello \\(world\\)) Tj" in content
+    # At 72 dpi one pixel is one point; PDF y runs up from the bottom of the page
+    assert re.search(rb"1 0 0 1 30\.00 24\d\.\d\d Tm \(Hello", content)
+
+def test_lines_without_boxes_share_the_block_box():
+    block = {"bbox": [0, 0, 100, 40], "text": "a\nb",
+             "lines": [{"text": "a", "bbox": [0, 0, 0, 0]}, {"text": "b", "bbox": [0, 0, 0, 0]}]}
+    assert line_boxes(block) == [("a", [0, 0, 100, 20]), ("b", [0, 20, 100, 40])]
+
+def test_failed_export_leaves_no_file(tmp_path):
+    output = tmp_path / "out.pdf"
+    with pytest.raises(ValueError):
+        with SearchablePDFWriter(output) as writer:
+            writer.add_page(b"not an image", page_data(10, 10, []))
+    assert not output.exists()
@@ -0,0 +1,66 @@
+import asyncio
+import gzip
+import json
+import pytest
+from app.services import serialization
+from app.services.serialization import (
+    InvalidFieldsError, negotiate_encoding, parse_fields, render, shape_events, shape_page,
+)
+from app.services.streaming import page_events
+
+PAGE = {
+    "meta": {"request_id": "r1", "timings_ms": {"ocr": 5}},
+    "blocks": [
+        {"id": "b1", "type": "text", "text": "one", "lines": [{"bbox": [0, 0, 1, 1], "text": "one"}]},
+        {"id": "b2", "type": "figure", "text": "", "lines": []},
+    ],
+    "figures": [{"id": "f1", "bbox": [0, 0, 5, 5]}],
+    "exports": {"annotated_image_path": None},
+}
+
+def test_fields_project_the_page_and_leave_it_intact():
+    tree = parse_fields("blocks.text, figures, meta.request_id, blocks.id")
+    assert shape_page(PAGE, tree, include_lines=True) == {
+        "blocks": [{"text": "one", "id": "b1"}, {"text": "", "id": "b2"}],
+        "figures": [{"id": "f1", "bbox": [0, 0, 5, 5]}],
+        "meta": {"request_id": "r1"},
+    }
+    assert [list(block) for block in shape_page(PAGE, None, include_lines=False)["blocks"]] == [
+        ["id", "type", "text"], ["id", "type", "text"]
+    ]
+    assert shape_page(PAGE, None, include_lines=True) is PAGE and "lines" in PAGE["blocks"][0]
+    assert parse_fields("blocks.text,blocks") == {"blocks": True} and parse_fields(" ") is None
+    for fields in ("pages", "blocks..text", "blocks,"):
+        with pytest.raises(InvalidFieldsError):
+            parse_fields(fields)
+
+def test_streamed_events_are_shaped_like_the_page():
+    async def events():
+        for event in page_events(PAGE):
+            yield event
+
+    async def collect():
+        return [event async for event in shape_events(events(), parse_fields("blocks.id,meta.request_id"), False)]
+
+    assert asyncio.run(collect()) == [
+        {"type": "block", "data": {"id": "b1"}},
+        {"type": "block", "data": {"id": "b2"}},
+        {"type": "meta", "data": {"meta": {"request_id": "r1"}}},
+    ]
+
+def test_large_bodies_are_compressed_for_clients_that_accept_it(monkeypatch):
+    monkeypatch.setattr(serialization, "brotli", None)
+    assert negotiate_encoding("gzip, deflate, br") == "gzip"
+    assert negotiate_encoding("gzip;q=0, identity") is None
+    response = render(PAGE, accept_encoding="gzip", compress_min_bytes=100)
+    assert response.headers["content-encoding"] == "gzip" and response.media_type == "application/json"
+    assert json.loads(gzip.decompress(response.body)) == PAGE
+    assert "content-encoding" not in render(PAGE, accept_encoding="gzip", compress_min_bytes=10_000).headers
+    assert "content-encoding" not in render(PAGE, accept_encoding="gzip", compress_min_bytes=0).headers
+
+def test_messagepack_when_asked_for():
+    msgpack = pytest.importorskip("msgpack")
+    response = render(PAGE, accept="application/msgpack, application/json")
+    assert response.media_type == "application/msgpack"
+    assert msgpack.unpackb(response.body) == PAGE
+    assert render(PAGE, accept="application/json, application/msgpack").media_type == "application/json"
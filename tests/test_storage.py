@@ -0,0 +1,109 @@
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+from starlette.applications import Starlette
+from starlette.testclient import TestClient
+from app.services.artifacts import MARKER_LEASE_S
+from app.services.storage import INPUT_GRACE_S, ShardedStaticFiles, StorageManager
+
+RID_1 = "3fa85f64-5717-4562-b3fc-2c963f66afa6"
+RID_2 = "7c9e6679-7425-40de-944b-e07fc1f90ae7"
+RID_3 = "9b2d4a1e-0f3c-4e5b-8a7d-1c2e3f4a5b6c"
+
+def make_request(storage, request_id, size, age_s, now):
+    request_dir = storage.request_dir(request_id)
+    request_dir.mkdir(parents=True)
+    (request_dir / "annotated.png").write_bytes(b"x" * size)
+    os.utime(request_dir, (now - age_s, now - age_s))
+    return request_dir
+
+def test_request_dirs_are_sharded_and_legacy_dirs_still_found(tmp_path):
+    storage = StorageManager(tmp_path)
+    assert storage.request_dir(RID_1) == tmp_path / "3f" / RID_1
+    (tmp_path / RID_2).mkdir()
+    assert storage.request_dir(RID_2) == tmp_path / RID_2
+
+def test_identical_inputs_are_stored_once(tmp_path):
+    storage = StorageManager(tmp_path)
+    paths = []
+    for request_id in (RID_1, RID_2):
+        request_dir = storage.request_dir(request_id)
+        request_dir.mkdir(parents=True)
+        paths.append(request_dir / "input_page.png")
+        storage.store_input(paths[-1], b"same image")
+    assert os.path.samefile(*paths)
+    assert paths[0].read_bytes() == b"same image"
+    assert os.stat(paths[0]).st_nlink == 3  # the blob and both requests
+
+def test_sweep_evicts_expired_then_oldest_over_quota(tmp_path):
+    now = time.time()
+    storage = StorageManager(tmp_path, ttl_s=3600, max_bytes=150)
+    expired = make_request(storage, RID_1, 100, 7200, now)
+    oldest = make_request(storage, RID_2, 100, 600, now)
+    newest = make_request(storage, RID_3, 100, 60, now)
+
+    stats = storage.sweep(now)
+
+    assert not expired.exists() and not oldest.exists()
+    assert newest.exists()
+    assert stats == {"removed": 2, "freed_bytes": 200, "total_bytes": 100}
+
+def test_sweep_keeps_protected_and_pending_dirs(tmp_path):
+    now = time.time()
+    storage = StorageManager(tmp_path, ttl_s=3600, protect=lambda request_id: request_id == RID_1)
+    job_dir = make_request(storage, RID_1, 10, 7200, now)
+    writing = make_request(storage, RID_2, 10, 7200, now)
+    (writing / f".pending.{os.getpid()}").touch()
+    os.utime(writing, (now - 7200, now - 7200))
+    (tmp_path / "_cache").mkdir()
+
+    assert storage.sweep(now)["removed"] == 0
+    assert job_dir.exists() and writing.exists() and (tmp_path / "_cache").exists()
+
+def test_sweep_drops_inputs_no_request_links_to(tmp_path):
+    storage = StorageManager(tmp_path, ttl_s=60)
+    request_dir = storage.request_dir(RID_1)
+    request_dir.mkdir(parents=True)
+    storage.store_input(request_dir / "input.png", b"img")
+    later = time.time() + INPUT_GRACE_S + 61
+
+    storage.sweep(later)  # expires the request, orphaning its input
+    assert not request_dir.exists()
+    assert [p for p in (tmp_path / "_inputs").rglob("*") if p.is_file()] == []
+
+def test_static_files_serve_request_urls_from_shards(tmp_path):
+    storage = StorageManager(tmp_path)
+    request_dir = storage.request_dir(RID_1)
+    request_dir.mkdir(parents=True)
+    (request_dir / "annotated.png").write_bytes(b"png")
+    app = Starlette()
+    app.mount("/outputs", ShardedStaticFiles(storage), name="outputs")
+
+    client = TestClient(app)
+    assert client.get(f"/outputs/{RID_1}/annotated.png").content == b"png"
+    assert client.get(f"/outputs/{RID_2}/annotated.png").status_code == 404
+
+def test_identical_uploads_stored_at_once_share_one_input(tmp_path):
+    storage = StorageManager(tmp_path)
+    request_dir = storage.request_dir(RID_1)
+    request_dir.mkdir(parents=True)
+    with ThreadPoolExecutor(8) as pool:
+        for upload in range(20):
+            data = f"page {upload}".encode() * 100000
+            targets = [request_dir / f"input_{upload}_{index}.png" for index in range(8)]
+            list(pool.map(lambda path: storage.store_input(path, data), targets))
+            assert all(path.read_bytes() == data for path in targets)
+    assert len([p for p in (tmp_path / "_inputs").rglob("*") if p.is_file()]) == 20
+
+def test_sweep_evicts_dirs_whose_writer_died(tmp_path):
+    now = time.time()
+    storage = StorageManager(tmp_path, ttl_s=3600)
+    abandoned = make_request(storage, RID_1, 10, 7200, now)
+    marker = abandoned / ".pending.worker-1-7"
+    marker.touch()
+    stale = now - MARKER_LEASE_S - 1
+    os.utime(marker, (stale, stale))
+    os.utime(abandoned, (now - 7200, now - 7200))
+
+    assert storage.sweep(now)["removed"] == 1
+    assert not abandoned.exists()
@@ -0,0 +1,37 @@
+import json
+import pytest
+from app.services.streaming import (
+    NDJSON_MEDIA_TYPE, SSE_MEDIA_TYPE, collect_page, encode_event, negotiate_stream_format, page_events
+)
+
+RESPONSE = {
+    "meta": {"request_id": "req-1", "image": {"width": 10, "height": 10}, "timings_ms": {}},
+    "blocks": [{"id": "b1", "text": "Hello"}, {"id": "b2", "text": "World"}],
+    "figures": [{"id": "f1", "image_path": ""}],
+    "exports": {"annotated_image_path": None},
+}
+
+@pytest.mark.parametrize("accept, expected", [
+    (None, None),
+    ("application/json", None),
+    ("*/*", None),
+    ("application/x-ndjson", NDJSON_MEDIA_TYPE),
+    ("application/jsonl", NDJSON_MEDIA_TYPE),
+    ("text/html, text/event-stream;q=0.9", SSE_MEDIA_TYPE),
+])
+def test_negotiate_stream_format(accept, expected):
+    assert negotiate_stream_format(accept) == expected
+
+def test_page_events_round_trip():
+    events = page_events(RESPONSE)
+    assert [e["type"] for e in events] == ["block", "block", "figure", "meta"]
+    assert collect_page(events) == RESPONSE
+
+def test_collect_page_requires_meta():
+    with pytest.raises(ValueError):
+        collect_page([{"type": "block", "data": {}}])
+
+def test_encode_event():
+    event = {"type": "block", "data": {"id": "b1"}}
+    assert json.loads(encode_event(NDJSON_MEDIA_TYPE, event)) == event
+    assert encode_event(SSE_MEDIA_TYPE, event) == b'event: block\ndata: {"id": "b1"}\n\n'
@@ -0,0 +1,110 @@
+import asyncio
+import numpy as np
+from unittest.mock import patch
+from app.services.extraction import ExtractionService
+from app.services.tiling import merge_tiles, plan_inference, plan_tiles, run_tiles
+
+def line(text, x1, y1, x2, y2, confidence=0.9):
+    return {'text': text, 'confidence': confidence, 'text_region': [[x1, y1], [x2, y1], [x2, y2], [x1, y2]]}
+
+def test_tiles_cover_the_page_with_overlap():
+    tiles = plan_tiles(2500, 1000, tile_size=1024, overlap=256)
+    assert tiles == [(0, 0, 1024, 1000), (738, 0, 1024, 1000), (1476, 0, 1024, 1000)]
+    assert plan_tiles(800, 600, tile_size=1024, overlap=256) == [(0, 0, 800, 600)]
+
+def test_large_pages_are_tiled_instead_of_shrunk():
+    page = np.zeros((3000, 2000, 3), dtype=np.uint8)
+    assert plan_inference(page, max_side=1500) == (0.5, False)
+    assert plan_inference(page, max_side=1500, tile_size=2048) == (1.0, True)
+    assert plan_inference(page, max_side=1500, tile_size=4096) == (0.5, False)
+
+def test_regions_seen_from_two_tiles_are_merged():
+    # Two 100 px tiles overlapping on x 60..100; a line crosses the border
+    # and a short region lies entirely in the overlap
+    left = [
+        {'type': 'text', 'bbox': [10, 10, 100, 30], 'score': 0.8,
+         'res': [line('the quick bro', 10, 10, 100, 20)]},
+        {'type': 'title', 'bbox': [70, 50, 90, 60], 'score': 0.9, 'res': [line('Title', 70, 50, 90, 60)]},
+    ]
+    right = [
+        {'type': 'text', 'bbox': [0, 10, 90, 30], 'score': 0.7,
+         'res': [line('k brown fox', 0, 10, 90, 20)]},
+        {'type': 'title', 'bbox': [10, 50, 30, 60], 'score': 0.6, 'res': [line('Tit1e', 10, 50, 30, 60, 0.5)]},
+    ]
+    merged = merge_tiles([((0, 0, 100, 80), left), ((60, 0, 100, 80), right)], 160, 80)
+
+    assert len(merged) == 2
+    text, title = sorted(merged, key=lambda region: region['bbox'][1])
+    assert text['bbox'] == [10, 10, 150, 30]
+    assert text['score'] == 0.8
+    assert [l['text'] for l in text['res']] == ['the quick brown fox']
+    assert text['res'][0]['text_region'] == [[10, 10], [150, 10], [150, 20], [10, 20]]
+    assert title['bbox'] == [70, 50, 90, 60]
+    assert [l['text'] for l in title['res']] == ['Title']
+
+def test_complete_line_wins_over_its_cut_copy():
+    # The lower tile sees the whole paragraph; the upper one only its first line, cut off
+    top = [{'type': 'text', 'bbox': [10, 70, 90, 100], 'res': [line('first lin', 10, 90, 90, 100)]}]
+    bottom = [{'type': 'text', 'bbox': [10, 10, 90, 50], 'res': [
+        line('first line', 10, 30, 90, 40), line('second line', 10, 42, 90, 50),
+    ]}]
+    merged = merge_tiles([((0, 0, 100, 100), top), ((0, 60, 100, 100), bottom)], 100, 160)
+    assert len(merged) == 1
+    assert [l['text'] for l in merged[0]['res']] == ['first line', 'second line']
+
+class ServicePool:
+    """Runs calls on one service, as an engine pool's workers would."""
+    workers = 2
+
+    def __init__(self, service):
+        self.service = service
+
+    async def run(self, method, wait_for_slot=False, profile_path=None, **kwargs):
+        return getattr(self.service, method)(**kwargs), {"queue_depth": 0, "queue_wait": 0.0}
+
+def test_tiles_run_on_the_service_and_cut_lines_are_joined():
+    def engine(tile):
+        # One region per tile, a line cut by the vertical border where it touches it
+        h, w = tile.shape[:2]
+        text = 'left half of' if tile[0, -1, 0] == 0 else 'half of the line'
+        return [{'type': 'text', 'bbox': [0, 10, w, 30], 'res': [line(text, 0, 10, w, 30)], 'img': tile[10:30]}]
+
+    with patch('app.services.extraction.PPStructure') as MockClass:
+        MockClass.return_value.side_effect = engine
+        service = ExtractionService()
+        page = np.zeros((100, 200, 3), dtype=np.uint8)
+        page[:, 120:] = 1
+        tiles = plan_tiles(200, 100, tile_size=120, overlap=40)
+        regions, _, _ = asyncio.run(run_tiles(ServicePool(service), page, tiles, "paddle", "paddle"))
+
+    assert MockClass.return_value.call_count == 2
+    assert all('img' not in region for region in regions)
+    [region] = regions
+    assert region['bbox'] == [0, 10, 200, 30]
+    assert [entry['text'] for entry in region['res']] == ["left half of the line"]
+
+class FakePool:
+    workers = 2
+
+    def __init__(self):
+        self.running = 0
+        self.peak = 0
+
+    async def run(self, method, wait_for_slot=False, profile_path=None, **kwargs):
+        self.running += 1
+        self.peak = max(self.peak, self.running)
+        await asyncio.sleep(0.01)
+        self.running -= 1
+        tile = np.frombuffer(kwargs["pixels"], np.uint8).reshape(kwargs["shape"])
+        regions = [{'type': 'figure', 'bbox': [0, 0, tile.shape[1], tile.shape[0]], 'res': []}]
+        return (regions, {"layout": 0.1, "det": 0.0, "rec": 0.0}), {"queue_depth": 1, "queue_wait": 0.5}
+
+def test_tiles_run_on_the_pool_one_per_worker_at_a_time():
+    pool = FakePool()
+    page = np.zeros((100, 300, 3), dtype=np.uint8)
+    tiles = plan_tiles(300, 100, tile_size=100, overlap=20)
+    regions, engine_times, stats = asyncio.run(run_tiles(pool, page, tiles, "paddle", "paddle"))
+    assert len(tiles) == 4 and pool.peak == 2
+    assert [region['bbox'] for region in regions] == [[0, 0, 300, 100]]
+    assert engine_times == {"layout": 0.4, "det": 0.0, "rec": 0.0}
+    assert stats == {"queue_depth": 1, "queue_wait": 0.5}
@@ -0,0 +1,73 @@
+import numpy as np
+import cv2
+from unittest.mock import patch
+from app.services.extraction import ExtractionService
+from app.services.triage import triage_page
+
+def paper(height=1400, width=1000, seed=0):
+    page = np.full((height, width, 3), 240, dtype=np.float64)
+    page += np.random.default_rng(seed).normal(0, 4, page.shape)
+    return page.clip(0, 255).astype(np.uint8)
+
+def write(page, text, x, y, scale=0.8, color=(20, 20, 20)):
+    cv2.putText(page, text, (x, y), cv2.FONT_HERSHEY_SIMPLEX, scale, color, 2, cv2.LINE_AA)
+
+def photo(page, x1, y1, x2, y2):
+    yy, xx = np.mgrid[y1:y2, x1:x2]
+    page[y1:y2, x1:x2] = (120 + 90 * np.sin(xx / 37.0) * np.cos(yy / 53.0))[..., None]
+
+def test_blank_pages_with_show_through_dust_and_a_dark_border():
+    page = paper()
+    for y in range(100, 1300, 40):
+        write(page, "faint text from the other side", 80, y, color=(210, 210, 210))
+    for x, y in np.random.default_rng(1).integers(50, 950, (40, 2)):
+        page[y:y + 2, x:x + 2] = 30
+    page[:, :15] = 10
+    triage = triage_page(page)
+    assert triage.decision == "blank" and triage.regions == []
+    assert triage.text_components == 0 and triage.ink_ratio < 0.002
+
+def test_figure_only_page_is_one_figure_around_the_picture():
+    page = paper()
+    photo(page, 150, 300, 850, 1000)
+    triage = triage_page(page)
+    assert triage.decision == "figure"
+    [figure] = triage.regions
+    assert figure["type"] == "figure" and figure["res"] == []
+    assert np.allclose(figure["bbox"], [150, 300, 850, 1000], atol=6)
+
+def test_text_or_a_caption_sends_the_page_to_the_engines():
+    page = paper()
+    for y in range(100, 1300, 40):
+        write(page, "body text of the page, line after line", 80, y)
+    assert triage_page(page).decision == "text"
+
+    captioned = paper()
+    photo(captioned, 150, 300, 850, 1000)
+    write(captioned, "Plate 4. The harbour at dawn", 150, 1040)
+    assert triage_page(captioned).decision == "text"
+
+def test_service_skips_the_engines_on_triaged_pages(tmp_path):
+    with patch('app.services.extraction.PPStructure') as MockClass:
+        MockClass.return_value.return_value = []
+        service = ExtractionService()
+        extract = lambda page, triage: service.run_extraction(
+            image_bytes=cv2.imencode('.png', page)[1].tobytes(), request_id="req-triage", output_dir=tmp_path,
+            store_outputs=True, return_annotated=False, triage=triage
+        )
+        blank = extract(paper(), True)
+        figure_page = paper()
+        photo(figure_page, 150, 300, 850, 1000)
+        figure = extract(figure_page, True)
+        assert MockClass.return_value.call_count == 0
+
+        untriaged = extract(paper(), False)
+        assert MockClass.return_value.call_count == 1
+
+    assert blank["blocks"] == [] and blank["figures"] == []
+    assert blank["meta"]["triage"]["decision"] == "blank"
+    assert blank["meta"]["timings_ms"]["layout"] == blank["meta"]["timings_ms"]["ocr"] == 0
+    assert [block["type"] for block in figure["blocks"]] == ["figure"]
+    assert figure["figures"][0]["image_path"] == "/outputs/req-triage/f1_figure.png"
+    assert figure["meta"]["triage"]["decision"] == "figure"
+    assert "triage" not in untriaged["meta"]
@@ -0,0 +1,71 @@
+import io
+import tempfile
+import pytest
+from fastapi import FastAPI, File, UploadFile
+from fastapi.testclient import TestClient
+from PIL import Image
+from app.services.image_ingest import probe_image
+from app.services.uploads import BodySizeLimitMiddleware, UploadTooLargeError, read_upload
+
+def spooled(data, max_size=16):
+    spool = tempfile.SpooledTemporaryFile(max_size=max_size)
+    spool.write(data)
+    return spool
+
+def test_read_upload_returns_one_read_only_buffer():
+    data = bytes(range(256)) * 10
+    view = read_upload(spooled(data), max_bytes=len(data), chunk_size=100)
+    assert isinstance(view, memoryview) and view.readonly
+    assert view == data
+
+class Python310Spool:
+    """A SpooledTemporaryFile as Python 3.10 has it, without readinto."""
+
+    def __init__(self, spool):
+        self.seek, self.read = spool.seek, spool.read
+
+def test_read_upload_reads_spooled_files_without_readinto():
+    data = bytes(range(256)) * 10
+    for max_size in (16, len(data) + 1):
+        view = read_upload(Python310Spool(spooled(data, max_size)), max_bytes=len(data), chunk_size=100)
+        assert view.readonly and view == data
+
+def test_read_upload_rejects_oversized_files_before_reading():
+    upload = spooled(b"x" * 101)
+    with pytest.raises(UploadTooLargeError) as excinfo:
+        read_upload(upload, max_bytes=100)
+    assert excinfo.value.max_bytes == 100
+    assert upload.tell() == 101
+    assert read_upload(spooled(b"x" * 101), max_bytes=0) == b"x" * 101
+
+def test_image_header_is_probed_from_a_memoryview():
+    buf = io.BytesIO()
+    Image.new("RGB", (30, 20)).save(buf, format="PNG")
+    assert probe_image(memoryview(buf.getvalue()).toreadonly()) == (30, 20)
+
+def make_client(limit):
+    app = FastAPI()
+
+    @app.post("/upload")
+    async def upload(file: UploadFile = File(...)):
+        return {"size": len(await file.read())}
+
+    app.add_middleware(BodySizeLimitMiddleware, limits={"/upload": limit})
+    return TestClient(app)
+
+def test_body_limit_rejects_declared_and_streamed_bodies():
+    client = make_client(2000)
+    assert client.post("/upload", files={"file": ("a.png", b"x" * 1000, "image/png")}).json() == {"size": 1000}
+
+    response = client.post("/upload", files={"file": ("a.png", b"x" * 3000, "image/png")})
+    assert response.status_code == 413
+    assert response.json() == {"detail": "Request body exceeds the limit of 2000 bytes."}
+
+    def chunked():
+        yield b'--b\r\nContent-Disposition: form-data; name="file"; filename="a.png"\r\n\r\n'
+        for _ in range(3):
+            yield b"x" * 1000
+        yield b"\r\n--b--\r\n"
+
+    response = client.post("/upload", content=chunked(), headers={"content-type": "multipart/form-data; boundary=b"})
+    assert response.status_code == 413
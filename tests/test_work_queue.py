@@ -0,0 +1,132 @@
+import asyncio
+import time
+import pytest
+from app.services.engine_pool import EngineCrashedError, RemoteEnginePool, ThreadEnginePool
+from app.services.work_queue import QueueConsumer, WorkQueue, options_key
+
+class FakeService:
+    def run_extraction(self, image_bytes, request_id):
+        if request_id == "bad":
+            raise ValueError("Invalid image file.")
+        return {"request_id": request_id, "size": len(image_bytes)}
+
+    def iter_events(self, count):
+        for index in range(count):
+            yield {"type": "block", "index": index}
+
+    def crash(self):
+        raise EngineCrashedError("Engine worker process crashed")
+
+def test_tasks_are_leased_in_order_to_nodes_with_the_same_options(tmp_path):
+    queue = WorkQueue(tmp_path / "tasks.sqlite3")
+    first = queue.put("a", "run_extraction", {"image_bytes": memoryview(b"png"), "request_id": "r1"})
+    queue.put("b", "run_extraction", {"request_id": "other options"})
+    second = queue.put("a", "iter_events", {"count": 2}, collect=True)
+
+    task = queue.claim("node-1", "a")
+    assert task.id == first and task.kwargs == {"image_bytes": b"png", "request_id": "r1"} and task.attempts == 1
+    assert queue.claim("node-2", "a").id == second
+    assert queue.claim("node-2", "a") is None
+
+    assert queue.take([first, second]) == []
+    assert queue.complete(first, "node-1", {"ok": True}, run_s=0.5)
+    [done] = queue.take([first, second])
+    assert (done.id, done.status, done.value, done.run_s) == (first, "done", {"ok": True}, 0.5)
+    # Taken results are gone
+    assert queue.take([first]) == []
+    assert queue.stats() == {"queued": 1, "running": 1}
+
+def test_work_of_a_dead_node_is_retried_then_abandoned(tmp_path):
+    queue = WorkQueue(tmp_path / "tasks.sqlite3", lease_s=0.2, max_attempts=2)
+    task_id = queue.put("a", "run_extraction", {"request_id": "r1"})
+    assert queue.claim("dead", "a").attempts == 1
+    assert queue.claim("alive", "a") is None
+
+    time.sleep(0.25)
+    retry = queue.claim("alive", "a")
+    assert (retry.id, retry.attempts) == (task_id, 2)
+    # The first node coming back late does not overwrite the retry
+    assert not queue.complete(task_id, "dead", {"from": "dead"}, run_s=1)
+
+    time.sleep(0.25)
+    assert queue.claim("third", "a") is None
+    [abandoned] = queue.take([task_id])
+    assert abandoned.status == "abandoned" and abandoned.value is None
+
+def test_heartbeats_keep_leases_and_leaving_hands_work_back(tmp_path):
+    queue = WorkQueue(tmp_path / "tasks.sqlite3", lease_s=0.3)
+    task_id = queue.put("a", "run_extraction", {"request_id": "r1"})
+    queue.claim("node-1", "a")
+    for _ in range(3):
+        time.sleep(0.15)
+        queue.heartbeat("node-1", "a", slots=2, report=[{"load_ms": 1}])
+        assert queue.claim("node-2", "a") is None
+    assert queue.fleet("a") == [{"node": "node-1", "slots": 2, "workers": [{"load_ms": 1}]}]
+    assert queue.fleet("b") == []
+
+    queue.leave("node-1")
+    assert queue.fleet("a") == []
+    # Handed back without spending an attempt
+    assert queue.claim("node-2", "a").attempts == 1
+    assert queue.fail(task_id, "node-2", ValueError("Invalid image file."))
+    [failed] = queue.take([task_id])
+    assert isinstance(failed.value, ValueError) and str(failed.value) == "Invalid image file."
+
+def test_remote_pool_runs_calls_on_worker_nodes(tmp_path):
+    queue = WorkQueue(tmp_path / "tasks.sqlite3", lease_s=1)
+    options = options_key({"max_side": 2560})
+    remote = RemoteEnginePool(queue, options, queue_size=4)
+    local = ThreadEnginePool(workers=2, queue_size=0, service_factory=FakeService)
+    node = QueueConsumer(queue, local, options)
+
+    async def go():
+        await node.start()
+        try:
+            fleet = await asyncio.wait_for(remote.warmup(), timeout=5)
+            assert remote.workers == 2 and remote.capacity == 6
+            result, stats = await remote.run("run_extraction", image_bytes=memoryview(b"image"), request_id="r1")
+            events = [event async for event in remote.stream("iter_events", count=3)]
+            with pytest.raises(ValueError, match="Invalid image file"):
+                await remote.run("run_extraction", image_bytes=b"", request_id="bad")
+            with pytest.raises(EngineCrashedError):
+                await remote.run("crash")
+            return fleet, result, stats, events
+        finally:
+            await node.stop()
+
+    try:
+        fleet, result, stats, events = asyncio.run(go())
+    finally:
+        remote.shutdown()
+        local.shutdown()
+
+    assert [(n["node"], n["slots"]) for n in fleet] == [(node.worker_id, 2)]
+    assert result == {"request_id": "r1", "size": 5}
+    assert set(stats) == {"queue_depth", "queue_wait"}
+    assert [event["index"] for event in events] == [0, 1, 2]
+    assert queue.stats() == {}
+
+def test_callers_waiting_for_a_slot_are_admitted_when_worker_nodes_join(tmp_path):
+    queue = WorkQueue(tmp_path / "tasks.sqlite3", lease_s=5)
+    remote = RemoteEnginePool(queue, "a", queue_size=0)
+
+    async def go():
+        first = asyncio.create_task(remote.run("run_extraction", request_id="r1"))
+        await asyncio.sleep(0.1)
+        second = asyncio.create_task(remote.run("run_extraction", wait_for_slot=True, request_id="r2"))
+        await asyncio.sleep(0.1)
+        assert remote.in_flight == 1 and remote.capacity == 1
+        queue.heartbeat("node-1", "a", slots=2, report=[])
+        for _ in range(100):
+            if remote.in_flight == 2:
+                break
+            await asyncio.sleep(0.05)
+        admitted = remote.in_flight, remote.capacity
+        for task in (first, second):
+            task.cancel()
+        return admitted
+
+    try:
+        assert asyncio.run(go()) == (2, 2)
+    finally:
+        remote.shutdown()